@@ -0,0 +1,146 @@
+"""
+A NumPy backtesting engine, with the same (hard) trading rules as the simulator in `trader.build_env_step`.
+
+The TF simulator is built for training: Every order execution is a `softops` threshold, with soft gradients.
+When replaying a trained trader, none of that is needed, and thousands of portfolios can be evaluated at once on the CPU.
+"""
+import numpy as np
+from market import *
+
+def softmax(x, axis):
+    """
+    Same as `tf.nn.softmax`
+    """
+    e = np.exp(x - np.max(x, axis=axis, keepdims=True))
+    return e / np.sum(e, axis=axis, keepdims=True)
+
+def gte(a, b):
+    """
+    Hard value of `softops.gte(a, b, percent=True)`
+    """
+    return (np.log(a / b) >= 0).astype(np.float32)
+
+def lte(a, b):
+    """
+    Hard value of `softops.lte(a, b, percent=True)`
+    """
+    return (np.log(a / b) <= 0).astype(np.float32)
+
+def positive(x):
+    """
+    Hard value of `softops.positive(x)`
+    """
+    return np.maximum(np.float32(0), np.minimum(np.float32(1), x))
+
+def backtest_step(money, stocks, order_prices, buy_amount, next_day_data, sell_low=False):
+    """
+    Executes the orders of a single day.
+
+    Arguments:
+    - money: array[portfolio, money_settle_time], the money available today, tomorrow, etc
+    - stocks: array[portfolio, company], the number of stocks owned
+    - order_prices: array[portfolio, company, response] -> [sell_low_price, sell_high_price, buy_price]
+    - buy_amount: array[portfolio, company], trader output, normalized with a softmax over the companies (like the simulator)
+    - next_day_data: array[portfolio, company, feature], the market data of the day the orders are executed
+    - sell_low: Executes sell-low orders. They are disabled in `build_env_step`, so this is off by default.
+
+    Returns: (next_money, next_stocks)
+    """
+    sell_low_price  = order_prices[:, :, RESPONSE_SELL_LOW]
+    sell_high_price = order_prices[:, :, RESPONSE_SELL_HIGH]
+    buy_price       = order_prices[:, :, RESPONSE_BUY_PRICE]
+    current_money   = money[:, MONEY_TODAY]
+    buy_amount = softmax(buy_amount, axis=1)
+
+    # Executes SELL transactions if prices reaches BELOW a threshold (minimize losses)
+    # (If the day opens below the threshold for LOW SELL, use the open price)
+    sell_low_price = np.minimum(next_day_data[:, :, FEATURE_OPEN], sell_low_price)
+    sell_low_kernel = gte(sell_low_price, next_day_data[:, :, FEATURE_LOW]) * positive(stocks)
+    if not sell_low:
+        sell_low_kernel = np.zeros_like(sell_low_kernel)
+    sell_low_stock_sold = sell_low_kernel * stocks
+    money_earned_sell_low = np.sum(sell_low_stock_sold * sell_low_price, axis=1)
+    money_spent_sell_low = np.sum(sell_low_kernel * SELL_TRANSACTION_COST, axis=1)
+
+    # Executes SELL transactions if prices reaches ABOVE a threshold (Maximize gains)
+    sell_high_amount = stocks - sell_low_stock_sold
+    sell_high_kernel = lte(sell_high_price, next_day_data[:, :, FEATURE_HIGH]) * positive(sell_high_amount)
+    sell_high_stock_sold = sell_high_kernel * sell_high_amount
+    money_earned_sell_high = np.sum(sell_high_stock_sold * sell_high_price, axis=1)
+    money_spent_sell_high = np.sum(sell_high_kernel * SELL_TRANSACTION_COST, axis=1)
+
+    # Executes BUY transactions if prices reaches above a threshold
+    # (Normalize `buy_amount` to be in amount of stocks, instead of fraction of my money)
+    buy_amount = np.floor(buy_amount * current_money[:, np.newaxis] / buy_price)
+    buy_kernel = gte(buy_price, next_day_data[:, :, FEATURE_LOW]) * positive(buy_amount)
+    buy_stock_bought = buy_kernel * buy_amount
+    money_spent_buy = np.sum(buy_stock_bought * buy_price + buy_kernel * BUY_TRANSACTION_COST, axis=1)
+
+    total_money_earned = money_earned_sell_high + money_earned_sell_low
+    total_money_spent = money_spent_sell_low + money_spent_sell_high + money_spent_buy
+    next_money = np.concatenate([
+        (current_money - total_money_spent + money[:, MONEY_TOMORROW])[:, np.newaxis],
+        money[:, 2:],
+        total_money_earned[:, np.newaxis],
+    ], axis=1)
+
+    next_stocks = stocks + buy_stock_bought - sell_low_stock_sold - sell_high_stock_sold
+    return next_money, next_stocks
+
+def backtest(order_prices, buy_amount, next_day_data, initial_stock_prices, initial_money=100000., initial_stocks=None, money_settle_time=3, sell_low=False):
+    """
+    Replays the orders of a trader over many days and portfolios.
+
+    Arguments:
+    - order_prices: array[portfolio, company, day, response] -> [sell_low_price, sell_high_price, buy_price]
+    - buy_amount: array[portfolio, company, day], unnormalized trader output
+    - next_day_data: array[portfolio, company, day, feature], the market data of the day each order is executed
+    - initial_stock_prices: array[portfolio, company], the prices used to value the initial stocks
+    - initial_money: Either the amount of money available today (scalar or array[portfolio]), or array[portfolio, money_settle_time]
+    - initial_stocks: array[portfolio, company], defaults to no stocks
+
+    Market data broadcasts over the portfolio axis, so many traders can be evaluated over the same companies.
+    Everything is computed in float32, like the TF simulator.
+
+    Returns: dict with
+    - money: array[portfolio, day+1, money_settle_time]
+    - stocks: array[portfolio, day+1, company]
+    - money_value, stocks_value, account_value: array[portfolio, day+1]
+    """
+    order_prices = np.asarray(order_prices, dtype=np.float32)
+    buy_amount = np.asarray(buy_amount, dtype=np.float32)
+    num_portfolios, num_companies, num_days = buy_amount.shape
+    next_day_data = np.broadcast_to(np.asarray(next_day_data, dtype=np.float32), (num_portfolios, num_companies, num_days, NUM_FEATURES))
+    stock_prices = np.broadcast_to(np.asarray(initial_stock_prices, dtype=np.float32), (num_portfolios, num_companies))
+
+    money = np.asarray(initial_money, dtype=np.float32)
+    if money.ndim < 2:
+        money = np.concatenate([
+            np.broadcast_to(money, (num_portfolios,))[:, np.newaxis],
+            np.zeros([num_portfolios, money_settle_time-1], dtype=np.float32),
+        ], axis=1)
+    if initial_stocks is None:
+        stocks = np.zeros([num_portfolios, num_companies], dtype=np.float32)
+    else:
+        stocks = np.broadcast_to(np.asarray(initial_stocks, dtype=np.float32), (num_portfolios, num_companies))
+
+    all_money = [money]
+    all_stocks = [stocks]
+    all_stock_prices = [stock_prices]
+    for day in range(num_days):
+        money, stocks = backtest_step(money, stocks, order_prices[:, :, day], buy_amount[:, :, day], next_day_data[:, :, day], sell_low=sell_low)
+        all_money.append(money)
+        all_stocks.append(stocks)
+        all_stock_prices.append(next_day_data[:, :, day, FEATURE_CLOSE])
+
+    money = np.stack(all_money, axis=1)
+    stocks = np.stack(all_stocks, axis=1)
+    money_value = np.sum(money, axis=2)
+    stocks_value = np.sum(stocks * np.stack(all_stock_prices, axis=1), axis=2)
+    return dict(
+        money = money,
+        stocks = stocks,
+        money_value = money_value,
+        stocks_value = stocks_value,
+        account_value = money_value + stocks_value,
+    )
@@ -0,0 +1,60 @@
+"""
+Checks that `backtest.backtest` agrees with the hard forward values of the TF simulator,
+and measures how many portfolios per second it can replay.
+
+Usage (from the project root):
+    python -m benchmarks.backtest
+"""
+import time
+import numpy as np
+import tensorflow as tf
+import trader
+import backtest
+from market import *
+from benchmarks.day_loop import random_stock_history
+
+WARMUP_DAYS = 5
+EVALUATED_DAYS = 20
+HISTORIC_WINDOW_SIZE = 5
+FUTURE_WINDOW_SIZE = 5
+
+def simulate():
+    """
+    Runs the (unrolled) TF simulator, returning its inputs, its orders and the account values of each day
+    """
+    num_days = WARMUP_DAYS + EVALUATED_DAYS
+    graph = trader.build_graph(warmup_days=WARMUP_DAYS, evaluated_days=EVALUATED_DAYS, historic_window_size=HISTORIC_WINDOW_SIZE, future_window_size=FUTURE_WINDOW_SIZE)
+    stock_history = graph.get_tensor_by_name('inputs/stock_history:0')
+    fetches = dict(
+        order_prices = tf.stack([graph.get_tensor_by_name(f'trading/day_{i}/trader/denormalize_prices/trade_decisions/value:0') for i in range(num_days)], axis=2),
+        buy_amount = tf.stack([graph.get_tensor_by_name(f'trading/day_{i}/trader/prediction/buy_amount:0') for i in range(num_days)], axis=2),
+        account_value = tf.stack([graph.get_tensor_by_name(f'trading/state_{i}/account_value:0') for i in range(num_days + 1)], axis=1),
+    )
+
+    history = random_stock_history(stock_history.shape[2].value)
+    with tf.Session(graph=graph) as session:
+        session.run(tf.variables_initializer(graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)))
+        results = session.run(fetches, feed_dict={stock_history: history})
+    results['next_day_data'] = history[:, :, HISTORIC_WINDOW_SIZE:HISTORIC_WINDOW_SIZE + num_days]
+    results['initial_stock_prices'] = history[:, :, HISTORIC_WINDOW_SIZE - 1, FEATURE_CLOSE]
+    return results
+
+if __name__ == '__main__':
+    simulated = simulate()
+    replayed = backtest.backtest(simulated['order_prices'], simulated['buy_amount'], simulated['next_day_data'], simulated['initial_stock_prices'])
+    error = np.abs(replayed['account_value'] - simulated['account_value']) / simulated['account_value']
+    print(f'Max relative difference of account values vs TF simulator: {error.max():.2e}')
+    assert np.allclose(replayed['account_value'], simulated['account_value'], rtol=1e-4)
+
+    for num_portfolios in [1000, 10000]:
+        repeat = -(-num_portfolios // len(simulated['buy_amount']))
+        order_prices = np.tile(simulated['order_prices'], [repeat, 1, 1, 1])[:num_portfolios]
+        buy_amount = np.tile(simulated['buy_amount'], [repeat, 1, 1])[:num_portfolios]
+        buy_amount += np.random.default_rng(0).normal(0, 1, buy_amount.shape).astype(np.float32)
+        next_day_data = simulated['next_day_data'][:1]
+        initial_stock_prices = simulated['initial_stock_prices'][:1]
+
+        start = time.perf_counter()
+        backtest.backtest(order_prices, buy_amount, next_day_data, initial_stock_prices)
+        elapsed = time.perf_counter() - start
+        print(f'{num_portfolios} portfolios x {buy_amount.shape[1]} companies x {buy_amount.shape[2]} days: {elapsed:.3f}s, {num_portfolios / elapsed:.0f} portfolios/s')
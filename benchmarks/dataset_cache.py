@@ -0,0 +1,32 @@
+"""
+Compares loading the S&P datasets from the CSV files with loading them from the binary cache, and checks that both give the same DataFrames.
+
+Usage (from the project root):
+    python -m benchmarks.dataset_cache
+"""
+import time
+import tempfile
+import pandas as pd
+import stock_dataset
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as cache_dir:
+        csv_datasets, csv_time = timed(stock_dataset.read_datasets, cache_dir=None)
+        _, cold_time = timed(stock_dataset.read_datasets, cache_dir=cache_dir)
+        cached_datasets, warm_time = timed(stock_dataset.read_datasets, cache_dir=cache_dir)
+
+    if cached_datasets.keys() != csv_datasets.keys():
+        raise Exception(f"Expected the same symbols from the CSV files and the cache, got {sorted(csv_datasets.keys() ^ cached_datasets.keys())} in only one of them")
+    for symbol, df in csv_datasets.items():
+        pd.testing.assert_frame_equal(cached_datasets[symbol], df, obj=f'{symbol} from the cache')
+    rows = sum(len(df) for df in cached_datasets.values())
+
+    print(f'{len(cached_datasets)} symbols, {rows} rows')
+    print(f'CSV:                   {csv_time:8.3f}s')
+    print(f'Cache (first run):     {cold_time:8.3f}s')
+    print(f'Cache (warm):          {warm_time:8.3f}s  ({csv_time / warm_time:.1f}x faster than CSV)')
@@ -0,0 +1,55 @@
+"""
+Compares the unrolled and `tf.while_loop` trading environments:
+graph size, graph build time, session start-up and training step time for increasing horizons.
+
+Usage (from the project root):
+    python -m benchmarks.day_loop [horizon ...]
+"""
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import trader
+
+MINIBATCH_SIZE = 20
+NUM_COMPANIES = 10
+WARMUP_DAYS = 10
+STEPS = 5
+
+def random_stock_history(total_days):
+    rng = np.random.default_rng(0)
+    prices = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, [MINIBATCH_SIZE, NUM_COMPANIES, total_days, 1]), axis=2))
+    spread = np.exp(rng.normal(0, 0.01, [MINIBATCH_SIZE, NUM_COMPANIES, total_days, 3]))
+    volume = rng.integers(1000, 100000, [MINIBATCH_SIZE, NUM_COMPANIES, total_days, 1])
+    return np.concatenate([prices * spread, prices, volume], axis=3).astype(np.float32)
+
+def measure(day_loop, evaluated_days):
+    start = time.perf_counter()
+    graph = trader.build_graph(warmup_days=WARMUP_DAYS, evaluated_days=evaluated_days, day_loop=day_loop)
+    with graph.as_default():
+        loss = graph.get_tensor_by_name('evaluation/all_price_errors/metrics/mean_sqr:0')
+        training_op = tf.train.AdagradOptimizer(learning_rate=0.05).minimize(loss)
+    build_time = time.perf_counter() - start
+
+    stock_history = graph.get_tensor_by_name('inputs/stock_history:0')
+    feed_dict = {stock_history: random_stock_history(stock_history.shape[2].value)}
+    with tf.Session(graph=graph) as session:
+        start = time.perf_counter()
+        session.run(tf.variables_initializer(graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)))
+        session.run(training_op, feed_dict=feed_dict)
+        startup_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(STEPS):
+            session.run(training_op, feed_dict=feed_dict)
+        step_time = (time.perf_counter() - start) / STEPS
+
+    return len(graph.as_graph_def().node), build_time, startup_time, step_time
+
+if __name__ == '__main__':
+    horizons = [int(arg) for arg in sys.argv[1:]] or [10, 30, 100, 300]
+    print(f'{"loop":>10} {"days":>6} {"nodes":>8} {"build":>9} {"startup":>9} {"step":>9}')
+    for evaluated_days in horizons:
+        for day_loop in ['unrolled', 'while_loop']:
+            nodes, build_time, startup_time, step_time = measure(day_loop, evaluated_days)
+            print(f'{day_loop:>10} {WARMUP_DAYS + evaluated_days:6d} {nodes:8d} {build_time:8.2f}s {startup_time:8.2f}s {step_time:8.3f}s')
@@ -0,0 +1,96 @@
+"""
+Frozen inference graphs (See `export.py`):
+- Checks that the exported `.pb` gives the same trader outputs as the training graph, restored from the same checkpoint (Without the future window of its input).
+- Compares the load time, the number of nodes and the latency of one decision run:
+  - full: The training graph, fetching the outputs and the evaluation metrics and summaries (Like a test run of `execute_trader`)
+  - outputs: The training graph, fetching the outputs only (TF already skips the ops they don't depend on)
+  - frozen: The frozen graph, without Grappler
+  - optimized: The frozen graph, optimized by Grappler
+
+Usage (from the project root):
+    python -m benchmarks.frozen_graph [evaluated_days ...]
+"""
+import os
+import sys
+import time
+import tempfile
+import numpy as np
+import tensorflow as tf
+import export
+from benchmarks.day_loop import random_stock_history, WARMUP_DAYS
+
+REPEATS = 20
+TOLERANCE = 1e-4  # relative
+
+def measure(session, fetches, feed_dict):
+    session.run(fetches, feed_dict=feed_dict)
+    start = time.perf_counter()
+    for i in range(REPEATS):
+        session.run(fetches, feed_dict=feed_dict)
+    return (time.perf_counter() - start) / REPEATS
+
+def compare(evaluated_days, temp_dir):
+    graph_params = dict(warmup_days=WARMUP_DAYS, evaluated_days=evaluated_days)
+    checkpoint = f'{temp_dir}/checkpoint.ckpt'
+
+    start = time.perf_counter()
+    graph = export.build_inference_graph(graph_params)
+    with graph.as_default():
+        summaries = tf.summary.merge_all()
+        saver = tf.train.Saver()
+    session = tf.Session(graph=graph)
+    with graph.as_default():
+        session.run(tf.global_variables_initializer())
+    load_times = dict(full=time.perf_counter() - start)
+    saver.save(session, checkpoint, write_meta_graph=False)
+
+    input = graph.get_tensor_by_name('inputs/stock_history:0')
+    outputs = {output.split('/')[-1]: graph.get_tensor_by_name(f'{output}:0') for output in export.OUTPUTS}
+    stock_history = random_stock_history(input.shape[2].value)
+    feed_dict = {input: stock_history}
+    metrics = {
+        'account_values': graph.get_tensor_by_name('evaluation/account_values/values:0'),
+        'price_error': graph.get_tensor_by_name('evaluation/all_price_errors/metrics/mean_sqr:0'),
+    }
+    if summaries is not None:
+        metrics['summaries'] = summaries
+
+    expected = session.run(outputs, feed_dict=feed_dict)
+    latencies = dict(
+        full=measure(session, dict(metrics, **outputs), feed_dict),
+        outputs=measure(session, outputs, feed_dict),
+    )
+    session.close()
+
+    nodes = {}
+    error = 0
+    for optimize, name in [(False, 'frozen'), (True, 'optimized')]:
+        path = f'{temp_dir}/{name}.pb'
+        nodes.update(export.export_frozen_graph(checkpoint, path, graph_params, optimize=optimize))
+        start = time.perf_counter()
+        with export.FrozenTrader(path) as frozen:
+            # Without the future window
+            history = stock_history[:, :, :frozen.num_days]
+            results = frozen.run(history)
+            load_times[name] = time.perf_counter() - start
+            latencies[name] = measure(frozen.session, frozen.outputs, {frozen.input: history})
+        error = max(error, max(
+            np.max(np.abs(results[output] - expected[output]) / np.maximum(np.abs(expected[output]), 1))
+            for output in expected
+        ))
+    return error, nodes, load_times, latencies
+
+if __name__ == '__main__':
+    horizons = [int(arg) for arg in sys.argv[1:]] or [10, 30]
+    variants = ['full', 'outputs', 'frozen', 'optimized']
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for evaluated_days in horizons:
+            error, nodes, load_times, latencies = compare(evaluated_days, temp_dir)
+            print(f'{WARMUP_DAYS + evaluated_days} days, output error {error:.2e}')
+            print(f'{"":>10} {"nodes":>7} {"load":>8} {"latency":>9}')
+            for variant in variants:
+                node_count = nodes.get(variant, nodes['full'])
+                load_time = f'{load_times[variant]:7.3f}s' if variant in load_times else f'{"":>8}'
+                print(f'{variant:>10} {node_count:7d} {load_time} {1000 * latencies[variant]:7.2f}ms')
+            if error > TOLERANCE:
+                raise Exception(f"Expected the frozen graph to give the same outputs as the training graph (relative error {error})")
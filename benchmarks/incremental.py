@@ -0,0 +1,71 @@
+"""
+Checks that `inference.IncrementalTrader`, fed one day at a time, makes the same decisions as the training graph restored from the same checkpoint,
+on every day of the graph (`trading/day_<i>/trader/...`), and that symbols without data on a day get no decision.
+
+Compares the time of one `step()` with the time of running the whole training graph for the latest day.
+
+Usage (from the project root):
+    python -m benchmarks.incremental [evaluated_days ...]
+"""
+import sys
+import time
+import tempfile
+import numpy as np
+import tensorflow as tf
+import trader
+import inference
+from benchmarks.day_loop import random_stock_history, WARMUP_DAYS
+
+HISTORIC_WINDOW_SIZE = 5
+TOLERANCE = 1e-4  # relative
+
+def compare(evaluated_days, temp_dir):
+    days = WARMUP_DAYS + evaluated_days
+    graph = trader.build_graph(warmup_days=WARMUP_DAYS, evaluated_days=evaluated_days, historic_window_size=HISTORIC_WINDOW_SIZE)
+    input = graph.get_tensor_by_name('inputs/stock_history:0')
+    stock_history = random_stock_history(input.shape[2].value)[:1]
+    fetches = {
+        name: [graph.get_tensor_by_name(f'trading/day_{day}/trader/{output}:0') for day in range(days)]
+        for name, output in [('trade_prices', 'denormalize_prices/trade_decisions/value'), ('buy_amount', 'prediction/buy_amount'), ('predictions', 'denormalize_prices/predictions/value')]
+    }
+    with graph.as_default(), tf.Session(graph=graph) as session:
+        session.run(tf.global_variables_initializer())
+        tf.train.Saver().save(session, f'{temp_dir}/checkpoint.ckpt', write_meta_graph=False)
+        expected = session.run(fetches, feed_dict={input: stock_history})
+        start = time.perf_counter()
+        session.run(fetches, feed_dict={input: stock_history})
+        graph_time = time.perf_counter() - start
+
+    symbols = [f'S{i}' for i in range(stock_history.shape[1])]
+    error = 0
+    with inference.IncrementalTrader(f'{temp_dir}/checkpoint.ckpt', symbols, historic_window_size=HISTORIC_WINDOW_SIZE) as incremental:
+        step_time = 0
+        for day in range(days + HISTORIC_WINDOW_SIZE - 1):
+            start = time.perf_counter()
+            outputs = incremental.step(stock_history[0, :, day])
+            step_time += time.perf_counter() - start
+            # The first decision is made once the first historic window is full
+            graph_day = day - HISTORIC_WINDOW_SIZE + 1
+            if graph_day < 0:
+                continue
+            error = max(error, max(
+                np.max(np.abs(outputs[name] - expected[name][graph_day][0]) / np.maximum(np.abs(expected[name][graph_day][0]), 1))
+                for name in expected
+            ))
+
+        # A symbol without data today
+        available = np.arange(len(symbols)) != 0
+        outputs = incremental.step(stock_history[0, :, 0], available=available)
+        if not all(np.all(np.isnan(outputs[name][0])) and not np.any(np.isnan(outputs[name][1:])) for name in expected):
+            raise Exception("Expected NaN decisions for the symbols without data only")
+    return error, step_time / (days + HISTORIC_WINDOW_SIZE - 1), graph_time
+
+if __name__ == '__main__':
+    horizons = [int(arg) for arg in sys.argv[1:]] or [10, 30]
+    print(f'{"days":>5} {"error":>9} {"step":>9} {"graph":>9}')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for evaluated_days in horizons:
+            error, step_time, graph_time = compare(evaluated_days, temp_dir)
+            print(f'{WARMUP_DAYS + evaluated_days:5d} {error:9.2e} {1000 * step_time:7.2f}ms {1000 * graph_time:7.2f}ms')
+            if error > TOLERANCE:
+                raise Exception(f"Expected IncrementalTrader to make the same decisions as the training graph (relative error {error})")
@@ -0,0 +1,65 @@
+"""
+Checks that an `indicators.IndicatorStream` fed in chunks of days gives the same indicators as `IndicatorEngine.compute` over all the days at once,
+and compares the time per new day of both (The stream updates running sums in O(1), `compute` recomputes the whole history).
+
+Raises if the indicators differ by more than the tolerance.
+
+Usage (from the project root):
+    python -m benchmarks.indicators [num_days ...]
+"""
+import sys
+import time
+import numpy as np
+from indicators import IndicatorEngine, IndicatorStream
+from benchmarks.day_loop import random_stock_history
+
+MAX_CHUNK = 20   # Days appended at once, random from 1
+TIMED_DAYS = 50  # Last days timed one at a time
+TOLERANCE = 1e-4  # relative (Running sums vs cumulative sums, in float64)
+
+def compare(num_days):
+    engine = IndicatorEngine()
+    symbols = random_stock_history(num_days)[0]
+    rng = np.random.default_rng(0)
+
+    error = 0
+    for ohlcv in symbols:
+        expected = engine.compute(ohlcv)
+        stream = IndicatorStream(engine)
+        chunks = []
+        start = 0
+        while start < num_days:
+            end = min(num_days, start + rng.integers(1, MAX_CHUNK + 1))
+            chunks.append(stream.append(ohlcv[start:end]))
+            start = end
+        streamed = np.concatenate(chunks)
+        if streamed.shape != expected.shape:
+            raise Exception(f"Expected the streamed indicators of shape {expected.shape}, got {streamed.shape}")
+        error = max(error, np.max(np.abs(streamed - expected) / np.maximum(np.abs(expected), 1)))
+
+    # A stream restored from its history continues it
+    restored = IndicatorStream(engine, stream.history)
+    error = max(error, np.max(np.abs(restored.append(ohlcv[-1]) - stream.append(ohlcv[-1])) / np.maximum(np.abs(expected[-1]), 1)))
+
+    # The last days of a symbol, one day at a time
+    ohlcv = symbols[0]
+    first = num_days - TIMED_DAYS
+    stream = IndicatorStream(engine, ohlcv[:first])
+    start = time.perf_counter()
+    for day in range(first, num_days):
+        stream.append(ohlcv[day])
+    stream_time = (time.perf_counter() - start) / TIMED_DAYS
+    start = time.perf_counter()
+    for day in range(first, num_days):
+        engine.compute(ohlcv[:day + 1])[-1]
+    compute_time = (time.perf_counter() - start) / TIMED_DAYS
+    return error, stream_time, compute_time
+
+if __name__ == '__main__':
+    lengths = [int(arg) for arg in sys.argv[1:]] or [250, 2500]
+    print(f'{"days":>6} {"error":>9} {"stream":>10} {"compute":>10}')
+    for num_days in lengths:
+        error, stream_time, compute_time = compare(num_days)
+        print(f'{num_days:6d} {error:9.2e} {1000 * stream_time:8.3f}ms {1000 * compute_time:8.3f}ms')
+        if error > TOLERANCE:
+            raise Exception(f"Expected the streamed indicators to match IndicatorEngine.compute (relative error {error})")
@@ -0,0 +1,81 @@
+"""
+Checks that the precomputed log features (`build_graph(precomputed_features=True)`) give the same trader as the in-graph `log_perc.normalize`,
+and compares their training step time.
+
+Both graphs run with the same variables and the same minibatch. Raises if the normalized inputs or the outputs differ by more than the tolerances.
+
+Usage (from the project root):
+    python -m benchmarks.log_features [evaluated_days ...]
+"""
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import trader
+import stock_dataset
+from benchmarks.day_loop import random_stock_history, WARMUP_DAYS
+
+HISTORIC_WINDOW_SIZE = 5
+STEPS = 50
+INPUT_TOLERANCE = 1e-3   # log-perc units (1e-3 = 0.00001 %)
+OUTPUT_TOLERANCE = 1e-2  # relative (Rounding differences of the inputs go through the whole network, and grow with the days)
+
+def build(precomputed_features, evaluated_days):
+    graph = trader.build_graph(warmup_days=WARMUP_DAYS, evaluated_days=evaluated_days, historic_window_size=HISTORIC_WINDOW_SIZE, precomputed_features=precomputed_features)
+    with graph.as_default():
+        loss = graph.get_tensor_by_name('evaluation/all_price_errors/metrics/mean_sqr:0')
+        training_op = tf.train.AdagradOptimizer(learning_rate=0.05).minimize(loss)
+        variables = {variable.op.name: variable for variable in tf.global_variables()}
+    return graph, training_op, variables
+
+def compare(evaluated_days):
+    stock_history = random_stock_history(WARMUP_DAYS + evaluated_days + 2 * HISTORIC_WINDOW_SIZE - 1)
+    stock_history[0, 0, :, 4] = 0  # A company without volume, where `eps` matters
+    with_log_features = np.concatenate([stock_history, stock_dataset.log_features(stock_history, HISTORIC_WINDOW_SIZE)], axis=3)
+
+    fetches = {
+        'normalized_history': [f'trading/day_{day}/trader/normalize_input/normalized_history/value:0' for day in range(WARMUP_DAYS + evaluated_days)],
+        'account_values': 'evaluation/account_values/values:0',
+        'price_errors': 'evaluation/all_price_errors/values:0',
+        'prediction_errors': 'evaluation/prediction_errors/values:0',
+    }
+
+    results = {}
+    initial_values = None
+    for precomputed_features, minibatch in [(False, stock_history), (True, with_log_features)]:
+        graph, training_op, variables = build(precomputed_features, evaluated_days)
+        feed_dict = {graph.get_tensor_by_name('inputs/stock_history:0'): minibatch}
+        with tf.Session(graph=graph) as session:
+            session.run(tf.variables_initializer(list(variables.values())))
+            # Same initial variables on both graphs
+            if initial_values is None:
+                initial_values = session.run(variables)
+            else:
+                for name, variable in variables.items():
+                    variable.load(initial_values[name], session)
+
+            outputs = session.run(fetches, feed_dict=feed_dict)
+            session.run(training_op, feed_dict=feed_dict)
+
+            start = time.perf_counter()
+            for i in range(STEPS):
+                session.run(training_op, feed_dict=feed_dict)
+            outputs['step_time'] = (time.perf_counter() - start) / STEPS
+        results[precomputed_features] = outputs
+
+    raw, log = results[False], results[True]
+    input_error = max(np.max(np.abs(a - b)) for a, b in zip(raw['normalized_history'], log['normalized_history']))
+    output_error = max(
+        np.max(np.abs(raw[name] - log[name]) / np.maximum(np.abs(raw[name]), 1))
+        for name in ['account_values', 'price_errors', 'prediction_errors']
+    )
+    return input_error, output_error, raw['step_time'], log['step_time']
+
+if __name__ == '__main__':
+    horizons = [int(arg) for arg in sys.argv[1:]] or [10, 30]
+    print(f'{"days":>6} {"input error":>12} {"output error":>13} {"raw step":>10} {"log step":>10}')
+    for evaluated_days in horizons:
+        input_error, output_error, raw_step_time, log_step_time = compare(evaluated_days)
+        print(f'{WARMUP_DAYS + evaluated_days:6d} {input_error:12.2e} {output_error:13.2e} {raw_step_time:9.3f}s {log_step_time:9.3f}s')
+        if input_error > INPUT_TOLERANCE or output_error > OUTPUT_TOLERANCE:
+            raise Exception(f"Expected the precomputed log features to match log_perc.normalize (input error {input_error}, output error {output_error})")
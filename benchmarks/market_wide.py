@@ -0,0 +1,104 @@
+"""
+Market-wide minibatches (`build_graph(market_wide=True)`):
+- Checks that padding companies don't change the results: A padded 2-date minibatch gives the same account values and price errors as each date on its own.
+- Compares the time to evaluate a whole market of companies in one `session.run`, against minibatches of `NUM_COMPANIES` companies.
+
+Usage (from the project root):
+    python -m benchmarks.market_wide [num_companies ...]
+"""
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import trader
+from benchmarks.day_loop import WARMUP_DAYS
+
+EVALUATED_DAYS = 10
+NUM_COMPANIES = 10
+REPEATS = 3
+TOLERANCE = 1e-3
+
+def random_market(num_dates, num_companies, total_days, seed=0):
+    rng = np.random.default_rng(seed)
+    prices = 50 * np.exp(np.cumsum(rng.normal(0, 0.02, [num_dates, num_companies, total_days, 1]), axis=2))
+    spread = np.exp(rng.normal(0, 0.01, [num_dates, num_companies, total_days, 3]))
+    volume = rng.integers(1000, 100000, [num_dates, num_companies, total_days, 1])
+    return np.concatenate([prices * spread, prices, volume], axis=3).astype(np.float32)
+
+def build(market_wide):
+    graph = trader.build_graph(warmup_days=WARMUP_DAYS, evaluated_days=EVALUATED_DAYS, market_wide=market_wide)
+    fetches = {
+        'account_values': graph.get_tensor_by_name('evaluation/account_values/values:0'),
+        'price_error': graph.get_tensor_by_name('evaluation/all_price_errors/metrics/mean_sqr:0'),
+    }
+    return graph, fetches
+
+def new_session(graph, initial_values=None):
+    session = tf.Session(graph=graph)
+    with graph.as_default():
+        variables = {variable.op.name: variable for variable in tf.global_variables()}
+        session.run(tf.variables_initializer(list(variables.values())))
+        if initial_values is not None:
+            for name, variable in variables.items():
+                variable.load(initial_values[name], session)
+        return session, session.run(variables)
+
+def check_padding(session, graph, fetches, total_days, num_companies):
+    """
+    Returns the largest difference between a padded minibatch, and each of its dates on its own
+    """
+    stock_history = random_market(2, num_companies, total_days)
+    mask = np.ones([2, num_companies], dtype=bool)
+    mask[1, num_companies // 2:] = False
+    stock_history[1, num_companies // 2:] = stock_history[1, :1]  # Padding, like `minibatch_producer(...).market`
+
+    padded = session.run(fetches, feed_dict={'inputs/stock_history:0': stock_history, 'inputs/company_mask:0': mask})
+    dates = [
+        session.run(fetches, feed_dict={'inputs/stock_history:0': stock_history[date:date+1, mask[date]], 'inputs/company_mask:0': mask[date:date+1, mask[date]]})
+        for date in range(2)
+    ]
+    account_values = np.concatenate([outputs['account_values'] for outputs in dates])
+    # The mean over both dates, weighted by their number of companies
+    price_error = np.average([outputs['price_error'] for outputs in dates], weights=mask.sum(axis=1))
+    return max(
+        np.max(np.abs(padded['account_values'] - account_values) / account_values),
+        abs(padded['price_error'] - price_error) / price_error)
+
+def measure(session, fetches, feed_dict):
+    session.run(fetches, feed_dict=feed_dict)
+    start = time.perf_counter()
+    for i in range(REPEATS):
+        session.run(fetches, feed_dict=feed_dict)
+    return (time.perf_counter() - start) / REPEATS
+
+if __name__ == '__main__':
+    market_sizes = [int(arg) for arg in sys.argv[1:]] or [100, 500]
+    market_graph, market_fetches = build(market_wide=True)
+    sampled_graph, sampled_fetches = build(market_wide=False)
+    total_days = market_graph.get_tensor_by_name('inputs/stock_history:0').shape[2].value
+
+    market_session, initial_values = new_session(market_graph)
+    sampled_session, _ = new_session(sampled_graph, initial_values)
+
+    print(f'{"companies":>10} {"padding error":>14} {"market-wide":>12} {"runs":>5} {"sampled":>9}')
+    for num_companies in market_sizes:
+        error = check_padding(market_session, market_graph, market_fetches, total_days, num_companies)
+        if error > TOLERANCE:
+            raise Exception(f"Expected padding companies to leave the results unchanged (relative error {error})")
+
+        market = random_market(1, num_companies, total_days)
+        market_time = measure(market_session, market_fetches, {'inputs/stock_history:0': market, 'inputs/company_mask:0': np.ones([1, num_companies], dtype=bool)})
+
+        # The same companies, split into minibatches of NUM_COMPANIES, one `session.run` each
+        runs = -(-num_companies // NUM_COMPANIES)
+        sampled_session.run(sampled_fetches, feed_dict={'inputs/stock_history:0': market[:, :NUM_COMPANIES]})
+        start = time.perf_counter()
+        for repeat in range(REPEATS):
+            for first in range(0, num_companies, NUM_COMPANIES):
+                sampled_session.run(sampled_fetches, feed_dict={'inputs/stock_history:0': market[:, first:first+NUM_COMPANIES]})
+        sampled_time = (time.perf_counter() - start) / REPEATS
+
+        print(f'{num_companies:10d} {error:14.2e} {market_time:11.3f}s {runs:5d} {sampled_time:8.3f}s')
+
+    market_session.close()
+    sampled_session.close()
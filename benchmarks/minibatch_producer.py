@@ -0,0 +1,61 @@
+"""
+Compares the throughput of `stock_dataset.minibatch_producer` with the previous implementation,
+which picked the samples of each minibatch row from a dict of per-date DataFrames.
+
+Usage (from the project root):
+    python -m benchmarks.minibatch_producer
+"""
+import time
+import random
+import numpy as np
+import stock_dataset
+
+TIMESERIES_LENGTH = 44  # Default trader graph
+NUM_COMPANIES = 10
+
+def legacy_minibatch_producer(timeseries_length, minibatch_size=100, num_companies=NUM_COMPANIES):
+    """
+    The previous producer, using flat DataFrames and a Python loop over each minibatch row
+    """
+    all_timeseries = stock_dataset.concat_data(stock_dataset.read_time_series(timeseries_length=timeseries_length, flat=True))
+    train_timeseries, _ = stock_dataset.train_test_split_by_symbol(all_timeseries)
+    train_timeseries = {
+        date: train_timeseries[train_timeseries.Date == date]
+        for date in set(train_timeseries.Date)
+    }
+
+    def produce(minibatch_size=minibatch_size, num_companies=num_companies):
+        minibatch = []
+        for i in range(minibatch_size):
+            date = random.choice(list(train_timeseries.keys()))
+            samples = train_timeseries[date].sample(n = num_companies, replace = True)
+            samples = samples[samples.columns[2:]].values
+            minibatch.append(samples.reshape([num_companies, -1, 5]))
+        return np.stack(minibatch)
+    return produce
+
+def measure(name, build, call, minibatch_sizes=(100, 500), min_time=2):
+    start = time.perf_counter()
+    produce = build()
+    print(f'{name}: setup {time.perf_counter() - start:.2f}s')
+
+    for minibatch_size in minibatch_sizes:
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < min_time:
+            call(produce, minibatch_size)
+            count += 1
+        elapsed = time.perf_counter() - start
+        print(f'  minibatch_size={minibatch_size}: {count * minibatch_size * NUM_COMPANIES / elapsed:12.0f} samples/s, {1000 * elapsed / count:8.2f} ms/minibatch')
+
+if __name__ == '__main__':
+    stock_dataset.read_datasets()  # Make sure the cache is warm for both
+
+    measure(
+        'legacy',
+        lambda: legacy_minibatch_producer(TIMESERIES_LENGTH),
+        lambda produce, minibatch_size: produce(minibatch_size=minibatch_size))
+    measure(
+        'dense',
+        lambda: stock_dataset.minibatch_producer(timeseries_length=TIMESERIES_LENGTH, seed=0),
+        lambda produce, minibatch_size: produce('train', minibatch_size=minibatch_size))
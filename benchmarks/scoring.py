@@ -0,0 +1,131 @@
+"""
+Load generator for the scoring service (See `scoring.py`), on synthetic stock histories.
+
+Exports a randomly initialized trader, then `NUM_CLIENTS` client threads send per-symbol requests as fast as they get their results,
+for each `max_wait` of the service. Prints the throughput, the p50/p99 latencies and a histogram of the batch sizes.
+Also checks that batched results are the same as scoring each request on its own, and that results depend on the last day of the request.
+
+Usage (from the project root):
+    python -m benchmarks.scoring [--http] [--clients N] [--requests N] [--max-wait-ms MS ...]
+"""
+import json
+import time
+import argparse
+import tempfile
+import threading
+import urllib.request
+import numpy as np
+import tensorflow as tf
+import export
+import scoring
+from benchmarks.day_loop import random_stock_history, WARMUP_DAYS
+
+EVALUATED_DAYS = 10
+NUM_CLIENTS = 32
+REQUESTS_PER_CLIENT = 50
+MAX_BATCH_SIZE = 64
+TOLERANCE = 1e-4  # relative
+
+def export_random_trader(temp_dir):
+    graph = export.build_inference_graph(dict(warmup_days=WARMUP_DAYS, evaluated_days=EVALUATED_DAYS))
+    with graph.as_default(), tf.Session(graph=graph) as session:
+        session.run(tf.global_variables_initializer())
+        tf.train.Saver().save(session, f'{temp_dir}/checkpoint.ckpt', write_meta_graph=False)
+    export.export_frozen_graph(f'{temp_dir}/checkpoint.ckpt', f'{temp_dir}/trader.pb', dict(warmup_days=WARMUP_DAYS, evaluated_days=EVALUATED_DAYS))
+    return f'{temp_dir}/trader.pb'
+
+def synthetic_symbols(num_days):
+    stock_history = random_stock_history(num_days)
+    return stock_history.reshape([-1, num_days, stock_history.shape[3]])
+
+def http_client(port):
+    def score(stock_history):
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{port}/score',
+            data=json.dumps(dict(stock_history=stock_history.tolist())).encode(),
+            headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            return {name: np.array(value) for name, value in json.loads(response.read()).items()}
+    return score
+
+def generate_load(score, symbols, num_clients, requests_per_client):
+    """
+    Runs `num_clients` threads, each scoring `requests_per_client` random symbols one after the other.
+
+    Returns: (seconds, results), results being a list of (symbol index, result)
+    """
+    results = []
+    lock = threading.Lock()
+
+    def client(seed):
+        rng = np.random.default_rng(seed)
+        client_results = []
+        for i in range(requests_per_client):
+            symbol = rng.integers(len(symbols))
+            client_results.append((symbol, score(symbols[symbol])))
+        with lock:
+            results.extend(client_results)
+
+    clients = [threading.Thread(target=client, args=(seed,)) for seed in range(num_clients)]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return time.perf_counter() - start, results
+
+def histogram(batch_sizes):
+    """
+    Number of requests per power-of-2 bucket of batch sizes
+    """
+    buckets = {}
+    for size, count in batch_sizes.items():
+        low = 1 << (int(size).bit_length() - 1)
+        buckets[low] = buckets.get(low, 0) + size * count
+    return ' '.join(f'{low if low == 1 else f"{low}-{2 * low - 1}"}:{requests}' for low, requests in sorted(buckets.items()))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--http', action='store_true', help='Send the requests through the HTTP server on localhost')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--clients', type=int, default=NUM_CLIENTS)
+    parser.add_argument('--requests', type=int, default=REQUESTS_PER_CLIENT, help='Requests per client')
+    parser.add_argument('--max-wait-ms', type=float, nargs='*', default=[0, 2, 10])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = export_random_trader(temp_dir)
+        with export.FrozenTrader(path) as frozen:
+            symbols = synthetic_symbols(frozen.num_days)
+            expected = frozen.run(symbols[:, np.newaxis])
+
+        # The results must use the last day of each request (A stale decision would ignore it)
+        with scoring.ScoringService(path) as service:
+            last_day_moved = symbols[0].copy()
+            last_day_moved[-1, :4] *= 1.1
+            original, moved = service.score(symbols[0]), service.score(last_day_moved)
+            if all(np.allclose(original[name], moved[name]) for name in original):
+                raise Exception("Expected the result to change with the last day of the request")
+
+        print(f'{"max wait":>9} {"requests/s":>11} {"p50":>9} {"p99":>9} {"batch":>6} {"error":>9}  requests per batch size')
+        for max_wait_ms in args.max_wait_ms:
+            with scoring.ScoringService(path, MAX_BATCH_SIZE, max_wait_ms / 1000) as service:
+                if args.http:
+                    server = scoring.serve(service, args.port)
+                    score = http_client(args.port)
+                else:
+                    score = service.score
+                seconds, results = generate_load(score, symbols, args.clients, args.requests)
+                if args.http:
+                    server.shutdown()
+                    server.server_close()
+                stats = service.stats.summary()
+
+            error = max(
+                np.max(np.abs(result[name] - expected[name][symbol, 0, -1]) / np.maximum(np.abs(expected[name][symbol, 0, -1]), 1))
+                for symbol, result in results
+                for name in expected
+            )
+            print(f'{max_wait_ms:7.1f}ms {len(results) / seconds:11.0f} {1000 * stats["p50"]:7.2f}ms {1000 * stats["p99"]:7.2f}ms {stats["mean_batch_size"]:6.1f} {error:9.2e}  {histogram(stats["batch_sizes"])}')
+            if error > TOLERANCE:
+                raise Exception(f"Expected batched results to match scoring each symbol on its own (relative error {error})")
@@ -0,0 +1,105 @@
+"""
+Compares the `tf.custom_gradient` softops (`build_graph(custom_gradients=True)`) against the `with_grad` ones, on the unrolled trading graph:
+- Checks that the account values, the profit and the gradients of the training loss are the same.
+- Compares the number of graph nodes, the bytes allocated by the ops of a training step, and the training step time.
+
+Both graphs run with the same variables and the same minibatch.
+
+Usage (from the project root):
+    python -m benchmarks.softops [evaluated_days ...]
+"""
+import sys
+import time
+import numpy as np
+import tensorflow as tf
+import trader
+from benchmarks.day_loop import random_stock_history, WARMUP_DAYS
+
+STEPS = 20
+TOLERANCE = 1e-5  # relative
+
+def build(custom_gradients, evaluated_days):
+    graph = trader.build_graph(warmup_days=WARMUP_DAYS, evaluated_days=evaluated_days, custom_gradients=custom_gradients)
+
+    with graph.as_default():
+        profit = graph.get_tensor_by_name('evaluation/period_variation/metrics/mean:0')
+        loss = -profit + graph.get_tensor_by_name('evaluation/all_price_errors/metrics/mean_sqr:0')
+        gradients = {
+            variable.op.name: gradient
+            for variable, gradient in zip(tf.trainable_variables(), tf.gradients(loss, tf.trainable_variables()))
+            if gradient is not None
+        }
+        training_op = tf.train.AdagradOptimizer(learning_rate=0.05).minimize(loss)
+        variables = {variable.op.name: variable for variable in tf.global_variables()}
+
+    fetches = {
+        'account_values': graph.get_tensor_by_name('evaluation/account_values/values:0'),
+        'profit': profit,
+        'gradients': gradients,
+    }
+    return graph, fetches, training_op, variables
+
+def memory(session, training_op, feed_dict):
+    """
+    Bytes allocated by all the ops of a training step
+    """
+    run_metadata = tf.RunMetadata()
+    session.run(training_op, feed_dict=feed_dict, options=tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), run_metadata=run_metadata)
+    return sum(
+        output.tensor_description.allocation_description.allocated_bytes
+        for device in run_metadata.step_stats.dev_stats
+        for node in device.node_stats
+        for output in node.output
+    )
+
+def compare(evaluated_days):
+    results = {}
+    initial_values = None
+    stock_history = None
+    for custom_gradients in [False, True]:
+        graph, fetches, training_op, variables = build(custom_gradients, evaluated_days)
+        input = graph.get_tensor_by_name('inputs/stock_history:0')
+        if stock_history is None:
+            stock_history = random_stock_history(input.shape[2].value)
+        feed_dict = {input: stock_history}
+
+        with tf.Session(graph=graph) as session:
+            session.run(tf.variables_initializer(list(variables.values())))
+            # Same initial variables on both graphs
+            if initial_values is None:
+                initial_values = session.run(variables)
+            else:
+                for name, variable in variables.items():
+                    variable.load(initial_values[name], session)
+
+            outputs = session.run(fetches, feed_dict=feed_dict)
+            outputs['nodes'] = len(graph.as_graph_def().node)
+            outputs['allocated'] = memory(session, training_op, feed_dict)
+
+            start = time.perf_counter()
+            for i in range(STEPS):
+                session.run(training_op, feed_dict=feed_dict)
+            outputs['step_time'] = (time.perf_counter() - start) / STEPS
+        results[custom_gradients] = outputs
+
+    reference, custom = results[False], results[True]
+    value_error = max(
+        np.max(np.abs(reference[name] - custom[name]) / np.maximum(np.abs(reference[name]), 1))
+        for name in ['account_values', 'profit']
+    )
+    gradient_error = max(
+        np.max(np.abs(reference['gradients'][name] - custom['gradients'][name])) / max(np.max(np.abs(reference['gradients'][name])), 1e-12)
+        for name in reference['gradients']
+    )
+    return value_error, gradient_error, reference, custom
+
+if __name__ == '__main__':
+    horizons = [int(arg) for arg in sys.argv[1:]] or [10, 30]
+    print(f'{"days":>5} {"softops":>8} {"nodes":>7} {"allocated":>10} {"step":>9} {"value err":>10} {"grad err":>10}')
+    for evaluated_days in horizons:
+        value_error, gradient_error, reference, custom = compare(evaluated_days)
+        for label, outputs in [('with_grad', reference), ('custom', custom)]:
+            print(f'{WARMUP_DAYS + evaluated_days:5d} {label:>8} {outputs["nodes"]:7d} {outputs["allocated"] / 2**20:8.1f}MB {outputs["step_time"]:8.3f}s', end='')
+            print(f' {value_error:10.2e} {gradient_error:10.2e}' if label == 'custom' else '')
+        if value_error > TOLERANCE or gradient_error > TOLERANCE:
+            raise Exception(f"Expected the custom gradient softops to match with_grad (value error {value_error}, gradient error {gradient_error})")
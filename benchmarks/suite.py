@@ -0,0 +1,149 @@
+"""
+Times the hot paths of the project end to end on a synthetic dataset (See `benchmarks.synthetic`), and writes the results as JSON.
+
+The benchmarks run inside a temporary directory holding the synthetic `dataset`, so the real dataset submodule isn't needed.
+Compare the JSON files of two commits to find regressions.
+
+Usage (from the project root):
+    python -m benchmarks.suite [--symbols N] [--years Y] [--gaps RATIO] [--output results.json] [--only NAME ...]
+"""
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import platform
+import tempfile
+import contextlib
+import subprocess
+import numpy as np
+
+from benchmarks import synthetic
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TIMESERIES_LENGTH = 30
+MINIBATCH_SIZE = 100
+NUM_COMPANIES = 10
+
+def timed(f, *args, **kwargs):
+    start = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def repeated(f, repeat):
+    """
+    Best time of `repeat` calls of `f()`
+    """
+    return min(timed(f)[1] for i in range(repeat))
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def dataset_benchmarks(args, min_date):
+    import stock_dataset
+    symbols = synthetic.symbol_names(args.symbols)
+    results = {}
+
+    datasets, seconds = timed(stock_dataset.read_datasets, symbols, min_date, cache_dir=None)
+    rows = sum(len(df) for df in datasets.values())
+    results['read_datasets_csv'] = dict(seconds=seconds, rows=rows)
+
+    _, seconds = timed(stock_dataset.read_datasets, symbols, min_date)
+    results['read_datasets_cache_cold'] = dict(seconds=seconds, rows=rows)
+
+    datasets, seconds = timed(stock_dataset.read_datasets, symbols, min_date)
+    results['read_datasets_cache_warm'] = dict(seconds=seconds, rows=rows)
+
+    seconds = repeated(lambda: [stock_dataset.dataset_to_timeseries(df, TIMESERIES_LENGTH) for df in datasets.values()], args.repeat)
+    results['dataset_to_timeseries'] = dict(seconds=seconds, rows=rows)
+
+    seconds = repeated(lambda: [stock_dataset.dataset_to_timeseries(df, TIMESERIES_LENGTH, flat=True) for df in datasets.values()], args.repeat)
+    results['dataset_to_timeseries_flat'] = dict(seconds=seconds, rows=rows)
+
+    concatenated, seconds = timed(stock_dataset.concat_data, datasets)
+    results['concat_data'] = dict(seconds=seconds, rows=len(concatenated))
+
+    seconds = repeated(lambda: stock_dataset.train_test_split_by_symbol(concatenated), args.repeat)
+    results['train_test_split_by_symbol'] = dict(seconds=seconds, rows=len(concatenated))
+
+    produce, seconds = timed(stock_dataset.minibatch_producer, symbols, min_date, TIMESERIES_LENGTH, seed=0)
+    results['minibatch_producer_setup'] = dict(seconds=seconds, dates=len(produce.dense.dates))
+
+    _, seconds = timed(lambda: [produce('train', MINIBATCH_SIZE, NUM_COMPANIES) for i in range(args.batches)])
+    results['minibatch_producer_batch'] = dict(
+        seconds = seconds / args.batches,
+        batches = args.batches,
+        samples_per_second = args.batches * MINIBATCH_SIZE * NUM_COMPANIES / seconds,
+    )
+    return results
+
+def trader_benchmarks(args, min_date):
+    import trader
+    results = {}
+
+    graph, seconds = timed(trader.build_graph)
+    results['build_graph'] = dict(seconds=seconds, nodes=len(graph.as_graph_def().node))
+
+    # Startup (graph, dataset, session) is the same for both runs, so the difference is the cost of the extra train steps
+    def train(steps):
+        with contextlib.redirect_stdout(io.StringIO()):
+            trader.execute_trader(
+                stop_at = steps,
+                optimize_price_error = True,
+                dataset_params = dict(symbols=synthetic.symbol_names(args.symbols), min_date=min_date, seed=0))
+
+    _, startup_seconds = timed(train, 1)
+    _, seconds = timed(train, 1 + args.steps)
+    results['execute_trader'] = dict(seconds=startup_seconds, steps=1)
+    results['execute_trader_train_step'] = dict(
+        seconds = (seconds - startup_seconds) / args.steps,
+        steps = args.steps,
+        examples_per_second = args.steps * MINIBATCH_SIZE / (seconds - startup_seconds),
+    )
+    return results
+
+BENCHMARKS = {
+    'dataset': dataset_benchmarks,
+    'trader': trader_benchmarks,
+}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    synthetic.add_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=3, help='Repetitions of the fast benchmarks (The best time is reported)')
+    parser.add_argument('--batches', type=int, default=100, help='Minibatches sampled')
+    parser.add_argument('--steps', type=int, default=10, help='Train steps of execute_trader')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument('--output', help='JSON file to write the results to (Printed to stdout by default)')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    report = dict(
+        commit = git_commit(),
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        platform = platform.platform(),
+        python = platform.python_version(),
+        numpy = np.__version__,
+        params = dict(symbols=args.symbols, years=args.years, gaps=args.gaps, seed=args.seed, repeat=args.repeat, batches=args.batches, steps=args.steps),
+        results = {},
+    )
+
+    with tempfile.TemporaryDirectory() as root:
+        synthetic.write_dataset(root, args.symbols, args.years, args.gaps, args.seed)
+        min_date = f'{int(synthetic.END_DATE[:4]) - int(np.ceil(args.years))}-01-01'
+        os.chdir(root)  # `stock_dataset` and `trader` use paths relative to the current directory
+        for name in args.only:
+            print(f'Running {name} benchmarks...', file=sys.stderr)
+            report['results'].update(BENCHMARKS[name](args, min_date))
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'Results written to {output}', file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
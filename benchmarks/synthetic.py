@@ -0,0 +1,75 @@
+"""
+Writes a deterministic synthetic dataset with the same layout as the `dataset` submodule:
+
+    {root}/dataset/dataset-2017-10-11/Stocks/{symbol}.us.txt
+    {root}/dataset/dataset-2017-10-11/ETFs/
+    {root}/dataset/s&p500.tsv
+
+The CSV files have the Kaggle format (Date,Open,High,Low,Close,Volume,OpenInt), with prices following a geometric random walk.
+
+Usage (from the project root):
+    python -m benchmarks.synthetic ROOT [--symbols N] [--years Y] [--gaps RATIO] [--seed SEED]
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+END_DATE = '2017-11-10'
+
+def symbol_names(num_symbols):
+    return [f'S{i:04d}' for i in range(num_symbols)]
+
+def write_dataset(root, num_symbols=100, years=5, gaps=0.01, seed=0):
+    """
+    Writes the synthetic dataset under `root`, and returns the list of symbols.
+
+    Arguments:
+    - num_symbols: Number of Stocks files. All of them are listed in `s&p500.tsv`
+    - years: Length of the calendar, ending on the last day of the real dataset
+    - gaps: Ratio of business days missing from each file. Symbols also start trading at different dates (Up to 10% of the calendar)
+    - seed: The same seed always produces the same files
+    """
+    stock_dir = f'{root}/dataset/dataset-2017-10-11/Stocks'
+    os.makedirs(stock_dir, exist_ok=True)
+    os.makedirs(f'{root}/dataset/dataset-2017-10-11/ETFs', exist_ok=True)
+
+    calendar = pd.bdate_range(end=END_DATE, periods=int(years * 261))
+    symbols = symbol_names(num_symbols)
+    for symbol, symbol_seed in zip(symbols, np.random.SeedSequence(seed).spawn(num_symbols)):
+        rng = np.random.default_rng(symbol_seed)
+        dates = calendar[rng.integers(len(calendar) // 10 + 1):]
+        dates = dates[rng.random(len(dates)) >= gaps]
+
+        close = rng.uniform(5, 200) * np.exp(np.cumsum(rng.normal(0, 0.02, len(dates))))
+        open = close * np.exp(rng.normal(0, 0.01, len(dates)))
+        high = np.maximum(open, close) * (1 + rng.random(len(dates)) * 0.02)
+        low = np.minimum(open, close) * (1 - rng.random(len(dates)) * 0.02)
+        volume = rng.integers(1000, 1000000, len(dates))
+
+        pd.DataFrame(dict(
+            Date = dates.strftime('%Y-%m-%d'),
+            Open = open.round(3),
+            High = high.round(3),
+            Low = low.round(3),
+            Close = close.round(3),
+            Volume = volume,
+            OpenInt = 0,
+        )).to_csv(f'{stock_dir}/{symbol.lower()}.us.txt', index=False)
+
+    pd.DataFrame({'Ticker symbol': symbols, 'Security': symbols}).to_csv(f'{root}/dataset/s&p500.tsv', sep='\t', index=False)
+    return symbols
+
+def add_arguments(parser):
+    parser.add_argument('--symbols', type=int, default=100, help='Number of symbols')
+    parser.add_argument('--years', type=float, default=5, help='Years of data')
+    parser.add_argument('--gaps', type=float, default=0.01, help='Ratio of missing days')
+    parser.add_argument('--seed', type=int, default=0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root')
+    add_arguments(parser)
+    args = parser.parse_args()
+    symbols = write_dataset(args.root, args.symbols, args.years, args.gaps, args.seed)
+    print(f'{len(symbols)} symbols written to {args.root}/dataset')
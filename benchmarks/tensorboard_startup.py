@@ -0,0 +1,97 @@
+"""
+Startup time of `tensorboard.Server` for the first process of a logdir, and for later processes reusing its server and tunnel (See `tensorboard.Registry`).
+
+Runs with local stand-ins for `tensorboard` and `ngrok` (Same command lines, log lines and `/api/tunnels`), so it needs neither of them nor a network.
+The stand-ins take `STARTUP_DELAY` seconds to start, like the real programs.
+
+Usage (from the project root):
+    python -m benchmarks.tensorboard_startup [num_processes]
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+
+STARTUP_DELAY = 1.0
+NUM_PROCESSES = 3
+
+STANDIN_TENSORBOARD = f'''#!{sys.executable}
+import sys, time, http.server
+server = http.server.HTTPServer(('0.0.0.0', 0), http.server.SimpleHTTPRequestHandler)
+time.sleep({STARTUP_DELAY})
+print(f'TensorBoard 0.0-standin at http://localhost:{{server.server_port}} (Press CTRL+C to quit)', file=sys.stderr, flush=True)
+server.serve_forever()
+'''
+
+STANDIN_NGROK = f'''#!{sys.executable}
+import sys, json, time, http.server
+log_file = [arg for arg in sys.argv if arg.startswith('--log=')][0][len('--log='):]
+started = time.time()
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    def do_GET(self):
+        tunnels = [dict(public_url='https://standin.ngrok.io', config=dict(addr=sys.argv[2]))] if time.time() - started > {STARTUP_DELAY} else []
+        body = json.dumps(dict(tunnels=tunnels)).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, *args):
+        pass
+
+server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+with open(log_file, 'a') as log:
+    print(json.dumps(dict(obj='web', msg='starting web service', addr=f'127.0.0.1:{{server.server_port}}')), file=log, flush=True)
+server.serve_forever()
+'''
+
+CHILD = '''
+import sys, json, time
+import tensorboard
+start = time.perf_counter()
+server = tensorboard.Server(sys.argv[1], closeable=False, shared=True, command=[sys.argv[2]])
+attached = time.perf_counter() - start
+public_url = server.public_url
+print(json.dumps(dict(attached=attached, public_url=time.perf_counter() - start, pid=server.pid, url=public_url)))
+'''
+
+def write_executable(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+    return path
+
+if __name__ == '__main__':
+    num_processes = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_PROCESSES
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ['TENSORBOARD_REGISTRY'] = f'{temp_dir}/registry'
+        os.environ['NGROK_BINARY'] = write_executable(f'{temp_dir}/ngrok', STANDIN_NGROK)
+        standin_tensorboard = write_executable(f'{temp_dir}/tensorboard', STANDIN_TENSORBOARD)
+        logdir = f'{temp_dir}/runs'
+
+        import tensorboard
+        import ngrok
+
+        start = time.perf_counter()
+        server = tensorboard.Server(logdir, closeable=False, shared=True, command=[standin_tensorboard])
+        attached = time.perf_counter() - start
+        public_url = server.public_url
+        print(f'{"process":>8} {"server":>9} {"+ tunnel":>9}')
+        print(f'{"first":>8} {attached:8.3f}s {time.perf_counter() - start:8.3f}s')
+
+        for i in range(num_processes):
+            output = subprocess.run([sys.executable, '-c', CHILD, logdir, standin_tensorboard], capture_output=True, text=True, check=True, env=dict(os.environ, PYTHONPATH=os.getcwd()))
+            child = json.loads(output.stdout.strip().splitlines()[-1])
+            if child['pid'] != server.pid or child['url'] != public_url:
+                raise Exception(f"Expected process {i + 1} to reuse the server {server.pid} and tunnel {public_url}, got {child}")
+            print(f'{f"#{i + 1}":>8} {child["attached"]:8.3f}s {child["public_url"]:8.3f}s')
+
+        # Stops the shared server and tunnel
+        pids = [server.pid, server.ngrok.pid]
+        tensorboard.Server(logdir, closeable=True, shared=True, command=[standin_tensorboard]).close()
+        time.sleep(0.1)
+        if any(ngrok.is_alive(pid) for pid in pids):
+            raise Exception(f"Expected the stand-in processes {pids} to be stopped")
@@ -0,0 +1,169 @@
+import os
+import glob
+import json
+import queue
+import logging
+import threading
+import traceback
+import tensorflow as tf
+
+logger = logging.getLogger('checkpoints')
+
+INDEX_FILE = 'checkpoints.json'
+
+class CheckpointError(Exception):
+    """
+    Raised on the training loop when the background checkpoint writer fails
+    """
+    pass
+
+class AsyncCheckpointer:
+    """
+    Saves checkpoints of a training session without blocking it.
+
+    `save()` only copies the variables into NumPy arrays (A single `session.run`), the checkpoint files are written by a background thread.
+    At most one snapshot waits for the writer: If writing is slower than saving, `save()` waits for the queued one to be taken, instead of piling snapshots up in memory.
+    They are standard TF checkpoints (`{run_dir}/checkpoint.ckpt-{step}`), that can be restored by a `tf.train.Saver` of the training graph.
+
+    Retention: The last `keep` checkpoints (At least 1) are kept, plus the one with the best test profit (See `save(test_profit=...)`).
+    The checkpoints and their test profits are listed on `{run_dir}/checkpoints.json` (See `find_checkpoint`).
+    The TF `checkpoint` state file is also kept up to date, so `tf.train.latest_checkpoint(run_dir)` works.
+
+    Arguments:
+    - variables: Variables to save, defaults to every global variable (Like `tf.train.Saver()`)
+    """
+    def __init__(self, run_dir, variables=None, keep=5, name='checkpoint.ckpt'):
+        if keep < 1:
+            raise Exception("Expected keep to be at least 1 (The latest checkpoint is always kept)")
+        if variables is None:
+            variables = tf.global_variables()
+        self.run_dir = run_dir
+        self.keep = keep
+        self.name = name
+        self.variables = {variable.op.name: variable for variable in variables}
+        self.best_test_profit = None
+        self.index = dict(latest=None, best=None, best_test_profit=None, checkpoints=[])
+        self.error = None
+        self.last_step = None
+
+        # The writer has its own graph and session, with a copy of each variable initialized from the snapshots
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.placeholders = {}
+            copies = {}
+            for name, variable in self.variables.items():
+                self.placeholders[name] = tf.placeholder(variable.dtype.base_dtype, shape=variable.shape)
+                copies[name] = tf.Variable(self.placeholders[name], trainable=False, collections=[])
+            self.initializer = tf.variables_initializer(list(copies.values()))
+            self.saver = tf.train.Saver(copies, max_to_keep=None)
+        self.session = tf.Session(graph=self.graph)
+
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._writer, daemon=True)
+        self.thread.start()
+
+    def is_best(self, test_profit):
+        return self.best_test_profit is None or test_profit > self.best_test_profit
+
+    def save(self, session, step, test_profit=None):
+        """
+        Snapshots the variables of `session`, and queues them to be written as the checkpoint of `step` (Waiting if a previous snapshot is still queued).
+
+        If `test_profit` is the best seen so far, the checkpoint is kept as the best one.
+        """
+        self._raise_error()
+        if test_profit is not None:
+            test_profit = float(test_profit)
+        best = test_profit is not None and self.is_best(test_profit)
+        if best:
+            self.best_test_profit = test_profit
+        values = session.run(self.variables)
+        self.last_step = int(step)
+        self.queue.put((values, int(step), test_profit, best))
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    self._write(*item)
+            except BaseException:
+                self.error = CheckpointError(f'Checkpoint writer failed:\n{traceback.format_exc()}')
+            finally:
+                self.queue.task_done()
+
+    def _write(self, values, step, test_profit, best):
+        self.session.run(self.initializer, feed_dict={self.placeholders[name]: value for name, value in values.items()})
+        prefix = f'{self.name}-{step}'
+        self.saver.save(self.session, f'{self.run_dir}/{prefix}', write_meta_graph=False, write_state=False)
+        logger.debug(f'Checkpoint written: {prefix}')
+
+        checkpoints = [checkpoint for checkpoint in self.index['checkpoints'] if checkpoint['prefix'] != prefix]
+        checkpoints.append(dict(prefix=prefix, step=step, test_profit=test_profit))
+        self.index['latest'] = prefix
+        if best:
+            self.index['best'] = prefix
+            self.index['best_test_profit'] = test_profit
+
+        kept = checkpoints[-self.keep:]
+        for checkpoint in checkpoints[:-self.keep]:
+            if checkpoint['prefix'] == self.index['best']:
+                kept.insert(0, checkpoint)
+            else:
+                for filename in glob.glob(f'{self.run_dir}/{checkpoint["prefix"]}.*'):
+                    os.remove(filename)
+        self.index['checkpoints'] = kept
+
+        with open(f'{self.run_dir}/{INDEX_FILE}.tmp', 'w') as f:
+            json.dump(self.index, f, indent=2)
+        os.replace(f'{self.run_dir}/{INDEX_FILE}.tmp', f'{self.run_dir}/{INDEX_FILE}')
+        tf.train.update_checkpoint_state(self.run_dir, prefix, [checkpoint['prefix'] for checkpoint in kept])
+
+    def _raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def flush(self):
+        """
+        Waits until every queued checkpoint is written
+        """
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.session.close()
+        self._raise_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def __repr__(self):
+        return f'AsyncCheckpointer({self.run_dir}, latest={self.index["latest"]}, best={self.index["best"]}, queued={self.queue.qsize()})'
+
+def find_checkpoint(run_dir, which='latest'):
+    """
+    Returns the checkpoint prefix of a run directory.
+
+    - which: 'latest' or 'best' (Best test profit. Falls back to the latest checkpoint if no checkpoint was tested)
+
+    Runs from before `AsyncCheckpointer` have a single `checkpoint.ckpt`, which is returned for both.
+    """
+    if which not in ('latest', 'best'):
+        raise Exception("Expected which to be 'latest' or 'best'")
+
+    index_file = f'{run_dir}/{INDEX_FILE}'
+    if not os.path.exists(index_file):
+        return f'{run_dir}/checkpoint.ckpt'
+
+    with open(index_file) as f:
+        index = json.load(f)
+    prefix = index['best'] if which == 'best' and index['best'] is not None else index['latest']
+    return f'{run_dir}/{prefix}'
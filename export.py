@@ -0,0 +1,185 @@
+"""
+Frozen inference graphs: A trained trader as a standalone `.pb` file, with only the ops needed for its decisions.
+
+The graph of `trader.build_graph` also has the simulator, the per-day errors, the evaluation metrics and summaries, and the variables.
+`export_frozen_graph` keeps the trader outputs only: The variables are frozen into constants, everything else is pruned, and the graph is optimized by Grappler.
+Its input ends on the last historic day: The future window of `inputs/stock_history` is only read by the simulator and the errors, not by the trader.
+`FrozenTrader` loads and runs it, without this project's graph building code.
+
+Usage (from the project root):
+    python export.py runs/<timestamp> [trader.pb] [--which best] [--graph-params "{'historic_window_size': 10}"]
+"""
+import os
+import time
+import logging
+import argparse
+import ast
+import itertools
+import tensorflow as tf
+from tensorflow.core.protobuf import rewriter_config_pb2
+from tensorflow.python.grappler import tf_optimizer
+
+import trader
+import checkpoints
+
+logger = logging.getLogger('export')
+
+INPUT = 'inputs/history'
+OUTPUTS = ['outputs/order_prices', 'outputs/buy_amount', 'outputs/predictions']
+
+def build_inference_graph(graph_params={}):
+    """
+    Builds the training graph (with `graph_params`, always unrolled and without check_numerics), and stacks the trader outputs of every day as:
+    - outputs/order_prices: tensor[minibatch, company, day, response] -> [sell_low_price, sell_high_price, buy_price]
+    - outputs/buy_amount: tensor[minibatch, company, day], unnormalized
+    - outputs/predictions: tensor[minibatch, company, day, future_day, feature]
+
+    The historic window of the last day ends on day `graph.history_days` of `inputs/stock_history` (The days after it are its future window)
+    """
+    graph = trader.build_graph(**dict(graph_params, day_loop='unrolled', check_numerics=False, input_mode='placeholder'))
+    operations = {operation.name for operation in graph.get_operations()}
+    days = list(itertools.takewhile(lambda day: f'trading/day_{day}/trader/prediction/buy_amount' in operations, itertools.count()))
+
+    with graph.as_default(), tf.name_scope('outputs'):
+        tf.stack([graph.get_tensor_by_name(f'trading/day_{day}/trader/denormalize_prices/trade_decisions/value:0') for day in days], axis=2, name='order_prices')
+        tf.stack([graph.get_tensor_by_name(f'trading/day_{day}/trader/prediction/buy_amount:0') for day in days], axis=2, name='buy_amount')
+        tf.stack([graph.get_tensor_by_name(f'trading/day_{day}/trader/denormalize_prices/predictions/value:0') for day in days], axis=2, name='predictions')
+    graph.history_days = len(days) + graph.historic_window_size - 1
+    return graph
+
+def trim_input(graph_def, total_days, history_days, num_features, outputs=OUTPUTS):
+    """
+    Replaces the `inputs/stock_history` placeholder (`total_days` long) of a GraphDef by `inputs/history`, that ends on the last historic day (`history_days` long).
+
+    The days after it are only there to fill the shape of `inputs/stock_history` (They aren't read by the trader outputs), so they are filled with the last day.
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        with tf.name_scope('inputs'):
+            history = tf.placeholder(tf.float32, shape=(None, None, history_days, num_features), name='history')
+            padding = tf.tile(history[:, :, -1:], [1, 1, total_days - history_days, 1])
+            stock_history = tf.concat([history, padding], axis=2, name='padded_history')
+        tf.import_graph_def(graph_def, input_map={'inputs/stock_history:0': stock_history}, name='')
+    return tf.graph_util.extract_sub_graph(graph.as_graph_def(), outputs)
+
+def optimize_graph_def(graph_def, outputs=OUTPUTS):
+    """
+    Runs the Grappler optimizers (constant folding, arithmetic and dependency optimization, ...) over a frozen GraphDef
+    """
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+        # Grappler keeps the ops fetched by the `train_op` collection
+        for output in outputs:
+            graph.add_to_collection('train_op', graph.get_operation_by_name(output))
+        meta_graph = tf.train.export_meta_graph(graph=graph)
+
+    config = tf.ConfigProto()
+    rewriter = config.graph_options.rewrite_options
+    rewriter.constant_folding = rewriter_config_pb2.RewriterConfig.ON
+    rewriter.arithmetic_optimization = rewriter_config_pb2.RewriterConfig.ON
+    rewriter.dependency_optimization = rewriter_config_pb2.RewriterConfig.ON
+    rewriter.layout_optimizer = rewriter_config_pb2.RewriterConfig.OFF
+    rewriter.min_graph_nodes = -1
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
+
+def export_frozen_graph(checkpoint, path, graph_params={}, which='latest', optimize=True):
+    """
+    Exports a trained trader as a frozen GraphDef.
+
+    Arguments:
+    - checkpoint: A checkpoint prefix, or a run directory (e.g. `runs/<timestamp>`), to take its `which` checkpoint from (See `checkpoints.find_checkpoint`)
+    - path: The `.pb` file written
+    - graph_params: The `build_graph` arguments the checkpoint was trained with
+    - optimize: Runs Grappler over the frozen graph (See `optimize_graph_def`)
+
+    Returns a dict with the number of nodes of the `full` graph, the `frozen` (pruned) one and the `optimized` one
+    """
+    if os.path.isdir(checkpoint):
+        checkpoint = checkpoints.find_checkpoint(checkpoint, which)
+
+    graph = build_inference_graph(graph_params)
+    with tf.Session(graph=graph) as session:
+        with graph.as_default():
+            tf.train.Saver().restore(session, checkpoint)
+        full_graph_def = graph.as_graph_def()
+        graph_def = tf.graph_util.convert_variables_to_constants(session, full_graph_def, OUTPUTS)
+
+    _, _, total_days, num_features = graph.get_tensor_by_name('inputs/stock_history:0').shape.as_list()
+    graph_def = trim_input(graph_def, total_days, graph.history_days, num_features)
+
+    nodes = dict(full=len(full_graph_def.node), frozen=len(graph_def.node))
+    if optimize:
+        graph_def = optimize_graph_def(graph_def)
+        nodes['optimized'] = len(graph_def.node)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    logger.info(f'Exported {checkpoint} to {path}: {nodes}')
+    return nodes
+
+class FrozenTrader:
+    """
+    Runs a graph exported by `export_frozen_graph`.
+
+    Usage:
+        with FrozenTrader('trader.pb') as frozen:
+            outputs = frozen.run(history)  # tensor[minibatch, company, day, feature], the last `frozen.num_days` days
+
+    Returns the outputs of `build_inference_graph`: {'order_prices', 'buy_amount', 'predictions'}, one decision per day after the first historic window.
+    The last decision (`[:, :, -1]`) is the one for the day after the last day of `history`.
+    """
+    def __init__(self, path, session_config=None):
+        graph_def = tf.GraphDef()
+        with open(path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.input = self.graph.get_tensor_by_name(f'{INPUT}:0')
+        self.outputs = {
+            output.split('/')[-1]: self.graph.get_tensor_by_name(f'{output}:0')
+            for output in OUTPUTS
+        }
+        self.session = tf.Session(graph=self.graph, config=session_config)
+
+    @property
+    def num_days(self):
+        """
+        Days of history of each input (`inputs/history` shape[2], See `trim_input`)
+        """
+        return self.input.shape[2].value
+
+    def run(self, history):
+        return self.session.run(self.outputs, feed_dict={self.input: history})
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def __repr__(self):
+        return f'FrozenTrader({len(self.graph.as_graph_def().node)} nodes, {self.num_days} days)'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('checkpoint', help='Run directory or checkpoint prefix')
+    parser.add_argument('path', nargs='?', help='Output file, defaults to {run_dir}/trader.pb')
+    parser.add_argument('--which', default='latest', choices=['latest', 'best'])
+    parser.add_argument('--graph-params', default='{}', help='build_graph arguments of the run, as a Python dict literal')
+    parser.add_argument('--no-optimize', action='store_true')
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        run_dir = args.checkpoint if os.path.isdir(args.checkpoint) else os.path.dirname(args.checkpoint)
+        path = f'{run_dir}/trader.pb'
+    start = time.perf_counter()
+    nodes = export_frozen_graph(args.checkpoint, path, ast.literal_eval(args.graph_params), which=args.which, optimize=not args.no_optimize)
+    print(f'Exported {path} in {time.perf_counter() - start:.1f}s -- nodes: {", ".join(f"{name} {count}" for name, count in nodes.items())}')
@@ -0,0 +1,254 @@
+"""
+Rolling technical indicators, as extra feature channels for the trader (See `minibatch_producer(indicators=...)`)
+
+They give the trader a long context (50-200 days) without widening its `historic_window_size`: Each day carries a few indicators summarizing the days before it.
+
+Every indicator is a rolling statistic computed with cumulative sums, so a symbol with n days costs O(n), whatever the indicator length.
+New days can be appended with an `IndicatorStream`, which updates running sums instead: A new day costs O(1), whatever the history.
+
+The first days of a symbol, with less history than an indicator needs, use every day available (Like a shorter indicator).
+
+All indicators are scale-free, so they don't need to be normalized by the trader:
+- SMA: Log-perc of the close price wrt its simple moving average
+- Volatility: Standard deviation of the daily log-perc variations of the close price
+- RSI: Relative strength index (With simple moving averages of the gains and losses, i.e. Cutler's RSI), minus 50
+- VolumeZScore: Z-score of the volume wrt its moving average and standard deviation
+"""
+import math
+import collections
+import numpy as np
+from market import *
+
+def rolling_sum(values, days):
+    """
+    Sum of the `days` rows ending on each row of `values` (array[row, ...]), or of every row before it on the first rows.
+
+    Returns (sums, counts): float64 array[row, ...], and int array[row] with the number of rows summed.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    sums = np.concatenate([np.zeros_like(values[:1]), np.cumsum(values, axis=0)])
+    ends = np.arange(1, len(values) + 1)
+    starts = np.maximum(ends - days, 0)
+    return sums[ends] - sums[starts], ends - starts
+
+def rolling_mean(values, days):
+    sums, counts = rolling_sum(values, days)
+    return sums / counts.reshape([-1] + [1] * (sums.ndim - 1))
+
+def rolling_std(values, days):
+    """
+    Rolling standard deviation (See `rolling_sum`). Values are centered on their first row, to keep cumulative sums of squares small.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values - values[:1]
+    mean = rolling_mean(values, days)
+    return np.sqrt(np.maximum(rolling_mean(values * values, days) - mean * mean, 0))
+
+def _variations(close):
+    """
+    Daily log-perc variations of the close prices. The first row has no previous day, and no variation.
+    """
+    log_close = np.log(np.maximum(np.asarray(close, dtype=np.float64), 1e-6))
+    return 100 * np.diff(log_close, prepend=log_close[:1])
+
+class _RollingWindow:
+    """
+    The last `days` values of a stream, with their running sum and sum of squares (See `IndicatorStream`).
+
+    With `centered`, values are centered on the first one, like `rolling_std`.
+    """
+    def __init__(self, days, centered=False):
+        self.days = days
+        self.centered = centered
+        self.center = None
+        self.values = collections.deque()
+        self.sum = 0.
+        self.sum_squares = 0.
+
+    def append(self, value):
+        if self.center is None:
+            self.center = value if self.centered else 0.
+        value -= self.center
+        self.values.append(value)
+        self.sum += value
+        self.sum_squares += value * value
+        if len(self.values) > self.days:
+            value = self.values.popleft()
+            self.sum -= value
+            self.sum_squares -= value * value
+
+    def total(self):
+        return self.sum + self.center * len(self.values)
+
+    def mean(self):
+        return self.center + self.sum / len(self.values)
+
+    def std(self):
+        mean = self.sum / len(self.values)
+        return math.sqrt(max(self.sum_squares / len(self.values) - mean * mean, 0))
+
+def _variation_stream():
+    """
+    `_variations`, one close price at a time
+    """
+    previous = None
+    def update(close):
+        nonlocal previous
+        log_close = math.log(max(close, 1e-6))
+        variation = 0. if previous is None else 100 * (log_close - previous)
+        previous = log_close
+        return variation
+    return update
+
+class SMA:
+    def __init__(self, days):
+        self.days = days
+        self.name = f'sma_{days}'
+        self.lookback = days
+
+    def compute(self, ohlcv):
+        close = np.maximum(ohlcv[:, FEATURE_CLOSE], 1e-6)
+        return 100 * np.log(close / rolling_mean(close, self.days))
+
+    def stream(self):
+        window = _RollingWindow(self.days)
+        def update(row):
+            close = max(row[FEATURE_CLOSE], 1e-6)
+            window.append(close)
+            return 100 * math.log(close / window.mean())
+        return update
+
+class Volatility:
+    def __init__(self, days):
+        self.days = days
+        self.name = f'volatility_{days}'
+        self.lookback = days + 1
+
+    def compute(self, ohlcv):
+        return rolling_std(_variations(ohlcv[:, FEATURE_CLOSE]), self.days)
+
+    def stream(self):
+        variations = _variation_stream()
+        window = _RollingWindow(self.days, centered=True)
+        def update(row):
+            window.append(variations(row[FEATURE_CLOSE]))
+            return window.std()
+        return update
+
+class RSI:
+    def __init__(self, days):
+        self.days = days
+        self.name = f'rsi_{days}'
+        self.lookback = days + 1
+
+    def compute(self, ohlcv):
+        variations = _variations(ohlcv[:, FEATURE_CLOSE])
+        gains, _ = rolling_sum(np.maximum(variations, 0), self.days)
+        losses, _ = rolling_sum(np.maximum(-variations, 0), self.days)
+        total = gains + losses
+        return np.where(total > 0, 100 * gains / np.where(total > 0, total, 1), 50) - 50
+
+    def stream(self):
+        variations = _variation_stream()
+        gains, losses = _RollingWindow(self.days), _RollingWindow(self.days)
+        def update(row):
+            variation = variations(row[FEATURE_CLOSE])
+            gains.append(max(variation, 0))
+            losses.append(max(-variation, 0))
+            total = gains.total() + losses.total()
+            return (100 * gains.total() / total if total > 0 else 50) - 50
+        return update
+
+class VolumeZScore:
+    def __init__(self, days):
+        self.days = days
+        self.name = f'volume_zscore_{days}'
+        self.lookback = days
+
+    def compute(self, ohlcv):
+        volume = np.asarray(ohlcv[:, FEATURE_VOLUME], dtype=np.float64)
+        std = rolling_std(volume, self.days)
+        deviation = volume - rolling_mean(volume, self.days)
+        return np.where(std > 0, deviation / np.where(std > 0, std, 1), 0)
+
+    def stream(self):
+        window = _RollingWindow(self.days, centered=True)
+        def update(row):
+            window.append(row[FEATURE_VOLUME])
+            std = window.std()
+            return (row[FEATURE_VOLUME] - window.mean()) / std if std > 0 else 0.
+        return update
+
+DEFAULT_INDICATORS = [SMA(50), SMA(200), Volatility(20), RSI(14), VolumeZScore(50)]
+
+class IndicatorEngine:
+    """
+    Computes a list of indicators over the OHLCV rows of a symbol.
+
+    - names: The name of each indicator, in the order of the channels
+    - lookback: Rows of history needed to compute the indicators of a new row
+    """
+    def __init__(self, indicators=DEFAULT_INDICATORS):
+        self.indicators = list(indicators)
+        self.names = [indicator.name for indicator in self.indicators]
+        self.lookback = max(indicator.lookback for indicator in self.indicators)
+
+    def __len__(self):
+        return len(self.indicators)
+
+    def compute(self, ohlcv, history=None):
+        """
+        Arguments:
+        - ohlcv: array[row][low, high, open, close, volume], consecutive days of a symbol
+        - history: The rows of the symbol right before `ohlcv`, if any. Only the last `lookback` rows are used.
+
+        Returns float32 array[row][indicator]
+        """
+        ohlcv = np.asarray(ohlcv, dtype=np.float64)
+        skip = 0
+        if history is not None and len(history):
+            history = np.asarray(history[-self.lookback:], dtype=np.float64)
+            ohlcv = np.concatenate([history, ohlcv])
+            skip = len(history)
+        if len(ohlcv) == 0:
+            return np.zeros([0, len(self)], dtype=np.float32)
+        features = np.stack([indicator.compute(ohlcv) for indicator in self.indicators], axis=1)
+        return features[skip:].astype(np.float32)
+
+    def __repr__(self):
+        return f'IndicatorEngine({", ".join(self.names)})'
+
+class IndicatorStream:
+    """
+    Computes the indicators of a symbol one day at a time, e.g. as new days arrive.
+
+    Each indicator keeps the running sums of its window (See the `stream()` of each indicator class), so a new day costs O(1) per indicator,
+    whatever its length and the days seen before, where `engine.compute` costs O(days) over the whole history.
+    The indicators are the same as `engine.compute` over all the rows at once, up to float64 rounding (The running sums are updated, not recomputed).
+
+    The last `engine.lookback` rows are kept as `history`: A new stream built on them continues this one (See `inference.IncrementalTrader.restore_state`).
+    """
+    def __init__(self, engine, history=None):
+        self.engine = engine
+        self.rows = collections.deque(maxlen=engine.lookback)
+        self.updates = [indicator.stream() for indicator in engine.indicators]
+        if history is not None:
+            self.append(history)
+
+    @property
+    def history(self):
+        """
+        float32 array[row][low, high, open, close, volume], the last `engine.lookback` rows appended
+        """
+        return np.array(self.rows, dtype=np.float32).reshape([-1, NUM_FEATURES])
+
+    def append(self, ohlcv):
+        """
+        Appends new rows, and returns their float32 array[row][indicator]
+        """
+        ohlcv = np.asarray(ohlcv, dtype=np.float32).reshape([-1, NUM_FEATURES])
+        features = np.empty([len(ohlcv), len(self.engine)], dtype=np.float32)
+        for i, row in enumerate(ohlcv.astype(np.float64).tolist()):
+            self.rows.append(ohlcv[i])
+            features[i] = [update(row) for update in self.updates]
+        return features
@@ -0,0 +1,215 @@
+"""
+Stateful, day-by-day inference with a trained trader.
+"""
+import os
+import logging
+import numpy as np
+import tensorflow as tf
+
+import trader
+import stock_dataset
+from indicators import IndicatorEngine, IndicatorStream
+from market import *
+
+logger = logging.getLogger('inference')
+
+class IncrementalTrader:
+    """
+    Runs a trained trader one day at a time, keeping the LSTM state of each symbol between calls.
+
+    Training replays `warmup_days` of history from `first_inner_state` for every minibatch.
+    Here, each call to `step` takes a single new day per symbol, and costs O(1) regardless of how many days were seen before.
+
+    Arguments:
+    - checkpoint: A checkpoint prefix (e.g. `checkpoints.find_checkpoint('runs/<timestamp>', 'best')`), or a run directory to take the latest checkpoint from
+    - symbols: The symbols being traded. The order is the same used in every array passed to / returned by this class
+    - historic_window_size, future_window_size, precomputed_features, indicators: Must match the `build_graph` parameters the checkpoint was trained with
+
+    With `indicators`, each symbol has an `IndicatorStream`: Every new day updates the running sums of its indicators, in O(1).
+    Until a symbol has seen `lookback` days, its indicators use the days available (Like the first days of a symbol in the dataset).
+    """
+    def __init__(self, checkpoint, symbols, historic_window_size=5, future_window_size=5, precomputed_features=False, indicators=None, session_config=None):
+        if os.path.isdir(checkpoint):
+            checkpoint = tf.train.latest_checkpoint(checkpoint)
+        self.symbols = list(symbols)
+        self.historic_window_size = historic_window_size
+        self.precomputed_features = precomputed_features
+        if indicators is not None and not isinstance(indicators, IndicatorEngine):
+            indicators = IndicatorEngine(indicators)
+        self.indicator_engine = indicators
+        num_symbols = len(self.symbols)
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            # Same scopes as `trader.build_graph`, so the variable names match the checkpoint
+            trainable_variables_node = tf.name_scope("trainable_parameters")
+            with tf.name_scope("trading"):
+                build_trader, first_inner_state = trader.trader_builder(
+                    minibatch_size = 1,
+                    num_companies = num_symbols,
+                    historic_window_size = historic_window_size,
+                    future_window_size = future_window_size,
+                    trainable_variables_node = trainable_variables_node)
+
+            with tf.name_scope("inputs"):
+                self.history_input = tf.placeholder(tf.float32, shape=(num_symbols, historic_window_size, NUM_FEATURES), name='history')
+                self.log_history_input = None
+                if precomputed_features:
+                    self.log_history_input = tf.placeholder(tf.float32, shape=(num_symbols, historic_window_size, NUM_LOG_FEATURES), name='log_history')
+                self.indicators_input = None
+                if indicators is not None:
+                    self.indicators_input = tf.placeholder(tf.float32, shape=(num_symbols, len(indicators)), name='indicators')
+                self.inner_state_inputs = tuple(
+                    tf.nn.rnn_cell.LSTMStateTuple(
+                        tf.placeholder_with_default(c, c.shape, name=f'layer_{layer}_c'),
+                        tf.placeholder_with_default(h, h.shape, name=f'layer_{layer}_h'))
+                    for layer, (c, h) in enumerate(first_inner_state)
+                )
+                state = trader.TradingState(
+                    money = tf.zeros([1, 1]),
+                    stocks = tf.zeros([1, num_symbols]),
+                    stock_prices = tf.zeros([1, num_symbols]),
+                    inner_state = self.inner_state_inputs)
+
+            with tf.name_scope("trader"):
+                trade_prices, buy_amount, predictions, inner_state = build_trader(
+                    state = state,
+                    historic_data = self.history_input[tf.newaxis],
+                    log_historic_data = None if self.log_history_input is None else self.log_history_input[tf.newaxis],
+                    indicators = None if self.indicators_input is None else self.indicators_input[tf.newaxis])
+
+            self.outputs = dict(
+                trade_prices = trade_prices[0],
+                buy_amount = buy_amount[0],
+                predictions = predictions[0],
+                inner_state = inner_state,
+            )
+            self.session = tf.Session(graph=self.graph, config=session_config)
+            tf.train.Saver().restore(self.session, checkpoint)
+
+        self.zero_inner_state = self.session.run(first_inner_state)
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets every day seen so far
+        """
+        self.history = np.zeros([len(self.symbols), self.historic_window_size, NUM_FEATURES], dtype=np.float32)
+        self.days_seen = np.zeros(len(self.symbols), dtype=np.int64)
+        self.inner_state = [(np.copy(c), np.copy(h)) for c, h in self.zero_inner_state]
+        if self.indicator_engine is not None:
+            self.indicator_streams = [IndicatorStream(self.indicator_engine) for symbol in self.symbols]
+            self.indicators = np.zeros([len(self.symbols), len(self.indicator_engine)], dtype=np.float32)
+
+    def step(self, day_data, available=None):
+        """
+        Feeds a new day of data, and returns the trader decisions for the next day.
+
+        Arguments:
+        - day_data: array[symbol][low, high, open, close, volume]
+        - available: bool array[symbol], symbols with data today. The others are left untouched (history and state), and get no decision.
+
+        Returns: dict with
+        - trade_prices: array[symbol, response] -> [sell_low_price, sell_high_price, buy_price]
+        - buy_amount: array[symbol], unnormalized
+        - predictions: array[symbol, future_day, feature]
+        - ready: bool array[symbol], symbols that have seen at least `historic_window_size` days.
+          Outputs are NaN for the symbols that are not ready, or not available today (Their decision would come from stale history).
+        """
+        if available is None:
+            available = np.ones(len(self.symbols), dtype=bool)
+        available = np.asarray(available, dtype=bool)
+
+        day_data = np.asarray(day_data, dtype=np.float32)
+        self.history[available] = np.concatenate([self.history[available, 1:], day_data[available, np.newaxis]], axis=1)
+        self.days_seen[available] += 1
+        ready = self.days_seen >= self.historic_window_size
+        if self.indicator_engine is not None:
+            for i in np.flatnonzero(available):
+                self.indicators[i] = self.indicator_streams[i].append(day_data[i])[-1]
+
+        feed_dict = {self.history_input: self.history}
+        if self.log_history_input is not None:
+            # The mean volume of the last day is the one of the whole window
+            feed_dict[self.log_history_input] = stock_dataset.log_features(self.history, self.historic_window_size)
+        if self.indicators_input is not None:
+            feed_dict[self.indicators_input] = self.indicators
+        for (c_input, h_input), (c, h) in zip(self.inner_state_inputs, self.inner_state):
+            feed_dict[c_input] = c
+            feed_dict[h_input] = h
+        outputs = self.session.run(self.outputs, feed_dict=feed_dict)
+
+        # Only symbols with new data and a full window move their state forward
+        updated = available & ready
+        for (c, h), (new_c, new_h) in zip(self.inner_state, outputs['inner_state']):
+            c[updated] = new_c[updated]
+            h[updated] = new_h[updated]
+
+        result = {
+            name: np.where(updated.reshape([-1] + [1] * (outputs[name].ndim - 1)), outputs[name], np.nan)
+            for name in ['trade_prices', 'buy_amount', 'predictions']
+        }
+        result['ready'] = ready
+        return result
+
+    def save_state(self, path):
+        """
+        Saves the per-symbol history and LSTM state (And the history of the indicator streams), e.g. at the end of a nightly job
+        """
+        arrays = dict(symbols=np.array(self.symbols), history=self.history, days_seen=self.days_seen)
+        for layer, (c, h) in enumerate(self.inner_state):
+            arrays[f'layer_{layer}_c'] = c
+            arrays[f'layer_{layer}_h'] = h
+        if self.indicator_engine is not None:
+            # The stream histories are aligned on their last row
+            indicator_history = np.zeros([len(self.symbols), self.indicator_engine.lookback, NUM_FEATURES], dtype=np.float32)
+            for i, stream in enumerate(self.indicator_streams):
+                if len(stream.history):
+                    indicator_history[i, -len(stream.history):] = stream.history
+            arrays.update(indicator_history=indicator_history, indicators=self.indicators)
+        np.savez(path, **arrays)
+
+    def restore_state(self, path):
+        """
+        Restores the state saved by `save_state`.
+
+        Symbols are matched by name: Symbols that weren't saved start from scratch, and saved symbols that aren't traded anymore are ignored.
+        """
+        self.reset()
+        with np.load(path) as saved:
+            saved_index = {symbol: i for i, symbol in enumerate(saved['symbols'])}
+            rows = [(i, saved_index[symbol]) for i, symbol in enumerate(self.symbols) if symbol in saved_index]
+            if len(rows) < len(self.symbols):
+                logger.warning(f'{len(self.symbols) - len(rows)} symbols have no saved state')
+            if not rows:
+                return
+            dst, src = map(list, zip(*rows))
+
+            self.history[dst] = saved['history'][src]
+            self.days_seen[dst] = saved['days_seen'][src]
+            for layer, (c, h) in enumerate(self.inner_state):
+                c[dst] = saved[f'layer_{layer}_c'][src]
+                h[dst] = saved[f'layer_{layer}_h'][src]
+
+            if self.indicator_engine is None:
+                return
+            lookback = self.indicator_engine.lookback
+            if 'indicator_history' not in saved.files or saved['indicator_history'].shape[1] != lookback:
+                logger.warning('No saved indicator history, the indicators start from scratch')
+                return
+            indicator_history = saved['indicator_history']
+            self.indicators[dst] = saved['indicators'][src]
+            for i, j in rows:
+                self.indicator_streams[i] = IndicatorStream(self.indicator_engine, indicator_history[j, lookback - min(self.days_seen[i], lookback):])
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def __repr__(self):
+        return f'IncrementalTrader({len(self.symbols)} symbols{"" if self.indicator_engine is None else f", {self.indicator_engine}"})'
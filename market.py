@@ -0,0 +1,32 @@
+"""
+Layout of the market data and of the trader's orders, and the rules of the simulated stock exchange.
+
+Shared by the TensorFlow simulator (`trader`) and the NumPy backtester (`backtest`).
+"""
+
+FEATURE_LOW    = 0
+FEATURE_HIGH   = 1
+FEATURE_OPEN   = 2
+FEATURE_CLOSE  = 3
+FEATURE_VOLUME = 4
+NUM_FEATURES   = 5
+
+# Precomputed log-perc features (See `stock_dataset.log_features`), appended after the NUM_FEATURES raw features by `minibatch_producer(log_features=...)`
+# [FEATURE_LOW..FEATURE_VOLUME] are the log-perc of each raw feature, LOG_MEAN_VOLUME the log-perc of the mean volume of the historic window ending on that day
+LOG_MEAN_VOLUME  = 5
+NUM_LOG_FEATURES = 6
+
+# Floor of the prices and volumes before a division or a log (See `normalize`, `stock_dataset.log_features`)
+EPS = 1e-6
+
+RESPONSE_SELL_LOW    = 0
+RESPONSE_SELL_HIGH   = 1
+RESPONSE_BUY_PRICE   = 2
+RESPONSE_BUY_AMOUNT  = 3
+NUM_RESPONSES        = 4
+
+MONEY_TODAY = 0
+MONEY_TOMORROW = 1
+
+SELL_TRANSACTION_COST = 5 # 5 USD per transaction
+BUY_TRANSACTION_COST = 5  # 5 USD per transaction
@@ -1,6 +1,8 @@
 import logging
 import subprocess
 import os
+import signal
+import tempfile
 import requests
 import time
 import json
@@ -9,18 +11,47 @@ logger = logging.getLogger('ngrok')
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 logging.getLogger("ngrok").setLevel(logging.WARNING)
 
+NGROK_BINARY = os.environ.get('NGROK_BINARY', '/tmp/ngrok')
+
+def is_alive(pid):
+    """
+    Whether a process is running (Zombies of our own children count as dead)
+    """
+    try:
+        if os.waitpid(pid, os.WNOHANG)[0] == pid:
+            return False
+    except ChildProcessError:
+        pass
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
 class Ngrok:
     """
     NGrok is a public service that creates tunnels from local servers, making them available over the internet.
 
     In this project, we'll use it to tunnel tensorboard running inside a Colaboratory server to a public address that can be accessed outside the Jupyter frontend
 
+    The process logs to a file (`log_file`, a temporary file by default) instead of a pipe, so it can outlive this Python process (See `detached`, and `Ngrok.attach` to use it from another process).
+
+    - binary: The ngrok executable, defaults to `NGROK_BINARY` (The `NGROK_BINARY` environment variable, or `/tmp/ngrok`, downloaded if missing).
+      Any program with the same command line, log lines and `/api/tunnels` works, e.g. a local stand-in for tests.
+
     FIXME: While it does work, the link seems to break after a few minutes :/
     """
-    def __init__(self, *args):
+    def __init__(self, *args, binary=None, log_file=None, detached=False, timeout=10):
         self.args = args
+        self.binary = binary or NGROK_BINARY
+        self.public_url_cache = None
+        self.session = requests.Session()
 
-        if not os.path.exists("/tmp/ngrok"):
+        if not os.path.exists(self.binary):
+            if self.binary != '/tmp/ngrok':
+                raise Exception(f"Expected an ngrok binary at {self.binary}")
             logger.debug('Fetching ngrok')
             ret = subprocess.check_call(["wget", "https://bin.equinox.io/c/4VmDzA7iaHb/ngrok-stable-linux-amd64.zip", "-O", "/tmp/ngrok.zip"])
             if ret != 0:
@@ -30,46 +61,94 @@ class Ngrok:
             if ret != 0:
                 raise Exception("Failed to unzip ngrok")
 
+        if log_file is None:
+            fd, log_file = tempfile.mkstemp(prefix='ngrok-', suffix='.log')
+            os.close(fd)
+        self.log_file = log_file
+        open(self.log_file, 'w').close()
+
         logger.debug('Starting ngrok process')
-        self.process = subprocess.Popen(["/tmp/ngrok"] + list(args) + ["--log=stderr", "--log-format=json"], stderr=subprocess.PIPE)
+        self.process = subprocess.Popen([self.binary] + list(args) + [f"--log={self.log_file}", "--log-format=json"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=detached)
+        self.pid = self.process.pid
 
         try:
             self.admin_addr = None
-            for line in self.process.stderr:
-                line = json.loads(line)
-                if line.get('obj') == 'web' and line.get('msg') == 'starting web service':
-                    self.admin_addr = line['addr']
-                    logger.debug(f'ngrok local address: {self.admin_addr}')
-                    break
-
-            if self.admin_addr is None:
-                raise Exception("ngrok didn't bind to a local address!?")
+            start_time = time.time()
+            with open(self.log_file) as log:
+                while self.admin_addr is None:
+                    line = log.readline()
+                    if not line:
+                        if self.process.poll() is not None:
+                            raise Exception(f"ngrok exited with code {self.process.returncode}")
+                        if (time.time() - start_time) > timeout:
+                            raise TimeoutError("ngrok didn't bind to a local address")
+                        time.sleep(0.02)
+                        continue
+                    try:
+                        line = json.loads(line)
+                    except ValueError:
+                        continue
+                    if line.get('obj') == 'web' and line.get('msg') == 'starting web service':
+                        self.admin_addr = line['addr']
+                        logger.debug(f'ngrok local address: {self.admin_addr}')
 
         except:
             logger.warning('Initialization error, killing ngrok process')
             self.process.kill()
             raise
 
-    @property
-    def tunnels(self, timeout=5):
+    @classmethod
+    def attach(cls, pid, admin_addr, public_url=None):
+        """
+        Wraps an ngrok process that is already running, e.g. started by another Python process with `detached=True`
+        """
+        self = cls.__new__(cls)
+        self.args = ()
+        self.process = None
+        self.pid = pid
+        self.admin_addr = admin_addr
+        self.public_url_cache = public_url
+        self.session = requests.Session()
+        return self
+
+    def wait_for_tunnels(self, timeout=5):
+        """
+        Polls the tunnels on the admin API until there is one. Polls start every 50 ms and back off up to 400 ms, reusing the same connection.
+        """
         start_time = time.time()
+        delay = 0.05
 
         while True:
-            tunnels = requests.get(f'http://{self.admin_addr}/api/tunnels').json()['tunnels']
+            tunnels = self.session.get(f'http://{self.admin_addr}/api/tunnels').json()['tunnels']
             if len(tunnels) != 0:
                 return tunnels
             elif (time.time() - start_time) > timeout:
                 raise TimeoutError()
             else:
-                time.sleep(0.2)
-                continue
+                time.sleep(delay)
+                delay = min(2 * delay, 0.4)
+
+    @property
+    def tunnels(self):
+        return self.wait_for_tunnels()
 
     @property
     def public_url(self):
-        return self.tunnels[-1]['public_url']
+        if self.public_url_cache is None:
+            self.public_url_cache = self.tunnels[-1]['public_url']
+        return self.public_url_cache
+
+    @property
+    def alive(self):
+        return is_alive(self.pid)
 
     def close(self):
-        self.process.kill()
+        self.session.close()
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+        elif self.alive:
+            os.kill(self.pid, signal.SIGKILL)
 
     def __enter__(self):
         return self
@@ -87,10 +166,10 @@ class Ngrok:
 
 
 class Http (Ngrok):
-    def __init__(self, host='localhost', port=80):
+    def __init__(self, host='localhost', port=80, **kwargs):
         self.host = host
         self.port = port
-        Ngrok.__init__(self, 'http', f'{host}:{port}', '--bind-tls=true')
+        Ngrok.__init__(self, 'http', f'{host}:{port}', '--bind-tls=true', **kwargs)
 
     def __repr__(self):
         return f'Ngrok.Http(host={repr(self.host)}, port={repr(self.port)})'
@@ -1,6 +1,6 @@
 import tensorflow as tf
+from market import EPS as eps
 
-eps = 1e-6
 class perc:
     """
     Calculates the percentage difference of a value with respect to a reference.
@@ -34,6 +34,16 @@ class log_perc:
         with tf.name_scope(name):
             return tf.multiply(100., tf.log(tf.maximum(value, eps)/tf.maximum(wrt, eps)), name="value")
 
+    @staticmethod
+    def normalize_log(log_value, log_wrt=0.0, name='log_perc.normalize_log'):
+        """
+        Same as `normalize`, for a value and reference already in log-perc scale (i.e., `normalize(value)` and `normalize(wrt)`, See `stock_dataset.log_features`).
+
+        In log scale, normalizing is just a subtraction.
+        """
+        with tf.name_scope(name):
+            return tf.subtract(log_value, log_wrt, name="value")
+
     @staticmethod
     def denormalize(normalized_value, wrt=1.0, name='log_perc.denormalize'):
         with tf.name_scope(name):
@@ -0,0 +1,137 @@
+import logging
+import queue
+import threading
+import multiprocessing
+import traceback
+import time
+import numpy as np
+
+logger = logging.getLogger('prefetch')
+
+class WorkerError(Exception):
+    """
+    Raised on the consumer when a prefetch worker fails
+    """
+    pass
+
+def _worker(produce, kwargs, seed, batches, stop):
+    rng = np.random.default_rng(seed)
+    try:
+        while not stop.is_set():
+            item = produce(rng=rng, **kwargs)
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+    except BaseException:
+        item = WorkerError(f'Prefetch worker failed:\n{traceback.format_exc()}')
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+class Prefetcher:
+    """
+    Calls a minibatch producer on background workers, keeping a bounded queue of ready minibatches.
+
+    `produce` is called as `produce(rng=<Generator>, **kwargs)`, where each worker has its own `numpy.random.Generator` derived from `seed`.
+    This is the signature of the producer returned by `stock_dataset.minibatch_producer`.
+
+    Workers are threads by default. With `processes=True` they are forked processes, which avoids contention on the GIL but must pickle every minibatch back.
+
+    Counters:
+    - batches: Number of minibatches consumed
+    - stall_time: Total time (in seconds) the consumer waited for a minibatch
+    - queue_depth: Number of minibatches ready right now
+    - mean_queue_depth: Average number of ready minibatches seen by the consumer
+    """
+    def __init__(self, produce, queue_size=8, num_workers=1, processes=False, seed=None, **kwargs):
+        self.processes = processes
+        self.batches = 0
+        self.stall_time = 0.
+        self.total_queue_depth = 0
+
+        if processes:
+            context = multiprocessing.get_context('fork')
+            self.queue = context.Queue(queue_size)
+            self.stop = context.Event()
+            new_worker = context.Process
+        else:
+            self.queue = queue.Queue(queue_size)
+            self.stop = threading.Event()
+            new_worker = threading.Thread
+
+        self.workers = [
+            new_worker(target=_worker, args=(produce, kwargs, worker_seed, self.queue, self.stop), daemon=True)
+            for worker_seed in np.random.SeedSequence(seed).spawn(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    @property
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    @property
+    def mean_queue_depth(self):
+        return self.total_queue_depth / max(1, self.batches)
+
+    def get(self):
+        """
+        Returns the next minibatch, waiting for one to be ready if needed
+        """
+        self.total_queue_depth += self.queue_depth
+        start = time.perf_counter()
+        while True:
+            try:
+                item = self.queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if self.stop.is_set() or not any(worker.is_alive() for worker in self.workers):
+                    raise WorkerError('No prefetch workers running')
+        self.stall_time += time.perf_counter() - start
+
+        if isinstance(item, WorkerError):
+            self.close()
+            raise item
+        self.batches += 1
+        return item
+
+    def close(self):
+        self.stop.set()
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                if self.processes:
+                    logger.warning('Prefetch worker did not stop, killing it')
+                    worker.terminate()
+                else:
+                    logger.warning('Prefetch worker did not stop')
+
+        if self.processes:
+            self.queue.cancel_join_thread()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def __repr__(self):
+        return f'Prefetcher(workers={len(self.workers)}, processes={self.processes}, batches={self.batches}, stall_time={self.stall_time:.2f}s, mean_queue_depth={self.mean_queue_depth:.1f})'
@@ -0,0 +1,128 @@
+import os
+import time
+import contextlib
+import collections
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+_disabled = contextlib.nullcontext()
+
+class PhaseTimers:
+    """
+    Accumulates the wall-clock time spent on each phase of a training loop, and the training throughput.
+
+    Usage:
+        with timers.phase('input'):
+            ...
+        timers.step(examples)
+        writer.add_summary(timers.summary(), it)  # Once in a while
+
+    Every `summary()` reports the interval since the previous one, and starts a new interval.
+    When disabled, `phase()` returns a shared no-op context, and `step()` / `summary()` do nothing.
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.interval_start = time.perf_counter()
+        self.times = collections.defaultdict(float)
+        self.steps = 0
+        self.examples = 0
+
+    def phase(self, name):
+        if not self.enabled:
+            return _disabled
+        return self._phase(name)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    def step(self, examples):
+        if self.enabled:
+            self.steps += 1
+            self.examples += examples
+
+    def report(self):
+        """
+        Returns the statistics of the current interval, and starts a new interval.
+
+        Returns: dict with
+        - elapsed: Seconds since the start of the interval
+        - steps_per_sec, examples_per_sec
+        - phases: {phase: fraction of the elapsed time}
+        """
+        elapsed = time.perf_counter() - self.interval_start
+        report = dict(
+            elapsed = elapsed,
+            steps_per_sec = self.steps / elapsed,
+            examples_per_sec = self.examples / elapsed,
+            phases = {name: seconds / elapsed for name, seconds in self.times.items()},
+        )
+        self.reset()
+        return report
+
+    def summary(self):
+        """
+        Returns a `tf.Summary` with the statistics of the current interval (See `report()`), and starts a new interval.
+        Returns `None` when disabled, or when no steps were done in the interval (e.g., start-up)
+        """
+        if not self.enabled:
+            return None
+        if self.steps == 0:
+            self.reset()
+            return None
+        report = self.report()
+        values = [
+            tf.Summary.Value(tag='throughput/steps_per_sec', simple_value=report['steps_per_sec']),
+            tf.Summary.Value(tag='throughput/examples_per_sec', simple_value=report['examples_per_sec']),
+        ] + [
+            tf.Summary.Value(tag=f'phase_time/{name}', simple_value=fraction)
+            for name, fraction in report['phases'].items()
+        ]
+        self.last_report = report
+        return tf.Summary(value=values)
+
+    def __str__(self):
+        report = self.last_report
+        phases = ', '.join(f'{name} {100*fraction:.1f}%' for name, fraction in sorted(report['phases'].items(), key=lambda item: -item[1]))
+        return f'{report["steps_per_sec"]:.2f} steps/s, {report["examples_per_sec"]:.1f} examples/s -- {phases}'
+
+class Tracer:
+    """
+    Captures a full trace of one `session.run` every `every` calls, and writes it as a Chrome trace (Open it on chrome://tracing).
+
+    Usage:
+        options, run_metadata = tracer.options()
+        session.run(..., options=options, run_metadata=run_metadata)
+        tracer.save(run_metadata, step)
+
+    With `every=None`, `options()` returns `(None, None)` and `save()` does nothing.
+    """
+    def __init__(self, trace_dir, every=None, writer=None):
+        self.trace_dir = trace_dir
+        self.every = every
+        self.writer = writer
+        self.calls = 0
+
+    def options(self):
+        if not self.every:
+            return None, None
+        self.calls += 1
+        if self.calls % self.every != 0:
+            return None, None
+        return tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), tf.RunMetadata()
+
+    def save(self, run_metadata, step):
+        if run_metadata is None:
+            return
+        os.makedirs(self.trace_dir, exist_ok=True)
+        with open(f'{self.trace_dir}/step_{step}.json', 'w') as f:
+            f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+        if self.writer is not None:
+            self.writer.add_run_metadata(run_metadata, f'step_{step}', step)
@@ -0,0 +1,292 @@
+"""
+Local scoring service: The decisions of a trained trader for today, one symbol per request.
+
+The trader is loaded once (As a frozen graph, See `export.py`) and its session stays warm between requests.
+Concurrent requests are micro-batched: A background thread waits up to `max_wait` seconds after the first pending request,
+and scores every pending request (up to `max_batch_size`) in a single `session.run`, one request per minibatch row.
+The trader outputs of a company only depend on its own history, so batching doesn't change the results.
+
+In-process:
+    with ScoringService('runs/<timestamp>') as service:
+        result = service.score(stock_history)  # array[day][low, high, open, close, volume], the last `service.num_days` days of a symbol, up to today (Plus the extra channels of the trader, see `ScoringService.submit`)
+
+Over HTTP on localhost (POST /score with {"stock_history": [[low, high, open, close, volume], ...]}, GET /stats):
+    python scoring.py runs/<timestamp> [--port 8000] [--max-wait-ms 5] [--max-batch-size 64]
+
+See `benchmarks/scoring.py` for a load generator.
+"""
+import ast
+import json
+import time
+import queue
+import logging
+import argparse
+import tempfile
+import threading
+import traceback
+import collections
+import concurrent.futures
+import http.server
+import numpy as np
+
+import export
+
+logger = logging.getLogger('scoring')
+
+class ScoringStats:
+    """
+    Latency (From `submit` to the result) of every request, and size of every batch run
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.latencies = []
+            self.batch_sizes = collections.Counter()
+            self.run_time = 0.
+
+    def add_batch(self, latencies, run_time):
+        with self.lock:
+            self.latencies.extend(latencies)
+            self.batch_sizes[len(latencies)] += 1
+            self.run_time += run_time
+
+    def summary(self):
+        """
+        Returns a dict with:
+        - requests, batches: Counts
+        - p50, p99, max: Request latencies, in seconds
+        - mean_batch_size, mean_run_time: Per batch, `mean_run_time` being the `session.run` only
+        - batch_sizes: {batch size: number of batches}
+        """
+        with self.lock:
+            latencies = np.array(self.latencies)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            run_time = self.run_time
+        batches = sum(batch_sizes.values())
+        p50, p99, max_latency = np.percentile(latencies, [50, 99, 100]) if len(latencies) else (np.nan,) * 3
+        return dict(
+            requests = len(latencies),
+            batches = batches,
+            p50 = float(p50),
+            p99 = float(p99),
+            max = float(max_latency),
+            mean_batch_size = len(latencies) / max(1, batches),
+            mean_run_time = run_time / max(1, batches),
+            batch_sizes = batch_sizes,
+        )
+
+    def __repr__(self):
+        summary = self.summary()
+        return f'ScoringStats(requests={summary["requests"]}, batches={summary["batches"]}, p50={1000 * summary["p50"]:.2f}ms, p99={1000 * summary["p99"]:.2f}ms, mean_batch_size={summary["mean_batch_size"]:.1f})'
+
+class ScoringService:
+    """
+    Scores per-symbol requests with a trained trader, batching concurrent requests into one `session.run`.
+
+    Arguments:
+    - model: A frozen graph (`.pb`, See `export.export_frozen_graph`), a checkpoint prefix, or a run directory.
+      Checkpoints are exported to a temporary frozen graph first, with `graph_params` and `which`.
+    - max_batch_size: Max number of requests scored by one `session.run`
+    - max_wait: Max seconds a request waits for others to join its batch. 0 only batches the requests already pending.
+
+    Each result is a dict with the trader decisions for the day after the last day of the request (Whose historic window ends on that day, See `export.trim_input`):
+    - order_prices: array[response] -> [sell_low_price, sell_high_price, buy_price]
+    - buy_amount: float, unnormalized
+    - predictions: array[future_day, feature]
+    """
+    def __init__(self, model, max_batch_size=64, max_wait=0.005, graph_params={}, which='latest', session_config=None):
+        if max_batch_size < 1:
+            raise Exception("Expected max_batch_size to be at least 1")
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        if model.endswith('.pb'):
+            self.trader = export.FrozenTrader(model, session_config)
+        else:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                export.export_frozen_graph(model, f'{temp_dir}/trader.pb', graph_params, which=which)
+                self.trader = export.FrozenTrader(f'{temp_dir}/trader.pb', session_config)
+        self.num_features = self.trader.input.shape[3].value
+
+        # Warms up the session, so the first request doesn't pay for the graph setup
+        self.trader.run(np.ones([1, 1, self.num_days, self.num_features], dtype=np.float32))
+
+        self.stats = ScoringStats()
+        self.requests = queue.Queue()
+        self.stop = threading.Event()
+        self.lock = threading.Lock()  # Requests are either queued before `stop` is set, or rejected
+        self.worker = threading.Thread(target=self._worker, daemon=True)
+        self.worker.start()
+
+    @property
+    def num_days(self):
+        """
+        Days of history of each request
+        """
+        return self.trader.num_days
+
+    def submit(self, stock_history):
+        """
+        Queues a request, and returns a `concurrent.futures.Future` of its result.
+
+        Arguments:
+        - stock_history: array[day][feature], the last `num_days` days of a symbol, up to the last known day.
+          The features are [low, high, open, close, volume], followed by the channels the trader was trained with, `num_features` in all:
+          Its LOG_FEATURES with `precomputed_features` (See `stock_dataset.log_features`), then its indicators with `indicators` (See `indicators.IndicatorEngine`)
+        """
+        stock_history = np.asarray(stock_history, dtype=np.float32)
+        if stock_history.shape != (self.num_days, self.num_features):
+            raise Exception(f"Expected stock_history of shape ({self.num_days}, {self.num_features}), got {stock_history.shape}")
+
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self.stop.is_set():
+                raise Exception("Expected the scoring service to be running")
+            self.requests.put((stock_history, future, time.perf_counter()))
+        return future
+
+    def score(self, stock_history, timeout=None):
+        """
+        Scores a request, waiting for its batch (See `submit`)
+        """
+        return self.submit(stock_history).result(timeout)
+
+    def _next_batch(self):
+        batch = []
+        deadline = None
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self.requests.get(timeout=0.1 if deadline is None else max(0., deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            # Requests cancelled by their client are dropped
+            if not request[1].set_running_or_notify_cancel():
+                continue
+            if deadline is None:
+                deadline = time.perf_counter() + self.max_wait
+            batch.append(request)
+        return batch
+
+    def _worker(self):
+        while not self.stop.is_set():
+            batch = self._next_batch()
+            if not batch:
+                continue
+            histories, futures, submit_times = zip(*batch)
+            try:
+                start = time.perf_counter()
+                outputs = self.trader.run(np.stack(histories)[:, np.newaxis])
+                run_time = time.perf_counter() - start
+            except BaseException:
+                error = Exception(f'Scoring failed:\n{traceback.format_exc()}')
+                logger.error(str(error))
+                for future in futures:
+                    future.set_exception(error)
+                continue
+
+            end = time.perf_counter()
+            # The last decision of each request is the one made on its last days
+            for i, future in enumerate(futures):
+                future.set_result({name: values[i, 0, -1] for name, values in outputs.items()})
+            self.stats.add_batch([end - submit_time for submit_time in submit_times], run_time)
+
+        # Requests still pending when closed
+        while True:
+            try:
+                _, future, _ = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if future.set_running_or_notify_cancel():
+                future.set_exception(Exception("Scoring service closed"))
+
+    def close(self):
+        with self.lock:
+            self.stop.set()
+        self.worker.join(timeout=5)
+        self.trader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, tb):
+        self.close()
+
+    def __repr__(self):
+        return f'ScoringService({self.trader}, max_batch_size={self.max_batch_size}, max_wait={self.max_wait}s, {self.stats})'
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    service = None
+
+    def _reply(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.service.stats.summary())
+        else:
+            self._reply(404, dict(error=f'Unknown path {self.path}'))
+
+    def do_POST(self):
+        if self.path != '/score':
+            self._reply(404, dict(error=f'Unknown path {self.path}'))
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            future = self.service.submit(request['stock_history'])
+        except Exception as e:
+            self._reply(400, dict(error=str(e)))
+            return
+        try:
+            result = future.result()
+        except Exception as e:
+            self._reply(500, dict(error=str(e)))
+            return
+        result = {name: value.tolist() for name, value in result.items()}
+        if 'symbol' in request:
+            result['symbol'] = request['symbol']
+        self._reply(200, result)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+def serve(service, port=8000, host='127.0.0.1'):
+    """
+    Starts an HTTP server for `service` on a background thread, and returns it (Stop it with `server.shutdown()`).
+
+    - POST /score: {"stock_history": [[low, high, open, close, volume], ...], "symbol": optional} -> The result of `ScoringService.score` as JSON
+    - GET /stats: `ScoringStats.summary()`
+    """
+    handler = type('Handler', (_Handler,), dict(service=service))
+    server = http.server.ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='Frozen graph (.pb), run directory or checkpoint prefix')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5)
+    parser.add_argument('--which', default='latest', choices=['latest', 'best'])
+    parser.add_argument('--graph-params', default='{}', help='build_graph arguments of the run, as a Python dict literal')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    with ScoringService(args.model, args.max_batch_size, args.max_wait_ms / 1000, ast.literal_eval(args.graph_params), args.which) as service:
+        server = serve(service, args.port)
+        print(f'Scoring {service.num_days} days per symbol on http://127.0.0.1:{args.port}/score')
+        try:
+            while True:
+                time.sleep(60)
+                print(service.stats)
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -2,6 +2,10 @@ import tensorflow as tf
 
 """
 A collection of not-very-continuous functions, with hacked continuous gradients
+
+With `custom_gradients` set (The default of every function), the usual cases are built with `tf.custom_gradient`:
+The forward pass only computes the hard value, and the soft function is only built by the backwards pass, for its derivative.
+Otherwise (And for the cases not covered), they are built with `with_grad`, which computes both the hard and soft values on the forward pass.
 """
 
 def with_grad(f, g, name='custom_gradient'):
@@ -13,29 +17,46 @@ def with_grad(f, g, name='custom_gradient'):
     with tf.name_scope(name):
         return g + tf.stop_gradient(f - g)
 
+def _is_number(x):
+    return isinstance(x, (int, float))
+
+def _with_identity_grad(f, x, name, custom_gradients):
+    """
+    `f(x)`, with derivative=1
+    """
+    if not custom_gradients:
+        return with_grad(f(x), x, name = name)
+
+    @tf.custom_gradient
+    def op(x):
+        return f(x), lambda dy: dy
+
+    with tf.name_scope(name):
+        return op(x)
+
 
 
-def floor(x, name='soft_floor'):
+def floor(x, name='soft_floor', custom_gradients=True):
     """
-    `tf.ceil`, with derivative=1
+    `tf.floor`, with derivative=1
     """
-    return with_grad(tf.floor(x), x, name = name)
+    return _with_identity_grad(tf.floor, x, name = name, custom_gradients = custom_gradients)
 
-def ceil(x, name='soft_ceil'):
+def ceil(x, name='soft_ceil', custom_gradients=True):
     """
     `tf.ceil`, with derivative=1
     """
-    return with_grad(tf.ceil(x), x, name = name)
+    return _with_identity_grad(tf.ceil, x, name = name, custom_gradients = custom_gradients)
 
-def round(x, name='soft_round'):
+def round(x, name='soft_round', custom_gradients=True):
     """
     `tf.round`, with derivative=1
     """
-    return with_grad(tf.round(x), x, name = name)
+    return _with_identity_grad(tf.round, x, name = name, custom_gradients = custom_gradients)
 
 
 
-def threshold(x, ym=0, yp=1, softness=1, soft_value=False, soft_grad=True, threshold_func=tf.sigmoid, name='soft_threashold'):
+def threshold(x, ym=0, yp=1, softness=1, soft_value=False, soft_grad=True, threshold_func=tf.sigmoid, name='soft_threashold', custom_gradients=True):
     """
     Generates 2 threshold functions:
     - A hard threshold where the output is `ym` when `x <= 0` and `yp` where `x > 0`
@@ -48,6 +69,9 @@ def threshold(x, ym=0, yp=1, softness=1, soft_value=False, soft_grad=True, thres
     with tf.name_scope(name):
         if softness != 1:
             x /= softness
+        if custom_gradients and _is_number(ym) and _is_number(yp) and threshold_func is tf.sigmoid and soft_grad and not soft_value:
+            return _sigmoid_threshold(x, ym, yp)
+
         soft_q = tf.identity(threshold_func(x), 'soft_q')
         hard_q = tf.where(x > 0, tf.ones(tf.shape(x)),  tf.zeros(tf.shape(x)), name='hard_q')
         soft_y = tf.add((1-soft_q) * ym, soft_q * yp, name='soft_value')
@@ -57,6 +81,28 @@ def threshold(x, ym=0, yp=1, softness=1, soft_value=False, soft_grad=True, thres
             soft_y if soft_value else hard_y,
             soft_y if soft_grad else hard_y)
 
+def _sigmoid_threshold(x, ym, yp):
+    """
+    The hard threshold of `x`, with the derivative of the sigmoid threshold (`ym` and `yp` being numbers)
+    """
+    @tf.custom_gradient
+    def op(x):
+        hard_q = tf.cast(x > 0, x.dtype, name='hard_q')
+        if ym == 0:
+            hard_y = hard_q if yp == 1 else hard_q * yp
+        elif yp == 0:
+            hard_y = 1 - hard_q if ym == 1 else (1 - hard_q) * ym
+        else:
+            hard_y = (1 - hard_q) * ym + hard_q * yp
+
+        def grad(dy):
+            soft_q = tf.sigmoid(x, name='soft_q')
+            return dy * (yp - ym) * soft_q * (1 - soft_q)
+
+        return tf.identity(hard_y, name='hard_value'), grad
+
+    return op(x)
+
 
 
 def perc_variation(a, b):
@@ -108,7 +154,7 @@ def gte(a, b, ym=0, yp=1, *args, **kwargs):
     kwargs.setdefault('name', 'soft_gte')
     return lt(a, b, ym=yp, yp=ym, *args, **kwargs)
 
-def positive(x, softness=1, soft_value=False, soft_grad=True):
+def positive(x, softness=1, soft_value=False, soft_grad=True, custom_gradients=True):
     """
     A function to check if `x >= 1`, with relevant derivatives.
 
@@ -117,6 +163,17 @@ def positive(x, softness=1, soft_value=False, soft_grad=True):
     The derivative is `1` when `x=0`, and gets increasingly smaller for larger values of `x`.
     """
     with tf.name_scope('notzero'):
+        if custom_gradients and soft_grad and not soft_value:
+            @tf.custom_gradient
+            def op(x):
+                def grad(dy):
+                    soft_y = tf.tanh(x / softness)
+                    return dy * (1 - soft_y * soft_y)
+
+                return tf.maximum(0., tf.minimum(1., x)), grad
+
+            return op(x)
+
         #hard_y = tf.where(x > 0, tf.ones(tf.shape(x)), tf.zeros(tf.shape(x)))
         hard_y = tf.minimum(1., x)
         soft_y = tf.tanh(x / softness)
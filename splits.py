@@ -0,0 +1,117 @@
+"""
+Train/test splits over the sample index of a `stock_dataset.DenseTimeSeries` or `stock_dataset.UniverseStore`.
+
+Every valid window is a sample, identified by its position in `SampleIndex` (Samples are sorted by date).
+A `Fold` holds the sample ids of its train and test sets, so splitting never copies the data: Each fold costs an int array per set, consumed directly by `minibatch_producer(split=fold)`.
+
+Splits:
+- `by_symbol`: Test symbols are never seen during training
+- `by_date`: All samples of a date are either train or test
+- `by_weekday`: A random weekday of each week is used for testing (See README)
+- `walk_forward`: Rolling folds, where each test period comes after its train period
+"""
+import collections
+import numpy as np
+
+Fold = collections.namedtuple('Fold', ['train', 'test'])
+
+class SampleIndex:
+    """
+    Every valid window of a `DenseTimeSeries` / `UniverseStore`, as flat arrays sorted by date.
+
+    - sample_dates: array[sample], index in `source.dates`. (The window ends at `source.dates[sample_dates[sample]]`)
+    - sample_symbols: array[sample], index in `source.symbols`
+    """
+    def __init__(self, source):
+        self.source = source
+        dates, offsets, symbol_indices = source.sample_index()
+        self.sample_dates = np.repeat(dates, np.diff(offsets))
+        self.sample_symbols = symbol_indices
+
+    def __len__(self):
+        return len(self.sample_symbols)
+
+    def group_by_date(self, samples=None):
+        """
+        Returns the samples (Or a subset of them, given by sample ids) as `(dates, offsets, symbol_indices)`, like `DenseTimeSeries.sample_index()`
+        """
+        if samples is None:
+            samples = np.arange(len(self))
+        samples = np.sort(samples)
+        sample_dates = self.sample_dates[samples]
+        starts = np.flatnonzero(np.diff(sample_dates, prepend=-1))
+        return sample_dates[starts], np.append(starts, len(samples)), self.sample_symbols[samples]
+
+def _split_keys(sample_keys, keys, test_ratio, rng):
+    """
+    Randomly assigns `test_ratio` of `keys` to test, and returns the Fold of the samples with these keys
+    """
+    keys = rng.permutation(keys)
+    test = np.isin(sample_keys, keys[:int(round(len(keys) * test_ratio))])
+    return Fold(train=np.flatnonzero(~test), test=np.flatnonzero(test))
+
+def by_symbol(index, test_ratio=0.2, seed=None):
+    return _split_keys(index.sample_symbols, np.unique(index.sample_symbols), test_ratio, np.random.default_rng(seed))
+
+def by_date(index, test_ratio=0.2, seed=None):
+    return _split_keys(index.sample_dates, np.unique(index.sample_dates), test_ratio, np.random.default_rng(seed))
+
+def by_weekday(index, seed=None):
+    """
+    For each week, one of its trading days (at random) is a test date
+    """
+    rng = np.random.default_rng(seed)
+    dates = np.unique(index.sample_dates)
+    if not len(dates):
+        raise Exception("Expected samples to split by weekday")
+    weeks = (index.source.dates[dates].astype(np.int64) + 3) // 7  # 1970-01-01 is a Thursday, weeks start on Monday
+    week_starts = np.flatnonzero(np.diff(weeks, prepend=weeks[0] - 1))
+    days_in_week = np.diff(np.append(week_starts, len(dates)))
+    test_dates = dates[week_starts + rng.integers(days_in_week)]
+    test = np.isin(index.sample_dates, test_dates)
+    return Fold(train=np.flatnonzero(~test), test=np.flatnonzero(test))
+
+def walk_forward(index, num_folds, test_dates, train_dates=None, gap=None):
+    """
+    Rolling walk-forward folds: The i-th fold tests on `test_dates` dates, right after the dates of its training set.
+
+    Arguments:
+    - test_dates: Number of dates of each test set. The test sets of consecutive folds are adjacent, and the last one ends at the last date
+    - train_dates: Number of dates of each training set, or `None` to train on every date before the test set (Expanding window)
+    - gap: Dates skipped between train and test, defaults to `timeseries_length - 1`, so no day is in both a train and a test window
+
+    Returns a list of Folds, in chronological order
+    """
+    if gap is None:
+        gap = index.source.timeseries_length - 1
+    dates = np.unique(index.sample_dates)
+    positions = np.searchsorted(dates, index.sample_dates)  # Position of the date of each sample among the dates with samples
+
+    folds = []
+    for fold in range(num_folds):
+        test_end = len(dates) - (num_folds - fold - 1) * test_dates
+        test_start = test_end - test_dates
+        train_end = test_start - gap
+        train_start = 0 if train_dates is None else train_end - train_dates
+        if train_start < 0 or train_end <= 0:
+            raise Exception(f"Expected enough dates for {num_folds} folds of {train_dates} train + {gap} gap + {test_dates} test dates")
+        train = np.flatnonzero((positions >= train_start) & (positions < train_end))
+        test = np.flatnonzero((positions >= test_start) & (positions < test_end))
+        if not len(train) or not len(test):
+            raise Exception(f"Expected samples in the train and test sets of fold {fold} ({len(train)} train and {len(test)} test samples)")
+        folds.append(Fold(train=train, test=test))
+    return folds
+
+SPLITS = {
+    'symbol': by_symbol,
+    'date': by_date,
+    'weekday': lambda index, test_ratio, seed: by_weekday(index, seed),
+}
+
+def split(index, method='symbol', test_ratio=0.2, seed=None):
+    """
+    A single train/test Fold, with one of the methods in `SPLITS` ('symbol', 'date' or 'weekday'. `test_ratio` is ignored by 'weekday')
+    """
+    if method not in SPLITS:
+        raise Exception(f"Expected method to be one of {', '.join(SPLITS)}")
+    return SPLITS[method](index, test_ratio=test_ratio, seed=seed)
@@ -1,15 +1,34 @@
 import os
+import json
+import copy
+import shutil
+import collections
+import threading
 import logging
-import random
+import tempfile
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 
+import splits
+from market import EPS as LOG_EPS
+from indicators import IndicatorEngine, rolling_mean
+
 logger = logging.getLogger('stock-dataset')
 
 DATASET_DIR = "dataset/dataset-2017-10-11"
 STOCK_DIR = f"{DATASET_DIR}/Stocks"
 ETF_DIR = f"{DATASET_DIR}/ETFs"
+CACHE_DIR = "dataset-cache"
+
+CACHE_COLUMNS = {
+    'Date': np.int64,  # Days since 1970-01-01
+    'Open': np.float32,
+    'High': np.float32,
+    'Low': np.float32,
+    'Close': np.float32,
+    'Volume': np.int64,
+}
 
 SP500 = pd.read_csv('dataset/s&p500.tsv', sep='\t')['Ticker symbol']  # The most important/most traded companies -- a.k.a. the ones be care about.
 FAVORITE_COMPANIES = ['GOOG', 'AMZN', 'NFLX', 'TSLA', 'FB', 'AAPL', 'INTC', 'QCOM', 'DIS', 'NVDA']
@@ -18,57 +37,270 @@ DEFAULT_SYMBOLS = SP500
 DEFAULT_TEST_RATIO = 0.2
 DEFAULT_MIN_DATE = '2013-01-01'
 DEFAULT_TIMESERIES_LENGTH = 30
+DEFAULT_MEMORY_BUDGET = 1 << 30  # Bytes of symbol data kept in memory by `UniverseStore`
+
+FEATURES = ['Low', 'High', 'Open', 'Close', 'Volume']  # Order of the features on timeseries and minibatches
+LOG_FEATURES = [f'Log{feature}' for feature in FEATURES] + ['LogMeanVolume']  # Precomputed features (See `log_features`), appended after FEATURES
 
-def read_datasets(symbols=DEFAULT_SYMBOLS, min_date=DEFAULT_MIN_DATE):
+TimeSeries = collections.namedtuple('TimeSeries', ['dates', 'windows'])
+
+def log_features(ohlcv, mean_volume_days, axis=-2):
     """
-    Reads the CSV files with historic data for the given companies
+    Precomputes the log-perc scale features used by the trader input, so normalizing them is a subtraction (See `normalize.log_perc.normalize_log`)
+
+    Arguments:
+    - ohlcv: array[..., low, high, open, close, volume], with the days on `axis`
+    - mean_volume_days: Days averaged by the mean volume, the `historic_window_size` of the trader
+
+    Returns float32 array[..., LOG_FEATURES]: `100*log(max(feature, eps))` of each feature, and of the mean volume of the `mean_volume_days` days ending on each day.
+    The first `mean_volume_days-1` days average fewer days, the trader never uses them (Its first window ends on the day `historic_window_size-1`)
     """
-    symbols = set(symbols)
-    failed_csvs = []
-    datasets = {}
-    timeseries_feature_data = {}
-    for filename in os.listdir(STOCK_DIR):
-        symbol = filename.split('.')[0].upper()
-        if not symbol in symbols:
+    ohlcv = np.asarray(ohlcv, dtype=np.float64)
+    volume = np.moveaxis(ohlcv[..., FEATURES.index('Volume')], axis % ohlcv.ndim, 0)
+    mean_volume = np.moveaxis(rolling_mean(volume, mean_volume_days), 0, axis % ohlcv.ndim)
+
+    features = np.concatenate([ohlcv, mean_volume[..., np.newaxis]], axis=-1)
+    return (100 * np.log(np.maximum(features, LOG_EPS))).astype(np.float32)
+
+def _cache_subdir(source_dir, cache_dir):
+    return f"{cache_dir}/{os.path.basename(os.path.normpath(source_dir))}"
+
+def _read_cache_index(cache_dir):
+    try:
+        with open(f"{cache_dir}/index.json") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def _write_cache_index(cache_dir, index):
+    os.makedirs(cache_dir, exist_ok=True)
+    # A temporary file per writer, so concurrent updates don't write into the same file
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='index.', suffix='.json.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(temp_path, f"{cache_dir}/index.json")
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+CSV_ERRORS = (pd.errors.ParserError, pd.errors.EmptyDataError, KeyError, ValueError)  # Raised by `_parse_csv` on files that cannot be parsed
+
+def _parse_csv(csv_file):
+    """
+    Reads a CSV file into the `CACHE_COLUMNS`, sorted by date
+    """
+    raw = pd.read_csv(csv_file)
+    raw = raw.iloc[np.argsort(raw.Date.values, kind='stable')]
+    columns = {
+        'Date': pd.to_datetime(raw.Date).values.astype('datetime64[D]').astype(np.int64),
+    }
+    for col, dtype in CACHE_COLUMNS.items():
+        if col != 'Date':
+            columns[col] = raw[col].values.astype(dtype)
+    return columns
+
+def _skip_before(columns, min_date):
+    first = np.searchsorted(columns['Date'], np.datetime64(min_date, 'D').astype(np.int64))
+    return {
+        col: values[first:]
+        for col, values in columns.items()
+    }
+
+def _convert_csv(csv_file, symbol_dir):
+    """
+    Converts a single CSV file into one `.npy` file per column
+    """
+    columns = _parse_csv(csv_file)
+    os.makedirs(symbol_dir, exist_ok=True)
+    for col, values in columns.items():
+        np.save(f"{symbol_dir}/{col}.npy", values)
+    return len(columns['Date'])
+
+def update_cache(source_dir=STOCK_DIR, cache_dir=CACHE_DIR, symbols=None):
+    """
+    Converts the CSV files from `source_dir` into a binary cache, with one memory-mappable `.npy` file per column.
+
+    A symbol is only converted again if the size or modification time of its CSV file changes.
+    If `symbols` is given, only these symbols are converted.
+
+    Returns the cache index: {symbol: {filename, size, mtime, rows}}
+    Files that cannot be parsed are also indexed (with `failed=True`), so that they are not retried until they change.
+    Symbols whose CSV file was deleted are removed from the cache.
+    """
+    cache_dir = _cache_subdir(source_dir, cache_dir)
+    index = _read_cache_index(cache_dir)
+    changed = False
+
+    source_symbols = set()
+    for entry in os.scandir(source_dir):
+        symbol = entry.name.split('.')[0].upper()
+        source_symbols.add(symbol)
+        if symbols is not None and symbol not in symbols:
             continue
 
-        raw = pd.read_csv(f"{STOCK_DIR}/{filename}")
-        datasets[symbol] = raw[raw.Date >= min_date]
+        stat = entry.stat()
+        cached = index.get(symbol)
+        if cached is not None and cached['filename'] == entry.name and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime:
+            continue
+
+        logger.debug(f'Converting {entry.path}')
+        cached = dict(filename=entry.name, size=stat.st_size, mtime=stat.st_mtime)
+        try:
+            cached['rows'] = _convert_csv(entry.path, f"{cache_dir}/{symbol}")
+        except CSV_ERRORS:
+            cached['failed'] = True
+        index[symbol] = cached
+        changed = True
+
+    for symbol in set(index) - source_symbols:
+        logger.debug(f'Removing {symbol} from the cache, its CSV file is gone')
+        del index[symbol]
+        shutil.rmtree(f"{cache_dir}/{symbol}", ignore_errors=True)
+        changed = True
+
+    if changed:
+        _write_cache_index(cache_dir, index)
+    return index
+
+def read_cached_columns(symbol, min_date=DEFAULT_MIN_DATE, source_dir=STOCK_DIR, cache_dir=CACHE_DIR):
+    """
+    Memory-maps the cached columns of a symbol, skipping records before `min_date`.
+
+    Dates are returned as int64 days since 1970-01-01.
+    The cache must be up to date (See `update_cache`)
+    """
+    symbol_dir = f"{_cache_subdir(source_dir, cache_dir)}/{symbol}"
+    return _skip_before({
+        col: np.load(f"{symbol_dir}/{col}.npy", mmap_mode='r')
+        for col in CACHE_COLUMNS
+    }, min_date)
+
+def _read_columns(symbols, min_date, cache_dir):
+    """
+    Reads the `CACHE_COLUMNS` of every available symbol, either from the binary cache or from the CSV files (Both give the same columns).
+    """
+    failed_csvs = []
+    columns = {}
+
+    if cache_dir is not None:
+        index = update_cache(STOCK_DIR, cache_dir, symbols)
+        for symbol in symbols & set(index.keys()):
+            if index[symbol].get('failed'):
+                failed_csvs.append(index[symbol]['filename'])
+                continue
+
+            columns[symbol] = read_cached_columns(symbol, min_date, STOCK_DIR, cache_dir)
+
+    else:
+        for filename in os.listdir(STOCK_DIR):
+            symbol = filename.split('.')[0].upper()
+            if not symbol in symbols:
+                continue
+
+            try:
+                columns[symbol] = _skip_before(_parse_csv(f"{STOCK_DIR}/{filename}"), min_date)
+            except CSV_ERRORS:
+                failed_csvs.append(filename)
 
     if failed_csvs:
         logging.warning(f'Failed to read {len(failed_csvs)} CSV files: {", ".join(sorted(failed_csvs))}')
 
-    missed_symbols = symbols - set(datasets.keys())
+    missed_symbols = symbols - set(columns.keys())
     if missed_symbols:
         logger.warning(f'Didn\'t find {len(missed_symbols)} symbols: {", ".join(sorted(missed_symbols))}')
 
+    return columns
+
+def read_datasets(symbols=DEFAULT_SYMBOLS, min_date=DEFAULT_MIN_DATE, cache_dir=CACHE_DIR):
+    """
+    Reads the historic data for the given companies
+
+    The CSV files are converted into a binary cache on first use, and loaded from there afterwards (See `update_cache`).
+    Use `cache_dir=None` to always parse the CSV files, which gives the same DataFrames.
+
+    Returns {symbol: DataFrame}, with a datetime64 `Date` column and the other `CACHE_COLUMNS`, sorted by date
+    """
+    datasets = {}
+    for symbol, columns in _read_columns(set(symbols), min_date, cache_dir).items():
+        columns['Date'] = columns['Date'].astype('datetime64[D]')
+        datasets[symbol] = pd.DataFrame(columns)
     return datasets
 
+def read_ohlcv(symbols=DEFAULT_SYMBOLS, min_date=DEFAULT_MIN_DATE, cache_dir=CACHE_DIR):
+    """
+    Reads the historic data for the given companies as NumPy arrays
 
-def read_time_series(symbols=DEFAULT_SYMBOLS, min_date=DEFAULT_MIN_DATE, timeseries_length=DEFAULT_TIMESERIES_LENGTH):
+    Returns {symbol: (dates, ohlcv)}, where
+    - dates: datetime64[D] array[rows]
+    - ohlcv: contiguous float32 array[rows][low, high, open, close, volume]
+    """
     return {
-        symbol: dataset_to_timeseries(dataset, timeseries_length)
-        for (symbol, dataset) in read_datasets(symbols, min_date).items()
+        symbol: dataset_to_ohlcv(columns)
+        for symbol, columns in _read_columns(set(symbols), min_date, cache_dir).items()
     }
 
-def dataset_to_timeseries(dataset, timeseries_length):
+def dataset_to_ohlcv(dataset):
     """
-    Concatenates `days` sequential values to create a larger feature array.
+    Converts the columns of a dataset (A DataFrame or a dict of arrays) into `(dates, ohlcv)` arrays.
     """
-    parallel_series = [
-        dataset[d : len(dataset) + d + 1 - timeseries_length]
-        for d in range(timeseries_length)
-    ]
+    dates = np.asarray(dataset['Date']).astype('datetime64[D]')
+    ohlcv = np.stack([np.asarray(dataset[feature], dtype=np.float32) for feature in FEATURES], axis=1)
+    return dates, ohlcv
 
-    cols = ['Date']
-    data = [parallel_series[-1].Date]
-    for i in range(len(parallel_series)):
-        s = parallel_series[i]
-        for col in ['Low', 'High', 'Open', 'Close', 'Volume']:
-            cols.append(f'{col}.{i}')
-            data.append(s[col])
+def dataset_indicators(dataset, engine=None):
+    """
+    Returns a dataset from `read_datasets` with a column for each indicator of `engine` (An `indicators.IndicatorEngine`, defaults to its `DEFAULT_INDICATORS`)
+    """
+    if engine is None:
+        engine = IndicatorEngine()
+    features = engine.compute(dataset_to_ohlcv(dataset)[1])
+    return dataset.assign(**{name: features[:, i] for i, name in enumerate(engine.names)})
+
+
+def read_time_series(symbols=DEFAULT_SYMBOLS, min_date=DEFAULT_MIN_DATE, timeseries_length=DEFAULT_TIMESERIES_LENGTH, flat=False):
+    return {
+        symbol: dataset_to_timeseries(dataset, timeseries_length, flat=flat)
+        for (symbol, dataset) in read_ohlcv(symbols, min_date).items()
+    }
+
+def dataset_to_timeseries(dataset, timeseries_length, flat=False):
+    """
+    Creates the sliding windows of `timeseries_length` sequential days.
+
+    `dataset` is either a DataFrame from `read_datasets` or a `(dates, ohlcv)` tuple from `read_ohlcv`.
 
-    return pd.DataFrame(list(zip(*data)), columns=cols)
+    By default, returns a `TimeSeries(dates, windows)`, where:
+    - dates: datetime64[D] array[rows] with the date of the last day of each window
+    - windows: read-only float32 array[rows][days][low, high, open, close, volume].
+      This is a strided view over the `ohlcv` array: Nothing is copied until the windows are gathered into a minibatch.
+
+    If `flat` is set, returns a DataFrame with columns [Date, Low.0, High.0, Open.0, Close.0, Volume.0, Low.1, ...] instead.
+    """
+    if isinstance(dataset, pd.DataFrame):
+        dataset = dataset_to_ohlcv(dataset)
+    dates, ohlcv = dataset
+    ohlcv = np.ascontiguousarray(ohlcv)
+
+    num_windows = max(0, len(ohlcv) + 1 - timeseries_length)
+    windows = np.lib.stride_tricks.as_strided(
+        ohlcv,
+        shape=(num_windows, timeseries_length, ohlcv.shape[1]),
+        strides=(ohlcv.strides[0], ohlcv.strides[0], ohlcv.strides[1]),
+        writeable=False)
+    timeseries = TimeSeries(dates[timeseries_length - 1:], windows)
+
+    if not flat:
+        return timeseries
+
+    cols = [
+        f'{col}.{i}'
+        for i in range(timeseries_length)
+        for col in FEATURES
+    ]
+    df = pd.DataFrame(windows.reshape([num_windows, -1]), columns=cols)
+    df.insert(0, 'Date', timeseries.dates)
+    return df
 
 def concat_data(datasets):
     """
@@ -81,64 +313,502 @@ def concat_data(datasets):
     )
     return df.reindex(['Symbol'] + list(df.columns[:-1]), axis='columns')
 
+def _strided_windows(array, num_dates, timeseries_length):
+    """
+    Read-only view of `array[day][symbol][feature]` as array[date][symbol][day][feature], with the window `date` starting on `array[date]`
+    """
+    return np.lib.stride_tricks.as_strided(
+        array,
+        shape=(num_dates, array.shape[1], timeseries_length, array.shape[2]),
+        strides=(array.strides[0], array.strides[1], array.strides[0], array.strides[2]),
+        writeable=False)
+
+class DenseTimeSeries:
+    """
+    The timeseries of many symbols, aligned on a common calendar.
+
+    - symbols: array[symbol] with the symbol names
+    - calendar: datetime64[D] array[day], every day with data from any symbol
+    - ohlcv: float32 array[day][symbol][low, high, open, close, volume], with zeros where a symbol has no data.
+    - present: bool array[day][symbol], set where a symbol has data
+    - dates: datetime64[D] array[date], The calendar of the dataset, minus the first `timeseries_length-1` days
+    - valid: bool array[date][symbol], set where a symbol has data for all the `timeseries_length` days ending at `dates[date]`
+    - windows: read-only float32 array[date][symbol][day][low, high, open, close, volume], a strided view over `ohlcv`, with the window ending at `dates[date]`.
+    - log_features: None, or float32 array[day][symbol][LOG_FEATURES] precomputed from `ohlcv` (See `with_log_features`), with its `log_windows` view
+    - log_features_days: The `mean_volume_days` of `log_features`
+    - indicators: None, or float32 array[day][symbol][indicator] computed from `ohlcv` (See `with_indicators`), with its `indicator_windows` view
+    - indicator_names: The names of the `indicators`
+    """
+    def __init__(self, symbols, calendar, ohlcv, present, timeseries_length, log_features=None, log_features_days=None, indicators=None, indicator_names=None):
+        self.symbols = np.asarray(symbols)
+        self.timeseries_length = timeseries_length
+        self.calendar = calendar
+        self.ohlcv = ohlcv
+        self.present = present
+        self.dates = calendar[timeseries_length - 1:]
+
+        days_present = np.concatenate([np.zeros([1, len(self.symbols)], dtype=np.int64), np.cumsum(present, axis=0)])
+        self.valid = (days_present[timeseries_length:] - days_present[:-timeseries_length]) == timeseries_length
+
+        self.windows = _strided_windows(ohlcv, len(self.dates), timeseries_length)
+
+        self.log_features = log_features
+        self.log_features_days = log_features_days
+        self.log_windows = None if log_features is None else _strided_windows(log_features, len(self.dates), timeseries_length)
+
+        self.indicators = indicators
+        self.indicator_names = indicator_names
+        self.indicator_windows = None if indicators is None else _strided_windows(indicators, len(self.dates), timeseries_length)
+
+    @staticmethod
+    def from_ohlcv(datasets, timeseries_length):
+        """
+        Aligns the `{symbol: (dates, ohlcv)}` arrays from `read_ohlcv`
+        """
+        symbols = sorted(datasets.keys())
+        calendar = np.unique(np.concatenate([datasets[symbol][0] for symbol in symbols]))
+        ohlcv = np.zeros([len(calendar), len(symbols), len(FEATURES)], dtype=np.float32)
+        present = np.zeros([len(calendar), len(symbols)], dtype=bool)
+        for i, symbol in enumerate(symbols):
+            dates, symbol_ohlcv = datasets[symbol]
+            days = np.searchsorted(calendar, dates)
+            ohlcv[days, i] = symbol_ohlcv
+            present[days, i] = True
+        return DenseTimeSeries(symbols, calendar, ohlcv, present, timeseries_length)
+
+    def _replace(self, **arguments):
+        """
+        A DenseTimeSeries sharing the arrays of this one, except for the given constructor arguments
+        """
+        names = ['symbols', 'calendar', 'ohlcv', 'present', 'timeseries_length', 'log_features', 'log_features_days', 'indicators', 'indicator_names']
+        return DenseTimeSeries(**{**{name: getattr(self, name) for name in names}, **arguments})
+
+    def with_timeseries_length(self, timeseries_length):
+        """
+        The same data with another window length. The arrays are shared, not copied.
+        """
+        return self._replace(timeseries_length=timeseries_length)
+
+    def with_log_features(self, mean_volume_days):
+        """
+        The same data, with the `log_features` of the given mean volume days (Or without them, if `None`).
+
+        They are computed once over the whole `ohlcv`, unless they are already there. (Saved datasets keep them, see `save`)
+        """
+        if mean_volume_days is None:
+            features = None
+        elif mean_volume_days == self.log_features_days:
+            features = self.log_features
+        else:
+            features = log_features(self.ohlcv, mean_volume_days, axis=0)
+        return self._replace(log_features=features, log_features_days=mean_volume_days)
+
+    def with_indicators(self, engine):
+        """
+        The same data, with the `indicators` of an `indicators.IndicatorEngine` (Or without them, if `None`).
+
+        Each symbol's indicators are computed over the days it has data, once, unless they are already there. (Saved datasets keep them, see `save`)
+        """
+        if engine is None:
+            return self._replace(indicators=None, indicator_names=None)
+        if self.indicator_names is not None and list(self.indicator_names) == engine.names:
+            return self
+        features = np.zeros([len(self.calendar), len(self.symbols), len(engine)], dtype=np.float32)
+        for i in range(len(self.symbols)):
+            days = np.flatnonzero(self.present[:, i])
+            features[days, i] = engine.compute(self.ohlcv[days, i])
+        return self._replace(indicators=features, indicator_names=list(engine.names))
+
+    def all_features(self):
+        """
+        Returns float32 array[day][symbol][feature] with the raw features, followed by the LOG_FEATURES and the indicators (If there are), like the minibatches of `minibatch_producer`
+        """
+        features = [array for array in [self.ohlcv, self.log_features, self.indicators] if array is not None]
+        return features[0] if len(features) == 1 else np.concatenate(features, axis=2)
+
+    def save(self, path):
+        """
+        Saves the arrays into a directory, with one `.npy` file per array (See `load`)
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ['symbols', 'calendar', 'ohlcv', 'present']:
+            np.save(f'{path}/{name}.npy', getattr(self, name))
+        if self.log_features is not None:
+            np.save(f'{path}/log_features.npy', self.log_features)
+            np.save(f'{path}/log_features_days.npy', self.log_features_days)
+        if self.indicators is not None:
+            np.save(f'{path}/indicators.npy', self.indicators)
+            np.save(f'{path}/indicator_names.npy', np.array(self.indicator_names))
+
+    @staticmethod
+    def load(path, timeseries_length, mmap_mode='r'):
+        """
+        Loads the arrays saved by `save`.
+
+        By default the large arrays are memory-mapped read-only, so many processes loading the same directory share a single copy in the page cache.
+        """
+        has_log_features = os.path.exists(f'{path}/log_features.npy')
+        has_indicators = os.path.exists(f'{path}/indicators.npy')
+        return DenseTimeSeries(
+            symbols = np.load(f'{path}/symbols.npy'),
+            calendar = np.load(f'{path}/calendar.npy'),
+            ohlcv = np.load(f'{path}/ohlcv.npy', mmap_mode=mmap_mode),
+            present = np.load(f'{path}/present.npy', mmap_mode=mmap_mode),
+            timeseries_length = timeseries_length,
+            log_features = np.load(f'{path}/log_features.npy', mmap_mode=mmap_mode) if has_log_features else None,
+            log_features_days = int(np.load(f'{path}/log_features_days.npy')) if has_log_features else None,
+            indicators = np.load(f'{path}/indicators.npy', mmap_mode=mmap_mode) if has_indicators else None,
+            indicator_names = list(np.load(f'{path}/indicator_names.npy')) if has_indicators else None)
+
+    def sample_index(self, symbols=None):
+        """
+        Lists the valid windows of the given symbols (Or all symbols), grouped by date.
+
+        Returns `(dates, offsets, symbol_indices)`, where the windows available on `dates[i]` are `symbol_indices[offsets[i]:offsets[i+1]]`
+        """
+        valid = self.valid
+        if symbols is not None:
+            valid = valid & np.isin(self.symbols, symbols)
+
+        date_indices, symbol_indices = np.nonzero(valid)
+        counts = np.bincount(date_indices, minlength=len(self.dates))
+        dates = np.flatnonzero(counts)
+        offsets = np.concatenate([[0], np.cumsum(counts[dates])])
+        return dates, offsets, symbol_indices
+
+def read_dense_time_series(symbols=DEFAULT_SYMBOLS, min_date=DEFAULT_MIN_DATE, timeseries_length=DEFAULT_TIMESERIES_LENGTH):
+    return DenseTimeSeries.from_ohlcv(read_ohlcv(symbols, min_date), timeseries_length)
+
+class _SymbolCache:
+    """
+    The LRU cache of the symbols loaded by a `UniverseStore`, shared by the stores that load the same arrays (See `UniverseStore.with_timeseries_length`)
+    """
+    def __init__(self, memory_budget):
+        self.memory_budget = memory_budget
+        self.loaded = collections.OrderedDict()
+        self.memory_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, code):
+        with self.lock:
+            loaded = self.loaded.get(code)
+            if loaded is not None:
+                self.loaded.move_to_end(code)
+                self.hits += 1
+            return loaded
+
+    def put(self, code, loaded):
+        """
+        Adds a loaded symbol, and evicts the least recently used ones over the memory budget
+        """
+        with self.lock:
+            self.misses += 1
+            if code not in self.loaded:
+                self.loaded[code] = loaded
+                self.memory_used += sum(array.nbytes for array in loaded if array is not None)
+            while self.memory_used > self.memory_budget and len(self.loaded) > 1:
+                evicted = self.loaded.popitem(last=False)[1]
+                self.memory_used -= sum(array.nbytes for array in evicted if array is not None)
+
+class UniverseStore:
+    """
+    Every symbol of the Stocks and ETFs directories, loaded lazily.
+
+    The whole universe (~8,500 symbols, decades of data) doesn't fit in memory as a `DenseTimeSeries` or as DataFrames.
+    Instead, symbols are dictionary-encoded (A symbol is identified by its index in `symbols`), and their data is only loaded from the binary cache (See `update_cache`) when sampled.
+    Loaded symbols are kept in a LRU cache, evicted when the memory used goes over `memory_budget` (bytes).
+
+    Each loaded symbol takes 24 bytes per day: int32 day ordinals (indices in `calendar`) and float32 [low, high, open, close, volume].
+    With `with_log_features`, their `log_features` are precomputed when loaded, and kept with them (24 more bytes per day). So are their indicators, with `with_indicators` (4 bytes per indicator per day).
+
+    It has the same sampling interface as `DenseTimeSeries` (`symbols`, `dates`, `sample_index()`), and `gather()` builds the windows, so it can be used by `minibatch_producer(store=...)`.
+
+    - symbols: array[symbol] with the symbol names
+    - calendar: datetime64[D] array[day], every day with data from any symbol
+    - dates: datetime64[D] array[date], The calendar, minus the first `timeseries_length-1` days. Window `date` ends at `calendar[date + timeseries_length - 1]`
+    """
+    def __init__(self, source_dirs=(STOCK_DIR, ETF_DIR), min_date=DEFAULT_MIN_DATE, timeseries_length=DEFAULT_TIMESERIES_LENGTH, cache_dir=CACHE_DIR, memory_budget=DEFAULT_MEMORY_BUDGET, symbols=None):
+        self.min_date = min_date
+        self.cache_dir = cache_dir
+        self.memory_budget = memory_budget
+        self.timeseries_length = timeseries_length
+        self.log_features_days = None
+        self.indicator_engine = None
+
+        source_of = {}
+        for source_dir in source_dirs:
+            index = update_cache(source_dir, cache_dir, None if symbols is None else set(symbols))
+            for symbol, cached in index.items():
+                if not cached.get('failed') and cached['rows'] > 0:
+                    source_of[symbol] = source_dir
+        self.symbols = np.array(sorted(source_of))
+        self.source_dirs = [source_of[symbol] for symbol in self.symbols]
+
+        # Maps day ordinals (since `first_ordinal`) to indices in the calendar
+        first_ordinal, last_ordinal = np.iinfo(np.int64).max, np.iinfo(np.int64).min
+        for code in range(len(self.symbols)):
+            days = self._read_columns(code)['Date']
+            if len(days):
+                first_ordinal, last_ordinal = min(first_ordinal, days[0]), max(last_ordinal, days[-1])
+        present = np.zeros(max(0, last_ordinal - first_ordinal + 1), dtype=bool)
+        for code in range(len(self.symbols)):
+            present[self._read_columns(code)['Date'] - first_ordinal] = True
+
+        self.first_ordinal = first_ordinal
+        self.ordinal_to_day = (np.cumsum(present) - 1).astype(np.int32)
+        self.calendar = (np.flatnonzero(present) + first_ordinal).astype('datetime64[D]')
+        self.dates = self.calendar[timeseries_length - 1:]
+
+        self.cache = _SymbolCache(memory_budget)
+
+    def with_timeseries_length(self, timeseries_length):
+        """
+        The same universe with another window length. The loaded symbols are shared.
+        """
+        store = copy.copy(self)
+        store.timeseries_length = timeseries_length
+        store.dates = self.calendar[timeseries_length - 1:]
+        return store
+
+    def with_log_features(self, mean_volume_days):
+        """
+        The same universe, with the `log_features` of the given mean volume days appended to the windows of `gather()` (Or without them, if `None`).
+
+        The loaded symbols are not shared, since they don't have the same features.
+        """
+        store = copy.copy(self)
+        store.log_features_days = mean_volume_days
+        store._clear()
+        return store
+
+    def with_indicators(self, engine):
+        """
+        The same universe, with the indicators of an `indicators.IndicatorEngine` appended to the windows of `gather()`, after the `log_features` (Or without them, if `None`).
+
+        They are computed over every day of a symbol since `min_date` when it's loaded. The loaded symbols are not shared.
+        """
+        store = copy.copy(self)
+        store.indicator_engine = engine
+        store._clear()
+        return store
+
+    def _clear(self):
+        self.cache = _SymbolCache(self.memory_budget)
+
+    def _read_columns(self, code):
+        return read_cached_columns(self.symbols[code], self.min_date, self.source_dirs[code], self.cache_dir)
+
+    def load(self, code):
+        """
+        Returns `(days, ohlcv, features, indicators)` of a symbol: int32 array[row] with indices in `calendar`, float32 array[row][low, high, open, close, volume],
+        its float32 array[row][LOG_FEATURES] (Or `None`, see `with_log_features`), and its float32 array[row][indicator] (Or `None`, see `with_indicators`)
+        """
+        loaded = self.cache.get(code)
+        if loaded is not None:
+            return loaded
+
+        columns = self._read_columns(code)
+        days = self.ordinal_to_day[columns['Date'] - self.first_ordinal]
+        ohlcv = np.stack([np.asarray(columns[feature], dtype=np.float32) for feature in FEATURES], axis=1)
+        # Rows of a valid window are consecutive days, so a rolling mean over rows is the one over the calendar
+        features = None if self.log_features_days is None else log_features(ohlcv, self.log_features_days)
+        indicators = None if self.indicator_engine is None else self.indicator_engine.compute(ohlcv)
+        loaded = (days, ohlcv, features, indicators)
+        self.cache.put(code, loaded)
+        return loaded
+
+    def sample_index(self, symbols=None):
+        """
+        Lists the valid windows of the given symbols (Or all symbols), grouped by date. (See `DenseTimeSeries.sample_index`)
+
+        Only the dates of the symbols are read, not their prices.
+        """
+        codes = np.arange(len(self.symbols))
+        if symbols is not None:
+            codes = codes[np.isin(self.symbols, symbols)]
+
+        date_indices = []
+        symbol_indices = []
+        for code in codes:
+            days = self.ordinal_to_day[self._read_columns(code)['Date'] - self.first_ordinal]
+            # A window is valid if its `timeseries_length` rows are consecutive days of the calendar
+            ends = days[self.timeseries_length - 1:]
+            valid = ends - days[:len(ends)] == self.timeseries_length - 1
+            date_indices.append(ends[valid] - (self.timeseries_length - 1))
+            symbol_indices.append(np.full(np.count_nonzero(valid), code, dtype=np.int32))
+
+        date_indices = np.concatenate(date_indices) if date_indices else np.zeros(0, dtype=np.int32)
+        symbol_indices = np.concatenate(symbol_indices) if symbol_indices else np.zeros(0, dtype=np.int32)
+        order = np.argsort(date_indices, kind='stable')
+        counts = np.bincount(date_indices, minlength=len(self.dates))
+        dates = np.flatnonzero(counts)
+        offsets = np.concatenate([[0], np.cumsum(counts[dates])])
+        return dates, offsets, symbol_indices[order]
+
+    def gather(self, dates, symbol_indices):
+        """
+        Builds the windows of the given (date, symbol) pairs, as returned by `sample_index`. `dates` is broadcasted to the shape of `symbol_indices`.
+
+        Returns float32 array[*symbol_indices.shape][day][low, high, open, close, volume], followed by the LOG_FEATURES with `with_log_features` and the indicators with `with_indicators`
+        """
+        dates = np.broadcast_to(dates, symbol_indices.shape).ravel()
+        codes = symbol_indices.ravel()
+        num_log_features = 0 if self.log_features_days is None else len(LOG_FEATURES)
+        num_indicators = 0 if self.indicator_engine is None else len(self.indicator_engine)
+        windows = np.empty([len(codes), self.timeseries_length, len(FEATURES) + num_log_features + num_indicators], dtype=np.float32)
+
+        order = np.argsort(codes, kind='stable')
+        boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+        for samples in np.split(order, boundaries):
+            if len(samples) == 0:
+                continue
+            days, ohlcv, features, indicators = self.load(codes[samples[0]])
+            rows = np.searchsorted(days, dates[samples])[:, np.newaxis] + np.arange(self.timeseries_length)
+            windows[samples, :, :len(FEATURES)] = ohlcv[rows]
+            if features is not None:
+                windows[samples, :, len(FEATURES):len(FEATURES) + num_log_features] = features[rows]
+            if indicators is not None:
+                windows[samples, :, len(FEATURES) + num_log_features:] = indicators[rows]
+        return windows.reshape(symbol_indices.shape + windows.shape[1:])
+
+    def __repr__(self):
+        return f'UniverseStore({len(self.symbols)} symbols, {len(self.calendar)} days, {len(self.cache.loaded)} loaded, {self.cache.memory_used / 2**20:.1f}/{self.memory_budget / 2**20:.0f} MiB, hits={self.cache.hits}, misses={self.cache.misses})'
+
+def train_test_split_symbols(all_symbols, test_ratio=DEFAULT_TEST_RATIO, seed=None):
+    """
+    Randomly split a list of symbols in train and test symbols
+    """
+    train_symbols, test_symbols = train_test_split(sorted(all_symbols), test_size=test_ratio, random_state=seed)
+    logger.warning(f'Train/Test split: {train_symbols} / {test_symbols}')
+    return (train_symbols, test_symbols)
+
 def train_test_split_by_symbol(dataset, test_ratio=DEFAULT_TEST_RATIO):
     """
     Split a dataset in train a test partitions
 
     It uses the date as key (All records on the same date are either test or train).
     The rationale behind it is that, despite large individual variation, the whole market often moves as a whole and the same changes are seen by different companies at the same day.
+
+    This copies and shuffles the whole dataset. `splits` partitions the samples of `minibatch_producer` with index arrays instead.
     """
-    all_symbols = sorted(set(dataset.Symbol))
-    train_symbols, test_symbols = train_test_split(all_symbols, test_size=test_ratio)
-    logger.warning(f'Train/Test split: {train_symbols} / {test_symbols}')
+    train_symbols, test_symbols = train_test_split_symbols(set(dataset.Symbol), test_ratio=test_ratio)
     train_dataset = dataset[dataset.Symbol.isin(set(train_symbols))].sample(frac=1).reset_index(drop=True)
     test_dataset = dataset[dataset.Symbol.isin(set(test_symbols))].sample(frac=1).reset_index(drop=True)
     return (train_dataset, test_dataset)
 
-def minibatch_producer(symbols=DEFAULT_SYMBOLS, min_date=DEFAULT_MIN_DATE, timeseries_length=DEFAULT_TIMESERIES_LENGTH, test_ratio=DEFAULT_TEST_RATIO, minibatch_size=100, num_companies=10):
+def minibatch_producer(symbols=DEFAULT_SYMBOLS, min_date=DEFAULT_MIN_DATE, timeseries_length=DEFAULT_TIMESERIES_LENGTH, test_ratio=DEFAULT_TEST_RATIO, minibatch_size=100, num_companies=10, seed=None, dense=None, store=None, split='symbol', log_features=None, indicators=None):
     """
     Loads and pre-process data from the specified companies (symbols), and returns a function to produce new minibatches.
 
-    Each minibatch is a tensor[minibatch][company][days][low, high, open, close, volume]
+    Each minibatch is a tensor[minibatch][company][days][low, high, open, close, volume] (Followed by the LOG_FEATURES with `log_features`, and by the `indicators`)
 
     min_date: Any data before this is ignores -- e.g., We don't want to traing/validate with data from the 1970's
     timeseries_length: Number of consecutive days to fetch
-    test_ratio: Ratio of data samples reserved for testing  (Data partitioning is done by date)
+    test_ratio: Ratio of data samples reserved for testing
+    split: How the samples are partitioned: 'symbol', 'date', 'weekday' (See `splits`), or a `splits.Fold` of `produce.index` (E.g., from `splits.walk_forward`)
     minibatch_size: Number of minibatches to produce on each call (Can be overriden on each call)
     num_companies: Number of companies sampled on each minibatch (Can be overriden on each call)
-    """
-
-    def split_timeseries_by_date(timeseries):
-        dates = set(timeseries.Date)
-        return {
-            date: timeseries[timeseries.Date == date]
-            for date in dates
-        }
+    seed: Seed for the train/test split and for the sampling, for reproducible minibatches
+    dense: A preloaded `DenseTimeSeries` (E.g., from `DenseTimeSeries.load`), used instead of reading `symbols` since `min_date`
+    store: A `UniverseStore` to sample from, instead of a `DenseTimeSeries`. Symbols are loaded lazily, so it can sample from every Stock and ETF.
+    log_features: Mean volume days (The trader `historic_window_size`) of the precomputed LOG_FEATURES appended after the raw features of each minibatch (See `log_features()`), or `None`
+    indicators: An `indicators.IndicatorEngine` (Or a list of indicators) whose indicators are appended to each minibatch, or `None`
 
-    all_timeseries = concat_data(read_time_series(symbols, min_date, timeseries_length))
-    train_timeseries, test_timeseries = train_test_split_by_symbol(all_timeseries, test_ratio=test_ratio)
+    The returned function also takes an `rng` argument, to sample using another `numpy.random.Generator` (E.g., one per prefetch worker)
+    `produce.market(set, num_dates)` samples market-wide minibatches instead: every symbol available on a date, with a padding mask, and the same `rng` argument.
+    It also exposes the underlying `DenseTimeSeries` as `produce.dense` (or the `UniverseStore` as `produce.store`), its `splits.SampleIndex` as `produce.index`, the `Fold` as `produce.fold`,
+    and the samples of each set grouped by date (See `DenseTimeSeries.sample_index()`) as `produce.sample_indices[set]`
+    """
+    if indicators is not None and not isinstance(indicators, IndicatorEngine):
+        indicators = IndicatorEngine(indicators)
+    indicator_names = None if indicators is None else indicators.names
 
-    all_timeseries, train_timeseries, test_timeseries = split_timeseries_by_date(all_timeseries), split_timeseries_by_date(train_timeseries), split_timeseries_by_date(test_timeseries)
+    if store is not None:
+        if store.timeseries_length != timeseries_length:
+            store = store.with_timeseries_length(timeseries_length)
+        if store.log_features_days != log_features:
+            store = store.with_log_features(log_features)
+        if (None if store.indicator_engine is None else store.indicator_engine.names) != indicator_names:
+            store = store.with_indicators(indicators)
+        source = store
+    else:
+        if dense is None:
+            dense = read_dense_time_series(symbols, min_date, timeseries_length)
+        if dense.timeseries_length != timeseries_length:
+            dense = dense.with_timeseries_length(timeseries_length)
+        if dense.log_features_days != log_features:
+            dense = dense.with_log_features(log_features)
+        if dense.indicator_names != indicator_names:
+            dense = dense.with_indicators(indicators)
+        source = dense
+    index = splits.SampleIndex(source)
+    if isinstance(split, splits.Fold):
+        fold = split
+    elif split == 'symbol':
+        train_symbols, test_symbols = train_test_split_symbols(source.symbols, test_ratio=test_ratio, seed=seed)
+        train = np.isin(source.symbols, train_symbols)[index.sample_symbols]
+        fold = splits.Fold(train=np.flatnonzero(train), test=np.flatnonzero(~train))
+    else:
+        fold = splits.split(index, split, test_ratio=test_ratio, seed=seed)
+    all_index, train_index, test_index = index.group_by_date(), index.group_by_date(fold.train), index.group_by_date(fold.test)
+    rng = np.random.default_rng(seed)
 
-    def produce(set=None, minibatch_size=minibatch_size, num_companies=num_companies):
+    def sample_index(set):
         if set == 'train':
-            timeseries = train_timeseries
+            dates, offsets, symbol_indices = train_index
         elif set == 'test':
-            timeseries = test_timeseries
+            dates, offsets, symbol_indices = test_index
         elif set is None:
-            timeseries = all_timeseries
+            dates, offsets, symbol_indices = all_index
         else:
             raise Exception("Expected set do be 'train', 'test' or None")
+        if not len(dates):
+            raise Exception(f"Expected the {set or 'whole'} set to have samples (The split left it empty)")
+        return dates, offsets, symbol_indices
+
+    def gather(date_indices, symbol_samples):
+        if store is not None:
+            return store.gather(date_indices, symbol_samples)
+        windows = [dense.windows, dense.log_windows, dense.indicator_windows]
+        windows = [window[date_indices, symbol_samples] for window in windows if window is not None]
+        return windows[0] if len(windows) == 1 else np.concatenate(windows, axis=3)
+
+    def produce(set=None, minibatch_size=minibatch_size, num_companies=num_companies, rng=rng):
+        dates, offsets, symbol_indices = sample_index(set)
+        date_samples = rng.integers(len(dates), size=minibatch_size)
+        first, last = offsets[date_samples, np.newaxis], offsets[date_samples + 1, np.newaxis]
+        symbol_samples = symbol_indices[rng.integers(first, last, size=[minibatch_size, num_companies])]
+        return gather(dates[date_samples, np.newaxis], symbol_samples)
+
+    def market(set=None, num_dates=1, date_samples=None, rng=rng):
+        """
+        Market-wide minibatches: Every symbol of the set available on each sampled date, once.
+
+        Arguments:
+        - num_dates: Number of dates sampled
+        - date_samples: The dates to use instead of sampling them, as positions in the dates of the set (`produce.sample_indices[set][0]`)
+
+        Returns: (windows, mask)
+        - windows: tensor[date][symbol][days][features], with as many symbols as the date with the most symbols.
+          The other dates are padded with copies of their first symbol, so every value is real data.
+        - mask: bool tensor[date][symbol], set on the symbols that are not padding (See `trader.build_graph(market_wide=True)`)
+        """
+        dates, offsets, symbol_indices = sample_index(set)
+        if date_samples is None:
+            date_samples = rng.choice(len(dates), size=num_dates, replace=False)
+        date_samples = np.asarray(date_samples)
+        first, counts = offsets[date_samples], offsets[date_samples + 1] - offsets[date_samples]
+        positions = np.arange(counts.max())
+        mask = positions < counts[:, np.newaxis]
+        symbol_samples = symbol_indices[first[:, np.newaxis] + np.where(mask, positions, 0)]
+        return gather(dates[date_samples, np.newaxis], symbol_samples), mask
 
-        minibatch = []
-        for i in range(minibatch_size):
-            #print(len(timeseries.Date[10983]))
-            date = random.choice(list(timeseries.keys()))
-            timeseries_at_date = timeseries[date]
-
-            samples = timeseries_at_date.sample(n = num_companies, replace = True)
-            samples = samples.as_matrix(columns=samples.columns[2:])
-            samples = samples.reshape([num_companies, -1, 5])
-            minibatch.append(samples)
-        return np.stack(minibatch)
+    produce.market = market
+    produce.dense = dense
+    produce.store = store
+    produce.index = index
+    produce.fold = fold
+    produce.sample_indices = {'train': train_index, 'test': test_index, None: all_index}
     return produce
@@ -0,0 +1,189 @@
+"""
+Hyperparameter sweeps: Runs many `trader.execute_trader` jobs in parallel, and collects their results in a table.
+
+Example:
+    space = {
+        'learning_rate': sweep.LogUniform(0.005, 0.5),
+        'historic_window_size': [5, 10, 20],
+        'optimize_price_error': [True],
+    }
+    results = sweep.run_sweep(sweep.random_search(space, 20), stop_at=2000, processes=4)
+
+Parameters that are arguments of `trader.build_graph` are passed as `graph_params`, the others are passed directly to `execute_trader`.
+
+Jobs run on spawned processes: When called from a script (rather than a notebook), `run_sweep` must be called under `if __name__ == '__main__':`
+"""
+import os
+import inspect
+import logging
+import itertools
+import contextlib
+import multiprocessing
+import traceback
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import stock_dataset
+
+logger = logging.getLogger('sweep')
+
+class Uniform:
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+
+    def sample(self, rng):
+        return float(rng.uniform(self.low, self.high))
+
+    def __repr__(self):
+        return f'Uniform({self.low}, {self.high})'
+
+class LogUniform:
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+
+    def sample(self, rng):
+        return float(np.exp(rng.uniform(np.log(self.low), np.log(self.high))))
+
+    def __repr__(self):
+        return f'LogUniform({self.low}, {self.high})'
+
+def grid(space):
+    """
+    Every combination of the values in `space` ({parameter: [values]})
+    """
+    names = list(space.keys())
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(space[name] for name in names))
+    ]
+
+def random_search(space, num_samples, seed=None):
+    """
+    Samples `num_samples` configurations from `space`.
+
+    The values of `space` are either a list of choices, a distribution (`Uniform`, `LogUniform`, or any object with a `sample(rng)` method), or a constant
+    """
+    rng = np.random.default_rng(seed)
+    def sample(values):
+        if isinstance(values, list):
+            return values[rng.integers(len(values))]
+        elif hasattr(values, 'sample'):
+            return values.sample(rng)
+        else:
+            return values
+    return [
+        {name: sample(values) for name, values in space.items()}
+        for i in range(num_samples)
+    ]
+
+def _job_params(params):
+    """
+    Splits the parameters of a job in `execute_trader` and `build_graph` arguments
+    """
+    import trader
+    graph_arguments = set(inspect.signature(trader.build_graph).parameters)
+    trader_params = {name: value for name, value in params.items() if name not in graph_arguments}
+    graph_params = {name: value for name, value in params.items() if name in graph_arguments}
+    return trader_params, graph_params
+
+def _run_job(job):
+    """
+    Runs a single job on a pool worker. The output of `execute_trader` goes to `{run_dir}.log`
+    """
+    import tensorflow as tf
+    import trader
+
+    start = time.time()
+    result = dict(job=job['job'], **job['params'])
+    run_name = f'{job["sweep"]}/{job["job"]:03d}'
+    try:
+        trader_params, graph_params = _job_params(job['params'])
+        trader_params = {**job['base_params'], **trader_params}
+        graph_params = {**trader_params.pop('graph_params', {}), **graph_params}
+        dense = stock_dataset.DenseTimeSeries.load(job['dataset_dir'], timeseries_length=1)
+        session_config = tf.ConfigProto(
+            intra_op_parallelism_threads = job['intra_op_threads'],
+            inter_op_parallelism_threads = job['inter_op_threads'])
+
+        with open(f'runs/{run_name}.log', 'w') as log, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            output = trader.execute_trader(
+                run_name = run_name,
+                session_config = session_config,
+                graph_params = graph_params,
+                dataset_params = dict(dense=dense, **job['dataset_params']),
+                **trader_params)
+
+        result.update(
+            status = 'done',
+            iteration = output['iteration'],
+            best_test_profit = output['best_test_profit'],
+            **{f'test_{name}': value for name, value in output['test'].items()})
+    except Exception:
+        result.update(status='failed', error=traceback.format_exc().strip().split('\n')[-1])
+        logger.warning(f'Job {run_name} failed:\n{traceback.format_exc()}')
+    result.update(run_dir=f'runs/{run_name}', seconds=time.time() - start)
+    return result
+
+def run_sweep(configs, stop_at, name=None, processes=None, intra_op_threads=1, inter_op_threads=1, base_params={}, dataset_params={}, symbols=stock_dataset.DEFAULT_SYMBOLS, min_date=stock_dataset.DEFAULT_MIN_DATE):
+    """
+    Runs one `execute_trader` job for each configuration, on a pool of processes.
+
+    Arguments:
+    - configs: List of {parameter: value}, e.g. from `grid` or `random_search`
+    - stop_at: Train steps of each job
+    - name: Directory of the sweep in `runs/`, defaults to `sweep-{timestamp}`. Each job runs on `runs/{name}/{job}`
+    - processes: Number of parallel jobs, defaults to the number of CPUs divided by the threads of each job
+    - intra_op_threads, inter_op_threads: TF thread pools of each job
+    - base_params: `execute_trader` arguments shared by every job
+    - dataset_params: `stock_dataset.minibatch_producer` arguments shared by every job (test_ratio, seed).
+      The seed defaults to 0, so every job has the same train/test split and their test profits can be compared.
+    - symbols, min_date: The dataset, loaded once and shared by all jobs
+
+    The dataset is saved on `runs/{name}/dataset` (See `DenseTimeSeries.save`), and memory-mapped read-only by every job, so it's loaded from the CSVs only once and its pages are shared.
+
+    Returns a DataFrame with the parameters and results of each job, sorted by the best test profit. It is also saved as `runs/{name}/results.csv` (updated as the jobs finish)
+    """
+    if name is None:
+        name = f'sweep-{datetime.utcnow().strftime("%Y-%m-%d-%H-%M-%S")}'
+    if processes is None:
+        processes = max(1, os.cpu_count() // (intra_op_threads + inter_op_threads))
+    dataset_params = dict(dataset_params)
+    dataset_params.setdefault('seed', 0)
+    sweep_dir = f'runs/{name}'
+    dataset_dir = f'{sweep_dir}/dataset'
+    results_file = f'{sweep_dir}/results.csv'
+
+    logger.info(f'Loading dataset into {dataset_dir}')
+    stock_dataset.read_dense_time_series(symbols, min_date, timeseries_length=1).save(dataset_dir)
+
+    jobs = [
+        dict(
+            sweep = name,
+            job = i,
+            params = params,
+            base_params = dict(base_params, stop_at=stop_at),
+            dataset_params = dataset_params,
+            dataset_dir = dataset_dir,
+            intra_op_threads = intra_op_threads,
+            inter_op_threads = inter_op_threads,
+        )
+        for i, params in enumerate(configs)
+    ]
+
+    def results_table(results):
+        table = pd.DataFrame(results)
+        if 'best_test_profit' in table.columns:
+            table = table.sort_values('best_test_profit', ascending=False, na_position='last')
+        return table.reset_index(drop=True)
+
+    # TF is not fork-safe, jobs run on fresh processes
+    results = []
+    with multiprocessing.get_context('spawn').Pool(processes, maxtasksperchild=1) as pool:
+        for result in pool.imap_unordered(_run_job, jobs):
+            results.append(result)
+            results_table(results).to_csv(results_file, index=False)
+            print(f'[{len(results)}/{len(jobs)}] Job {result["job"]} {result["status"]} in {result["seconds"]:.0f}s -- best test profit: {result.get("best_test_profit")}')
+
+    return results_table(results)
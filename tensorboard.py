@@ -3,7 +3,15 @@ import tensorflow as tf
 import subprocess
 import re
 import os
+import time
+import json
+import fcntl
+import signal
+import socket
+import hashlib
 import logging
+import tempfile
+import contextlib
 import ngrok
 import urllib.parse
 
@@ -76,59 +84,199 @@ class Badge:
 
 
 logger = logging.getLogger('tensorboard-server')
+
+TENSORBOARD_COMMAND = ["tensorboard"]
+REGISTRY_DIR = os.environ.get('TENSORBOARD_REGISTRY', '/tmp/tensorboard-servers')
+
+class Registry:
+    """
+    Shares the TensorBoard server (and tunnel) of a logdir between Python processes, e.g. across kernel restarts or sweep workers.
+
+    Each logdir has, in `REGISTRY_DIR`, a JSON file with the pid and port of its server and tunnel, the server log, and a lock file.
+    Holding `lock()` makes starting a server (or tunnel) and registering it atomic, so concurrent processes start only one.
+    """
+    def __init__(self, logdir, registry_dir=None):
+        registry_dir = registry_dir or REGISTRY_DIR
+        os.makedirs(registry_dir, exist_ok=True)
+        key = hashlib.sha1(logdir.encode('utf-8')).hexdigest()[:16]
+        self.path = f'{registry_dir}/{key}.json'
+        self.log_file = f'{registry_dir}/{key}.log'
+        self.tunnel_log_file = f'{registry_dir}/{key}.ngrok.log'
+        self.lock_file = f'{registry_dir}/{key}.lock'
+
+    @contextlib.contextmanager
+    def lock(self):
+        with open(self.lock_file, 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def read(self):
+        """
+        Returns the registered server, if it is still running (Or None)
+        """
+        try:
+            with open(self.path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not ngrok.is_alive(entry['pid']) or not _accepts_connections(entry['port']):
+            return None
+        tunnel = entry.get('tunnel')
+        if tunnel is not None and not ngrok.is_alive(tunnel['pid']):
+            entry['tunnel'] = None
+        return entry
+
+    def write(self, entry):
+        with open(f'{self.path}.tmp', 'w') as f:
+            json.dump(entry, f)
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def _accepts_connections(port):
+    try:
+        socket.create_connection(('127.0.0.1', int(port)), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
 class Server:
+    """
+    A TensorBoard server of a logdir, with an optional ngrok tunnel to a public URL.
+
+    - closeable: `close()` stops the server and its tunnel
+    - tunnel: Tunnels `public_url` through ngrok. The tunnel is only started the first time `public_url` is used.
+      Without a tunnel, `public_url` is the local address.
+    - shared: Reuses the server (and tunnel) of the same logdir started by another Python process, if it is still running (See `Registry`).
+      Otherwise, starts one detached from this process, so later processes can reuse it.
+    - command: The TensorBoard command line, before the `--logdir ...` arguments
+
+    `Server.of` returns a shared server, that is never closed. It has a tunnel as soon as one of its callers asks for it.
+    """
     instances = {}
 
     @staticmethod
-    def of(logdir="tensorboard"):
+    def of(logdir="tensorboard", tunnel=True):
         logdir = os.path.abspath(logdir)
         if logdir not in Server.instances:
-            Server.instances[logdir] = Server(logdir, closeable=False)
+            Server.instances[logdir] = Server(logdir, closeable=False, tunnel=tunnel, shared=True)
+        elif tunnel:
+            # Started by `public_url`, like the tunnel of a new server
+            Server.instances[logdir].tunnel = True
         return Server.instances[logdir]
 
-    def __init__(self, logdir="tensorboard", closeable = True):
+    def __init__(self, logdir="tensorboard", closeable = True, tunnel = True, shared = False, command = None, timeout = 60):
         self.closeable = closeable
+        self.tunnel = tunnel
+        self.shared = shared
         self.logdir = os.path.abspath(logdir)
+        self.registry = Registry(self.logdir) if shared else None
+        self.process = None
+        self.ngrok = None
         os.makedirs(self.logdir, exist_ok=True)
+
+        if shared:
+            with self.registry.lock():
+                entry = self.registry.read()
+                if entry is None:
+                    self._start(command or TENSORBOARD_COMMAND, self.registry.log_file, timeout)
+                    self.registry.write(self._entry())
+                else:
+                    logger.debug(f'Reusing tensorboard process {entry["pid"]} for {self.logdir}')
+                    self.pid = entry['pid']
+                    self.version = entry['version']
+                    self.host = entry['host']
+                    self.port = entry['port']
+                    if entry.get('tunnel') is not None:
+                        self.ngrok = ngrok.Ngrok.attach(**entry['tunnel'])
+        else:
+            fd, log_file = tempfile.mkstemp(prefix='tensorboard-', suffix='.log')
+            os.close(fd)
+            self._start(command or TENSORBOARD_COMMAND, log_file, timeout)
+
+        self.private_url = f'http://{self.host}:{self.port}'
+        logger.debug(f'TensorBoard running at {self.private_url}')
+
+    def _start(self, command, log_file, timeout):
+        """
+        Starts the tensorboard process, and waits until it reports its address on the log file
+        """
         logger.debug(f'Starting tensorboard process for {self.logdir}')
-        self.process = subprocess.Popen(["tensorboard", "--logdir", self.logdir, "--host", '0.0.0.0', "--port", "0"], stderr=subprocess.PIPE)
+        with open(log_file, 'w') as log:
+            self.process = subprocess.Popen(command + ["--logdir", self.logdir, "--host", '0.0.0.0', "--port", "0"], stdout=subprocess.DEVNULL, stderr=log, start_new_session=self.shared)
+        self.pid = self.process.pid
 
         try:
             self.version = None
             self.host = None
             self.port = None
-            self.ngrok = None
 
-            for line in self.process.stderr:
-                line = line.decode("utf-8").strip()
-                match = re.match('TensorBoard (.*) at http://([^:]+):(\d+) .*', line)
-                if match:
-                    self.version = match.group(1)
-                    self.host = match.group(2)
-                    self.port = match.group(3)
-                    break
+            start_time = time.time()
+            with open(log_file) as log:
+                while self.port is None:
+                    line = log.readline()
+                    if not line:
+                        if self.process.poll() is not None or (time.time() - start_time) > timeout:
+                            break
+                        time.sleep(0.02)
+                        continue
+                    match = re.match('TensorBoard (.*) at http://([^:]+):(\d+) .*', line.strip())
+                    if match:
+                        self.version = match.group(1)
+                        self.host = match.group(2)
+                        self.port = match.group(3)
 
             if self.port is None or self.version is None:
                 raise Exception("tensorboard didn't bind to a local address!?")
 
-            self.ngrok = ngrok.Http(host=self.host, port=self.port)
-            self.private_url = f'http://{self.host}:{self.port}'
-
-            logging.debug(f'TensorBoard running at {self.public_url}')
-
         except:
             logger.warning('Initialization error, killing tensorboard process')
-            if self.ngrok != None:
-                self.ngrok.close()
             self.process.kill()
             raise
 
+    def _entry(self):
+        return dict(
+            logdir = self.logdir,
+            pid = self.pid,
+            version = self.version,
+            host = self.host,
+            port = self.port,
+            tunnel = None if self.ngrok is None else dict(pid=self.ngrok.pid, admin_addr=self.ngrok.admin_addr, public_url=self.ngrok.public_url),
+        )
+
+    def _start_tunnel(self):
+        if not self.shared:
+            self.ngrok = ngrok.Http(host=self.host, port=self.port)
+            return
+
+        with self.registry.lock():
+            entry = self.registry.read()
+            if entry is not None and entry['pid'] == self.pid and entry.get('tunnel') is not None:
+                self.ngrok = ngrok.Ngrok.attach(**entry['tunnel'])
+                return
+            self.ngrok = ngrok.Http(host=self.host, port=self.port, log_file=self.registry.tunnel_log_file, detached=True)
+            try:
+                self.registry.write(self._entry())
+            except:
+                self.ngrok.close()
+                self.ngrok = None
+                raise
+
     @property
     def runs(self):
         return os.listdir(self.logdir)
 
     @property
     def public_url(self):
+        if not self.tunnel:
+            return self.private_url
+        if self.ngrok is None or not self.ngrok.alive:
+            self._start_tunnel()
         return self.ngrok.public_url
 
     def run_url(self, run):
@@ -141,8 +289,16 @@ class Server:
 
     def close(self):
         if self.closeable:
-            self.ngrok.close()
-            self.process.kill()
+            if self.ngrok is not None:
+                self.ngrok.close()
+            if self.process is not None:
+                self.process.kill()
+                self.process.wait()
+            elif ngrok.is_alive(self.pid):
+                os.kill(self.pid, signal.SIGKILL)
+            if self.shared:
+                with self.registry.lock():
+                    self.registry.remove()
 
     def badge(self, run=None):
         if run is None:
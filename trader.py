@@ -0,0 +1,1060 @@
+"""
+The Stock Trader: A LSTM trader network, a differentiable trading environment, and the training loop.
+"""
+import os
+import logging
+import functools
+import contextlib
+import typing
+import time
+from datetime import datetime
+
+import tensorflow as tf
+from IPython.display import display
+
+import softops
+import tensorboard
+import stock_dataset
+import prefetch
+import checkpoints
+import profiling
+from indicators import IndicatorEngine
+from normalize import log_perc
+from market import *
+
+is_colab = os.path.exists('is_colab')
+
+# Graph collections of the summaries, besides `tf.GraphKeys.SUMMARIES`, so they can be computed at different cadences
+SCALAR_SUMMARIES = 'scalar_summaries'
+HISTOGRAM_SUMMARIES = 'histogram_summaries'
+
+class TradingState:
+    """
+    company_mask: Optional float tensor[minibatch, company], 1 for real companies and 0 for padding (See `build_graph(market_wide=True)`). Padding is left out of the account values.
+    """
+    def __init__(self, money: tf.Tensor, stocks: tf.Tensor, stock_prices: tf.Tensor, inner_state: typing.Any = None, money_value: tf.Tensor = None, stocks_value: tf.Tensor = None, account_value: tf.Tensor = None, company_mask: tf.Tensor = None):
+        self.money = tf.identity(money, name='money')
+        self.stocks = tf.identity(stocks, name='stocks')
+        self.stock_prices = tf.identity(stock_prices, name='stock_prices')
+        self.inner_state = inner_state
+        self.company_mask = company_mask
+
+        if money_value is not None:
+            self.money_value = tf.identity(money_value, name='money_value')
+        else:
+            self.money_value = tf.reduce_sum(self.money, axis=1, name='money_value')
+
+        if stocks_value is not None:
+            self.stocks_value = tf.identity(stocks_value, name='stocks_value')
+        else:
+            self.stocks_value = tf.reduce_sum(self.masked(self.stocks*self.stock_prices), axis=1, name='stocks_value')
+
+        if account_value is not None:
+            self.account_value = tf.identity(account_value, name='account_value')
+        else:
+            self.account_value = tf.add(self.money_value, self.stocks_value, name='account_value')
+
+    def masked(self, values):
+        """
+        Zeroes the padding companies of tensor[minibatch, company]
+        """
+        if self.company_mask is None:
+            return values
+        return values * self.company_mask
+
+    def copy(self, **kwargs):
+        args = dict(
+            money = self.money,
+            stocks = self.stocks,
+            stock_prices = self.stock_prices,
+            inner_state = self.inner_state,
+            money_value = self.money_value,
+            stocks_value = self.stocks_value,
+            account_value = self.account_value,
+            company_mask = self.company_mask)
+        args.update(kwargs)
+        return TradingState(**args)
+
+def trader_builder(minibatch_size, num_companies, historic_window_size, future_window_size, trainable_variables_node):
+    num_trade_prices = NUM_RESPONSES - 1
+    num_output_predictions = future_window_size*NUM_FEATURES
+    num_outputs = num_trade_prices + 1 + num_output_predictions
+
+    lstm_sizes = [50, 50, num_outputs]
+
+    with trainable_variables_node:
+        multi_lstm_cell = tf.nn.rnn_cell.MultiRNNCell([
+            tf.nn.rnn_cell.LSTMCell(lstm_size)
+            for lstm_size in lstm_sizes
+        ], state_is_tuple=True)
+
+        output_bias = tf.Variable(tf.zeros([num_outputs]), name='output_bias')
+        output_scale = tf.Variable(tf.ones([num_outputs]), name='output_scale')
+
+    first_inner_state = multi_lstm_cell.zero_state(minibatch_size*num_companies, tf.float32)
+
+    def build_trader(state: TradingState, historic_data: tf.Tensor, log_historic_data: tf.Tensor = None, indicators: tf.Tensor = None) -> tf.Tensor:
+        """
+        Builds the trader network on tensorflow
+
+        Arguments:
+        - state: Trading state coming from the previous day
+        - historic_data: tensor[minibatch, company, time] -> [low, high, open, close]
+        - log_historic_data: tensor[minibatch, company, time] -> LOG_FEATURES, precomputed from `historic_data` (See `stock_dataset.log_features`).
+          If given, the input normalization is a subtraction in log scale, instead of `log_perc.normalize`.
+        - indicators: tensor[minibatch, company, indicator], the indicators of the last historic day (See `indicators`). They are already normalized.
+
+        Returns:
+        tensor[minibatch, company] -> [buy_price, buy_amount, sell_low_price, sell_high_price]
+        - buy_price: The price for which you want to buy stocks
+        - buy_amount: Fraction of the cash available to be used to buy stocks from this company (If the price target is reached)
+        - sell_high_price: If the stock price reaches more than this amount, all of the owned stocks will be sold (Ideal case, sell when the price is high)
+        - sell_low_price: If the stock price reaches less than this amount, all of the owned stocks will also be sold (Fucked up case: Prices are crashing, minimize losses)
+        """
+        with tf.name_scope('normalize_input'):
+            historic_data_shape = tf.shape(historic_data)
+            reference_price = historic_data[:, :, -1, FEATURE_CLOSE]
+            mean_volume = tf.reduce_mean(historic_data[:, :, :, FEATURE_VOLUME], axis=[2])
+            normalize_wrt = tf.stack(
+                [
+                    reference_price,
+                    reference_price,
+                    reference_price,
+                    reference_price,
+                    mean_volume,
+                ],
+                axis = 2
+            )
+            normalize_wrt = tf.tile(normalize_wrt[:, :, tf.newaxis, :], [1, 1, historic_window_size, 1], name='normalize_wrt')
+
+            if log_historic_data is None:
+                normalized_history = log_perc.normalize(
+                    historic_data,
+                    normalize_wrt,
+                    name='normalized_history'
+                )
+            else:
+                log_reference_price = log_historic_data[:, :, -1:, FEATURE_CLOSE]
+                log_mean_volume = log_historic_data[:, :, -1:, LOG_MEAN_VOLUME]
+                log_normalize_wrt = tf.stack(
+                    [
+                        log_reference_price,
+                        log_reference_price,
+                        log_reference_price,
+                        log_reference_price,
+                        log_mean_volume,
+                    ],
+                    axis = 3,
+                    name = 'log_normalize_wrt'
+                )
+
+                normalized_history = log_perc.normalize_log(
+                    log_historic_data[:, :, :, :NUM_FEATURES],
+                    log_normalize_wrt,
+                    name='normalized_history'
+                )
+
+            normalized_features = tf.reshape(
+                normalized_history,
+                [
+                    historic_data_shape[0]*historic_data_shape[1],
+                    historic_window_size*NUM_FEATURES
+                ])
+
+            if indicators is not None:
+                normalized_features = tf.concat(
+                    [
+                        normalized_features,
+                        tf.reshape(indicators, [historic_data_shape[0]*historic_data_shape[1], indicators.shape[2].value]),
+                    ],
+                    axis = 1,
+                    name = 'with_indicators')
+
+            #tf.summary.histogram('input_features', tf.clip_by_value(normalized_features, -5, +5))
+
+        with tf.name_scope('prediction'):
+            with tf.name_scope('RNN'):
+                outputs, inner_state = multi_lstm_cell(normalized_features, state.inner_state)
+            outputs = outputs * output_scale + output_bias
+
+            trade_prices = tf.reshape(outputs[:, :RESPONSE_BUY_AMOUNT], [historic_data_shape[0], historic_data_shape[1], num_trade_prices], name="order_prices")
+            buy_amount   = tf.reshape(outputs[:, RESPONSE_BUY_AMOUNT], [historic_data_shape[0], historic_data_shape[1]], name="buy_amount")
+            predictions  = tf.reshape(outputs[:, RESPONSE_BUY_AMOUNT+1:], [historic_data_shape[0], historic_data_shape[1], future_window_size, NUM_FEATURES], name="predictions")
+
+        with tf.name_scope('denormalize_prices'):
+            trade_prices = log_perc.denormalize(
+                trade_prices,
+                tf.tile(reference_price[:, :, tf.newaxis], [1, 1, num_trade_prices]),
+                'trade_decisions')
+
+            predictions = log_perc.denormalize(
+                predictions,
+                normalize_wrt,
+                'predictions')
+
+            #sell_low_price = log_perc.denormalize(trade_decisions[:, :, RESPONSE_SELL_LOW], reference_price,'sell_low_price')
+            #sell_high_price = log_perc.denormalize(trade_decisions[:, :, RESPONSE_SELL_HIGH], reference_price, 'sell_high_price')
+            #buy_price = log_perc.denormalize(trade_decisions[:, :, RESPONSE_BUY_PRICE], reference_price,'buy_price')
+
+        with tf.name_scope('result'):
+            return (trade_prices, buy_amount, predictions, inner_state)
+
+    return build_trader, first_inner_state
+
+def build_env_step(build_trader, state: TradingState, historic_data: tf.Tensor, future_data: tf.Tensor, log_historic_data: tf.Tensor = None, indicators: tf.Tensor = None, custom_gradients: bool = True) -> TradingState:
+    """
+    Builds a single-day trading environment.
+    Arguments:
+    - state: Trading state coming from the previous day
+    - historic_data: tensor[minibatch, company, time] -> [low, high, open, close]
+    - next_day_data: tensor[minibatch, company] -> [low, high, open, close]
+    - log_historic_data: Optional precomputed log features of `historic_data` (See `build_trader`)
+    - indicators: Optional indicators of the last historic day (See `build_trader`)
+    - custom_gradients: Builds the soft operations of the simulator with `tf.custom_gradient` (See `softops`)
+
+    Returns: (next_state, errors)
+    - next_state: Arguments for the TradingState at the end of the next trading day
+    - errors: The price and prediction errors of this day, {buy_amount_error, sell_low_price_error, sell_high_price_error, buy_price_error: tensor[minibatch, company], prediction_error: tensor[minibatch, company, future_day, feature]}
+    """
+    with tf.name_scope("trader"):
+        trade_prices, buy_amount, trade_predictions, new_inner_state = build_trader(state = state, historic_data = historic_data, log_historic_data = log_historic_data, indicators = indicators)
+
+    with tf.name_scope("simulator"):
+        softness = 0.1
+
+        with tf.name_scope("slicing"):
+            sell_low_price  = trade_prices[:, :, RESPONSE_SELL_LOW]
+            sell_high_price = trade_prices[:, :, RESPONSE_SELL_HIGH]
+            buy_price       = trade_prices[:, :, RESPONSE_BUY_PRICE]
+
+            current_money   = state.money[:, MONEY_TODAY]
+            current_stocks  = state.stocks
+            next_day_data = future_data[:, :, 0, :]
+            eod_stock_prices = next_day_data[:, :, FEATURE_CLOSE]
+
+        with tf.name_scope("predictions"):
+            predictions_error  = log_perc.normalize(
+                trade_predictions[:, :, :, :FEATURE_VOLUME],
+                future_data[:, :, :, :FEATURE_VOLUME],
+                'percent_error')
+
+        # Normalize buy amount to 1-sum
+        with tf.name_scope("buy_amount"):
+            buy_amount_error  = log_perc.normalize(
+                buy_amount,
+                log_perc.normalize(
+                    next_day_data[:, :, FEATURE_HIGH],
+                    next_day_data[:, :, FEATURE_LOW]
+                ),
+                'amount_error')
+            if state.company_mask is not None:
+                # Padding companies get no money
+                buy_amount = tf.where(state.company_mask > 0, buy_amount, tf.fill(tf.shape(buy_amount), -1e9))
+            buy_amount = tf.nn.softmax(buy_amount)
+
+        # Executes SELL transactions if prices reaches BELOW a threshold (minimize losses)
+        # (If the day opens below the threshold for LOW SELL, use the open price)
+        with tf.name_scope("sell_low"):
+            sell_low_price_error  = log_perc.normalize(
+                sell_low_price,
+                #tf.reduce_min(future_data[:, :, :, FEATURE_LOW], axis=2),
+                next_day_data[:, :, FEATURE_LOW],
+                'price_error')
+
+            sell_low_price = tf.identity(
+                sell_low_price,
+                name='order_price')
+            sell_low_price = tf.minimum(
+                next_day_data[:, :, FEATURE_OPEN],
+                sell_low_price,
+                name = 'actual_price')
+            sell_low_amount = tf.identity(
+                current_stocks,
+                name = 'order_amount')
+            sell_low_kernel = 0*tf.multiply(
+                softops.gte(sell_low_price, next_day_data[:, :, FEATURE_LOW], percent = True, softness = softness, custom_gradients = custom_gradients),
+                softops.positive(sell_low_amount, custom_gradients = custom_gradients),
+                name = 'order_executed')
+            sell_low_kernel = state.masked(sell_low_kernel)
+
+            sell_low_stock_bough = tf.zeros(tf.shape(sell_low_kernel), name='stock_bought')
+            sell_low_stock_sold = tf.multiply(sell_low_kernel, sell_low_amount, name='stock_sold')
+            money_earned_sell_low = tf.reduce_sum(sell_low_stock_sold * sell_low_price, axis=1, name='money_earned')
+            money_spent_sell_low = tf.reduce_sum(sell_low_kernel * SELL_TRANSACTION_COST, axis=1, name='money_spent')
+
+        # Executes SELL transactions if prices reaches ABOVE a threshold (Maximize gains)
+        with tf.name_scope("sell_high"):
+            sell_high_price_error = log_perc.normalize(
+                sell_high_price,
+                #tf.reduce_min(future_data[:, :, :, FEATURE_HIGH], axis=2),
+                next_day_data[:, :, FEATURE_HIGH],
+                'price_error')
+
+            sell_high_price = tf.identity(
+                sell_high_price,
+                name='order_price')
+            sell_high_price = tf.identity(
+                sell_high_price,
+                name='actual_price')
+            sell_high_amount = tf.identity(
+                current_stocks - sell_low_stock_sold,
+                name = 'order_amount')
+            sell_high_kernel = tf.multiply(
+                softops.lte(sell_high_price, next_day_data[:, :, FEATURE_HIGH], percent = True, softness = softness, custom_gradients = custom_gradients),
+                softops.positive(sell_high_amount, custom_gradients = custom_gradients),
+                name = 'order_executed')
+            sell_high_kernel = state.masked(sell_high_kernel)
+
+            sell_high_stock_bough = tf.zeros(tf.shape(sell_high_kernel), name='stock_bought')
+            sell_high_stock_sold = tf.multiply(sell_high_kernel, sell_high_amount, name='stock_sold')
+            money_earned_sell_high = tf.reduce_sum(sell_high_stock_sold * sell_high_price, axis=1, name='money_earned')
+            money_spent_sell_high = tf.reduce_sum(sell_high_kernel * SELL_TRANSACTION_COST, axis=1, name='money_spent')
+
+        # Executes BUY transactions if prices reaches above a threshold
+        # (Normalize `buy_amount` to be in amount of stocks, instead of fraction of my money)
+        with tf.name_scope("buy"):
+            buy_price_error = log_perc.normalize(
+                buy_price,
+                #tf.reduce_min(future_data[:, :, :, FEATURE_LOW], axis=2),
+                next_day_data[:, :, FEATURE_LOW],
+                'price_error')
+
+            buy_price = tf.identity(
+                buy_price,
+                name = 'order_price')
+            buy_price = tf.identity(
+                buy_price,
+                name = 'actual_price')
+            buy_amount = softops.floor(
+                buy_amount * current_money[:, tf.newaxis] / buy_price,
+                name = 'order_amount',
+                custom_gradients = custom_gradients)
+            buy_kernel = tf.multiply(
+                softops.gte(buy_price, next_day_data[:, :, FEATURE_LOW], percent = True, softness = softness, custom_gradients = custom_gradients),
+                softops.positive(buy_amount, custom_gradients = custom_gradients),
+                name='kernel')
+            buy_kernel = state.masked(buy_kernel)
+
+            buy_stock_bough = tf.multiply(buy_kernel, buy_amount, name='stock_sold')
+            buy_stock_sold = tf.zeros(tf.shape(buy_kernel), name='stock_bought')
+            money_earned_buy = tf.zeros(tf.shape(current_money), name='money_earned')
+            money_spent_buy = tf.reduce_sum(buy_stock_bough * buy_price + buy_kernel * BUY_TRANSACTION_COST, axis=1, name='money_spent')
+
+        with tf.name_scope("update_money"):
+            total_money_earned = money_earned_sell_high + money_earned_sell_low + money_earned_buy
+            total_money_spent = money_spent_sell_low + money_spent_sell_high + money_spent_buy
+            new_money_first = tf.expand_dims(current_money - total_money_spent + state.money[:, MONEY_TOMORROW], axis = 1)
+            new_money_middle = state.money[:, 2:]
+            new_money_last = tf.expand_dims(total_money_earned, axis = 1)
+
+            next_money = tf.concat([
+                new_money_first,
+                new_money_middle,
+                new_money_last
+            ], axis = 1)
+
+#             with tf.name_scope("money_earned"):
+#                 tf.summary.histogram('values', total_money_earned)
+#                 tf.summary.scalar('mean', tf.reduce_mean(total_money_earned))
+#             with tf.name_scope("money_spent"):
+#                 tf.summary.histogram('values', total_money_spent)
+#                 tf.summary.scalar('mean', tf.reduce_mean(total_money_spent))
+#             with tf.name_scope("money_delta"):
+#                 tf.summary.histogram('values', total_money_earned - total_money_spent)
+#                 tf.summary.scalar('mean', tf.reduce_mean(total_money_earned - total_money_spent))
+#             with tf.name_scope("money_final"):
+#                 tf.summary.histogram('values', tf.reduce_sum(next_money, axis=1))
+#                 tf.summary.scalar('mean', tf.reduce_mean(tf.reduce_sum(next_money, axis=1)))
+
+        with tf.name_scope("update_stocks"):
+            total_stocks_bought = sell_low_stock_bough + sell_high_stock_bough + buy_stock_bough
+            total_stocks_sold = sell_low_stock_sold + sell_high_stock_sold + buy_stock_sold
+            next_stocks = current_stocks + total_stocks_bought - total_stocks_sold
+            next_stocks_value = tf.reduce_sum(state.masked(next_stocks * eod_stock_prices), axis=1)
+
+#             with tf.name_scope("stocks_bought"):
+#                 tf.summary.histogram('values', total_stocks_bought)
+#                 tf.summary.scalar('mean', tf.reduce_mean(total_stocks_bought))
+#             with tf.name_scope("stocks_sold"):
+#                 tf.summary.histogram('values', total_stocks_sold)
+#                 tf.summary.scalar('mean', tf.reduce_mean(total_stocks_sold))
+#             with tf.name_scope("stocks_delta"):
+#                 tf.summary.histogram('values', total_stocks_bought - total_stocks_sold)
+#                 tf.summary.scalar('mean', tf.reduce_mean(total_stocks_bought - total_stocks_sold))
+#             with tf.name_scope("stocks_final"):
+#                 tf.summary.histogram('values', next_stocks)
+#                 tf.summary.scalar('mean', tf.reduce_mean(next_stocks))
+#             with tf.name_scope("stocks_value_final"):
+#                 tf.summary.histogram('values', next_stocks_value)
+#                 tf.summary.scalar('mean', tf.reduce_mean(next_stocks_value))
+#             with tf.name_scope("stocks_value_delta"):
+#                 tf.summary.histogram('values', next_stocks_value - state.stocks_value)
+#                 tf.summary.scalar('mean', tf.reduce_mean(next_stocks_value - state.stocks_value))
+
+        next_state = dict(
+            money = next_money,
+            stocks = next_stocks,
+            stock_prices = eod_stock_prices,
+            stocks_value= next_stocks_value,
+            inner_state = new_inner_state,
+            company_mask = state.company_mask
+        )
+        errors = dict(
+            buy_amount_error = buy_amount_error,
+            sell_low_price_error = sell_low_price_error,
+            sell_high_price_error = sell_high_price_error,
+            buy_price_error = buy_price_error,
+            prediction_error = predictions_error,
+        )
+        return next_state, errors
+
+def build_env(trainable_variables_node, historic_data, initial_state, num_days, historic_window_size, future_window_size, day_loop='unrolled', log_historic_data=None, indicator_data=None, custom_gradients=True):
+    """
+    Builds the trading environment for `num_days` consecutive days.
+
+    log_historic_data: Optional precomputed log features of `historic_data`, sliced like it and passed to the trader (See `build_trader`)
+    indicator_data: Optional tensor[minibatch, company, time, indicator]. The trader gets the indicators of the last day of its historic window.
+    custom_gradients: See `build_env_step`
+
+    day_loop:
+    - 'unrolled': Builds one copy of the trader and simulator per day, under `day_{i}` name scopes.
+    - 'while_loop': Builds a single copy inside a `tf.while_loop`, so graph size and build time don't depend on `num_days`.
+
+    Returns: dict with
+    - initial_state, final_state: TradingState before the first and after the last day
+    - account_values: tensor[minibatch, num_days+1], the account value after each day (starting with the initial state)
+    - errors: The errors returned by `build_env_step`, stacked on a new `day` axis after [minibatch, company]
+    """
+    build_trader, first_inner_state = trader_builder(
+        minibatch_size = tf.shape(historic_data)[0],
+        num_companies = tf.shape(historic_data)[1],
+        historic_window_size = historic_window_size,
+        future_window_size = future_window_size,
+        trainable_variables_node = trainable_variables_node)
+
+    with tf.name_scope(f'state_0'):
+        current_state = TradingState(inner_state = first_inner_state, **initial_state)
+
+    if day_loop == 'unrolled':
+        all_states = [current_state]
+        all_errors = []
+
+        for i in range(num_days):
+            #print(f'day_{i}')
+            with tf.name_scope(f'day_{i}'):
+                with tf.name_scope(f'historic_data'):
+                    historic_slice = historic_data[:, :, i:i+historic_window_size, :]
+                    log_historic_slice = None if log_historic_data is None else log_historic_data[:, :, i:i+historic_window_size, :]
+                    indicator_slice = None if indicator_data is None else indicator_data[:, :, i+historic_window_size-1, :]
+                with tf.name_scope(f'future_data'):
+                    future_slice = historic_data[:, :, i+historic_window_size:i+historic_window_size+future_window_size, :]
+
+                current_state, errors = build_env_step(
+                    build_trader = build_trader,
+                    state = current_state,
+                    historic_data = historic_slice,
+                    future_data = future_slice,
+                    log_historic_data = log_historic_slice,
+                    indicators = indicator_slice,
+                    custom_gradients = custom_gradients
+                )
+
+            with tf.name_scope(f'state_{i+1}'):
+                current_state = TradingState(**current_state)
+
+            all_states.append(current_state)
+            all_errors.append(errors)
+
+        return dict(
+            initial_state = all_states[0],
+            final_state = all_states[-1],
+            account_values = tf.stack([state.account_value for state in all_states], axis=1),
+            errors = {
+                name: tf.stack([errors[name] for errors in all_errors], axis=2)
+                for name in all_errors[0]
+            },
+        )
+
+    elif day_loop == 'while_loop':
+        error_names = ['buy_amount_error', 'sell_low_price_error', 'sell_high_price_error', 'buy_price_error', 'prediction_error']
+
+        def day_step(i, money, stocks, stock_prices, stocks_value, inner_state, account_values, errors):
+            with tf.name_scope('day'):
+                state = TradingState(money=money, stocks=stocks, stock_prices=stock_prices, stocks_value=stocks_value, inner_state=inner_state, company_mask=current_state.company_mask)
+                with tf.name_scope(f'historic_data'):
+                    historic_slice = historic_data[:, :, i:i+historic_window_size, :]
+                    historic_slice.set_shape([None, None, historic_window_size, None])
+                    log_historic_slice = None
+                    if log_historic_data is not None:
+                        log_historic_slice = log_historic_data[:, :, i:i+historic_window_size, :]
+                        log_historic_slice.set_shape([None, None, historic_window_size, None])
+                    indicator_slice = None if indicator_data is None else indicator_data[:, :, i+historic_window_size-1, :]
+                with tf.name_scope(f'future_data'):
+                    future_slice = historic_data[:, :, i+historic_window_size:i+historic_window_size+future_window_size, :]
+                    future_slice.set_shape([None, None, future_window_size, None])
+
+                next_state, day_errors = build_env_step(
+                    build_trader = build_trader,
+                    state = state,
+                    historic_data = historic_slice,
+                    future_data = future_slice,
+                    log_historic_data = log_historic_slice,
+                    indicators = indicator_slice,
+                    custom_gradients = custom_gradients
+                )
+                next_state = TradingState(**next_state)
+
+                return (
+                    i + 1,
+                    next_state.money,
+                    next_state.stocks,
+                    next_state.stock_prices,
+                    next_state.stocks_value,
+                    next_state.inner_state,
+                    account_values.write(i + 1, next_state.account_value),
+                    tuple(
+                        errors_array.write(i, day_errors[name])
+                        for name, errors_array in zip(error_names, errors)
+                    ),
+                )
+
+        _, money, stocks, stock_prices, stocks_value, inner_state, account_values, errors = tf.while_loop(
+            lambda i, *args: i < num_days,
+            day_step,
+            (
+                tf.constant(0),
+                current_state.money,
+                current_state.stocks,
+                current_state.stock_prices,
+                current_state.stocks_value,
+                current_state.inner_state,
+                tf.TensorArray(tf.float32, size=num_days+1).write(0, current_state.account_value),
+                tuple(tf.TensorArray(tf.float32, size=num_days) for name in error_names),
+            ),
+            name='days')
+
+        with tf.name_scope(f'state_{num_days}'):
+            final_state = TradingState(money=money, stocks=stocks, stock_prices=stock_prices, stocks_value=stocks_value, inner_state=inner_state, company_mask=current_state.company_mask)
+
+        def stack_days(errors_array):
+            # tensor[day, minibatch, company, ...] -> tensor[minibatch, company, day, ...]
+            errors = errors_array.stack()
+            return tf.transpose(errors, tf.concat([[1, 2, 0], tf.range(3, tf.rank(errors))], axis=0))
+
+        return dict(
+            initial_state = current_state,
+            final_state = final_state,
+            account_values = tf.transpose(account_values.stack()),
+            errors = {
+                name: stack_days(errors_array)
+                for name, errors_array in zip(error_names, errors)
+            },
+        )
+
+    else:
+        raise Exception("Expected day_loop to be 'unrolled' or 'while_loop'")
+
+def build_input_dataset(timeseries_length, minibatch_size, num_companies, num_parallel_calls, prefetch, shuffle_buffer=10000, num_features=NUM_FEATURES):
+    """
+    Builds a `tf.data` pipeline that samples minibatches like `stock_dataset.minibatch_producer`, but inside the TF runtime.
+
+    The OHLCV values and sampling index come from placeholders, that must be fed when the iterator is initialized (See `input_dataset_feed`)
+
+    Returns: (placeholders, dataset)
+    """
+    placeholders = dict(
+        ohlcv = tf.placeholder(tf.float32, shape=(None, None, num_features), name='ohlcv'),
+        dates = tf.placeholder(tf.int64, shape=(None,), name='dates'),
+        offsets = tf.placeholder(tf.int64, shape=(None,), name='offsets'),
+        symbol_indices = tf.placeholder(tf.int64, shape=(None,), name='symbol_indices'),
+    )
+
+    def sample_companies(i):
+        """
+        Samples `num_companies` windows ending at the i-th date of the index
+        """
+        samples = tf.random_uniform([num_companies], placeholders['offsets'][i], placeholders['offsets'][i+1], dtype=tf.int64)
+        symbols = tf.gather(placeholders['symbol_indices'], samples)
+        days = placeholders['dates'][i] + tf.range(timeseries_length, dtype=tf.int64)
+        windows = tf.gather(tf.gather(placeholders['ohlcv'], days), symbols, axis=1)
+        return tf.transpose(windows, [1, 0, 2])
+
+    dataset = tf.data.Dataset.range(tf.size(placeholders['dates'], out_type=tf.int64)) \
+        .shuffle(shuffle_buffer) \
+        .repeat() \
+        .map(sample_companies, num_parallel_calls=num_parallel_calls) \
+        .batch(minibatch_size, drop_remainder=True) \
+        .prefetch(prefetch)
+
+    return placeholders, dataset
+
+def input_dataset_feed(placeholders, producer, set):
+    """
+    Returns the feed_dict to initialize an iterator from `build_input_dataset` with the data of a `stock_dataset.minibatch_producer`
+    """
+    if producer.dense is None:
+        raise Exception("Expected a producer with a DenseTimeSeries (input_mode='dataset' can't sample from a UniverseStore)")
+    dates, offsets, symbol_indices = producer.sample_indices[set]
+    return {
+        placeholders['ohlcv']: producer.dense.all_features(),
+        placeholders['dates']: dates,
+        placeholders['offsets']: offsets,
+        placeholders['symbol_indices']: symbol_indices,
+    }
+
+def build_graph(warmup_days = 10, evaluated_days = 20, historic_window_size = 5, future_window_size = 5, money_settle_time = 3, check_numerics = False, input_mode = 'placeholder', minibatch_size = 100, test_minibatch_size = 500, num_companies = 10, input_parallelism = 4, input_prefetch = 4, day_loop = 'unrolled', precomputed_features = False, indicators = None, market_wide = False, custom_gradients = True) -> tf.Graph:
+    """
+    Builds the trading graph.
+
+    Input modes:
+    - 'placeholder': Minibatches are fed into `inputs/stock_history`
+    - 'dataset': Minibatches of `minibatch_size` (train) or `test_minibatch_size` (test) x `num_companies` are sampled by a `tf.data` pipeline.
+      `graph.input_iterators[set]` must be initialized with `input_dataset_feed(graph.input_placeholders[set], ...)`, and the string handle of one of them fed into `inputs/dataset/handle`.
+      Feeding `inputs/stock_history` directly still works.
+    With 'placeholder', `execute_trader` samples minibatches of the same sizes (`graph.minibatch_sizes[set]` x `graph.num_companies`).
+
+    day_loop: 'unrolled' or 'while_loop' (See `build_env`). `check_numerics` is only supported when unrolled.
+
+    precomputed_features: The minibatches have the LOG_FEATURES of `stock_dataset.log_features` after the raw features, and the trader input normalization uses them (See `build_trader`).
+    `graph.minibatch_producer` produces them.
+
+    indicators: An `indicators.IndicatorEngine` (Or a list of indicators). Their values on the last day of each historic window are extra inputs of the trader.
+    The minibatches have them after the other features, and `graph.minibatch_producer` produces them.
+
+    market_wide: The minibatches are whole markets (See `minibatch_producer(...).market`), with padding companies.
+    Their mask must be fed into `inputs/company_mask` (bool [minibatch, company]): Padding companies don't trade, and are left out of the account values and of the evaluation metrics.
+    Only supported with input_mode='placeholder'.
+
+    custom_gradients: The soft operations of the simulator only compute their soft functions on the backwards pass (See `softops`).
+    Unset, they are built with `softops.with_grad`, which computes them on the forward pass too. Both give the same values and gradients.
+    """
+    if check_numerics and day_loop != 'unrolled':
+        raise Exception("check_numerics requires day_loop='unrolled'")
+    if market_wide and input_mode != 'placeholder':
+        raise Exception("market_wide requires input_mode='placeholder'")
+
+    total_days = evaluated_days + warmup_days + historic_window_size + future_window_size - 1
+    if indicators is not None and not isinstance(indicators, IndicatorEngine):
+        indicators = IndicatorEngine(indicators)
+    num_log_features = NUM_LOG_FEATURES if precomputed_features else 0
+    num_indicators = 0 if indicators is None else len(indicators)
+    num_features = NUM_FEATURES + num_log_features + num_indicators
+
+    graph = tf.Graph()
+    # Set before `minibatch_size` and `num_companies` are shadowed by the shape of the input
+    graph.minibatch_sizes = {'train': minibatch_size, 'test': test_minibatch_size}
+    graph.num_companies = num_companies
+    with graph.as_default():
+        trainable_variables_node = tf.name_scope("trainable_parameters")
+        iteration = tf.Variable(0, name='iteration', dtype=tf.int32, expected_shape=())
+
+        with tf.name_scope("inputs"):
+            if input_mode == 'placeholder':
+                stock_history = tf.placeholder(tf.float32, shape=(None, None, total_days, num_features), name="stock_history")
+            elif input_mode == 'dataset':
+                with tf.name_scope("dataset"):
+                    graph.input_placeholders = {}
+                    graph.input_iterators = {}
+                    for set, set_minibatch_size in [('train', minibatch_size), ('test', test_minibatch_size)]:
+                        with tf.name_scope(set):
+                            graph.input_placeholders[set], dataset = build_input_dataset(total_days, set_minibatch_size, num_companies, input_parallelism, input_prefetch, num_features=num_features)
+                            graph.input_iterators[set] = dataset.make_initializable_iterator()
+
+                    handle = tf.placeholder(tf.string, shape=(), name='handle')
+                    iterator = tf.data.Iterator.from_string_handle(handle, dataset.output_types, tf.TensorShape([None, None, total_days, num_features]))
+                stock_history = tf.placeholder_with_default(iterator.get_next(), shape=(None, None, total_days, num_features), name="stock_history")
+            else:
+                raise Exception("Expected input_mode to be 'placeholder' or 'dataset'")
+
+            log_stock_history = None
+            indicator_history = None
+            if precomputed_features:
+                log_stock_history = tf.identity(stock_history[:, :, :, NUM_FEATURES:NUM_FEATURES+num_log_features], name='log_stock_history')
+            if indicators is not None:
+                indicator_history = tf.identity(stock_history[:, :, :, NUM_FEATURES+num_log_features:], name='indicator_history')
+            if num_features > NUM_FEATURES:
+                stock_history = tf.identity(stock_history[:, :, :, :NUM_FEATURES], name='raw_stock_history')
+
+            minibatch_size = tf.shape(stock_history)[0]
+            num_companies = tf.shape(stock_history)[1]
+            default_initial_stocks = tf.zeros([minibatch_size, num_companies], name = 'default_initial_stocks')
+            initial_stocks = tf.placeholder_with_default(default_initial_stocks, shape = (None, None), name = 'initial_stocks')
+
+            company_mask = None
+            if market_wide:
+                company_mask = tf.placeholder(tf.bool, shape = (None, None), name = 'company_mask')
+
+            initial_money_simple = tf.placeholder_with_default(100000., shape = (), name = 'initial_money_simple')
+            default_initial_money = tf.concat(
+                [
+                    initial_money_simple * tf.ones([minibatch_size, 1]),
+                    tf.zeros([minibatch_size, money_settle_time-1])
+                ],
+                axis = 1,
+                name = 'default_initial_money')
+            initial_money = tf.placeholder_with_default(default_initial_money, shape = (None, money_settle_time), name = 'initial_money')
+
+            with tf.name_scope("initial_state"):
+                initial_state = dict(
+                    money = initial_money,
+                    stocks = initial_stocks,
+                    stock_prices = stock_history[:, :, historic_window_size - 1, FEATURE_CLOSE],
+                    company_mask = None if company_mask is None else tf.cast(company_mask, tf.float32),
+                )
+
+        with tf.name_scope("trading"):
+            trajectory = build_env(trainable_variables_node, stock_history, initial_state, warmup_days + evaluated_days, historic_window_size, future_window_size, day_loop, log_stock_history, indicator_history, custom_gradients)
+            initial_account_value = trajectory['initial_state'].account_value
+            final_state = trajectory['final_state']
+            evaluated_errors = {
+                name: errors[:, :, warmup_days:]
+                for name, errors in trajectory['errors'].items()
+            }
+
+        with tf.name_scope("evaluation"):
+            def new_summary(values, clip=None, summaries=['mean'], family=None, per_company=False):
+                if per_company and company_mask is not None:
+                    # tensor[minibatch, company, ...] -> tensor[real company, ...]
+                    values = tf.boolean_mask(values, company_mask)
+                values = tf.identity(values, name='values')
+                values_clipped = values
+                if clip is not None:
+                    values_clipped = tf.clip_by_value(values, clip[0], clip[1], name='values_clipped')
+
+                with tf.name_scope('metrics'):
+                    mean, variance = tf.nn.moments(values, axes=None)
+                    mean = tf.identity(mean, name='mean')
+                    variance = tf.identity(variance, name='variance')
+                    stddev = tf.sqrt(variance, name='stddev')
+                    mean_sqr = tf.reduce_mean(values*values, name="mean_sqr")
+                    sqrt_mean_sqr = tf.sqrt(mean_sqr, name="sqrt_mean_sqr")
+                    mean_abs = tf.reduce_mean(tf.abs(values), name="mean_abs")
+                    min = tf.reduce_min(values, name="min")
+                    max = tf.reduce_max(values, name="max")
+
+                with tf.name_scope('summaries'):
+                    scalar_summaries = {
+                        'mean': mean,
+                        'mean_sqr': mean_sqr,
+                        'sqrt_mean_sqr': sqrt_mean_sqr,
+                        'mean_abs': mean_abs,
+                        'variance': variance,
+                        'stddev': stddev,
+                        'min': min,
+                        'max': max
+                    }
+                    for summary_name in summaries:
+                        tf.summary.scalar(summary_name, scalar_summaries[summary_name], family=family, collections=[tf.GraphKeys.SUMMARIES, SCALAR_SUMMARIES])
+                    tf.summary.histogram('values', values_clipped, family=family, collections=[tf.GraphKeys.SUMMARIES, HISTOGRAM_SUMMARIES])
+
+            with tf.name_scope("account_values"):
+                account_values = tf.identity(trajectory['account_values'][:, warmup_days:], name = 'values')
+
+            with tf.name_scope("daily_variation"):
+                daily_variation = log_perc.normalize(account_values[:, 1:], account_values[:, :-1])
+                new_summary(daily_variation, clip=(-5, +5))
+
+            with tf.name_scope("period_variation"):
+                period_variation = log_perc.normalize(account_values[:, -1], account_values[:, 0])
+                new_summary(period_variation, clip=(-100, +100))
+
+            with tf.name_scope("final_account_value"):
+                new_summary(final_state.account_value, clip=(0, 2*initial_account_value))
+
+            with tf.name_scope("final_money_value"):
+                new_summary(final_state.money_value, clip=(0, 2*initial_account_value))
+
+            with tf.name_scope("final_stocks_value"):
+                new_summary(final_state.stocks_value, clip=(0, 2*initial_account_value))
+
+            with tf.name_scope("buy_amount_error"):
+                new_summary(evaluated_errors['buy_amount_error'], clip=(-5, 5), summaries=['sqrt_mean_sqr'], family='price_error', per_company=True)
+
+            with tf.name_scope("sell_low_price_error"):
+                new_summary(evaluated_errors['sell_low_price_error'], clip=(-5, 5), summaries=['sqrt_mean_sqr'], family='price_error', per_company=True)
+
+            with tf.name_scope("sell_high_price_error"):
+                new_summary(evaluated_errors['sell_high_price_error'], clip=(-5, 5), summaries=['sqrt_mean_sqr'], family='price_error', per_company=True)
+
+            with tf.name_scope("buy_price_error"):
+                new_summary(evaluated_errors['buy_price_error'], clip=(-5, 5), summaries=['sqrt_mean_sqr'], family='price_error', per_company=True)
+
+            with tf.name_scope("all_price_errors"):
+                new_summary(tf.stack([
+                    evaluated_errors['buy_amount_error'],
+                    evaluated_errors['sell_low_price_error'],
+                    evaluated_errors['sell_high_price_error'],
+                    evaluated_errors['buy_price_error'],
+                ], axis=3), clip=(-5, 5), summaries=['sqrt_mean_sqr'], family='price_error', per_company=True)
+
+            with tf.name_scope("prediction_errors"):
+                new_summary(evaluated_errors['prediction_error'], clip=(-5, 5), summaries=['sqrt_mean_sqr'], family='prediction_errors', per_company=True)
+
+        if check_numerics:
+            tf.add_check_numerics_ops()
+
+        graph.input_mode = input_mode
+        graph.market_wide = market_wide
+        graph.historic_window_size = historic_window_size
+        graph.future_window_size = future_window_size
+        graph.minibatch_producer = functools.partial(
+            stock_dataset.minibatch_producer,
+            timeseries_length = warmup_days+evaluated_days+historic_window_size+future_window_size-1,
+            log_features = historic_window_size if precomputed_features else None,
+            indicators = indicators)
+
+    return graph
+
+def execute_trader(restore=None, stop_at=None, optimize_profit=False, optimize_price_error=False, optimize_prediction_error=False, learning_rate=0.05, graph_params={}, dataset_params={}, prefetch_params={}, profile=False, trace_every=None, scalar_summaries_every=10, histogram_summaries_every=100, test_every_secs=10, save_every_secs=30, keep_checkpoints=5, restore_from='latest', run_name=None, session_config=None, market_dates=1):
+    """
+    Builds the Stock Trader graph and executes the optimization loop
+
+    Arguments:
+    - restore: Continues the trainning of a previous run (The timestamp of its directory in `runs/`)
+    - restore_from: Checkpoint of the previous run to restore: 'latest' or 'best' (best test profit)
+    - stop_at: Stops when the global iteration counter reaches this value
+    - optimize_profit: Try to maximize the mean daily profit
+    - optimize_price_error: Minimize the difference between the order buy/sell prices and the min/max prices of the next day (A good starting point for profit optimization)
+    - optimize_prediction_error: Optimize the predicted open/close/low/high prices of the next few days. While it's not used anywhere per-se, it can be used to pre-train the deep networks used on the trader to extract relevant features.
+    - graph_params: Arguments to build_graph()
+    - dataset_params: Arguments to stock_dataset.minibatch_producer() (symbols, min_date, test_ratio, seed)
+    - prefetch_params: Arguments to prefetch.Prefetcher(), used for both the train and test minibatches (queue_size, num_workers, processes). Unused if graph_params has input_mode='dataset'
+    - profile: Measures the time spent on each phase of the training loop (input, run, summaries, checkpoint, test) and the training throughput.
+      They are printed and written as TensorBoard scalars (`phase_time/*`, `throughput/*`) every time the test set is evaluated.
+    - scalar_summaries_every, histogram_summaries_every: Train steps between scalar/histogram summaries. On the other steps, only the optimizer and the metrics printed are computed. (`None` disables them)
+      The test set evaluation always computes every summary.
+    - test_every_secs: Seconds between evaluations of the test set
+    - save_every_secs: Seconds between checkpoints. Checkpoints are written on a background thread (See `checkpoints.AsyncCheckpointer`).
+      The variables are also saved when the test set has the best profit so far.
+    - keep_checkpoints: Number of recent checkpoints kept, besides the best one
+    - run_name: Directory of this run in `runs/`, defaults to the current timestamp
+    - session_config: `tf.ConfigProto` of the session, e.g. to limit `intra_op_parallelism_threads` / `inter_op_parallelism_threads`
+    - market_dates: Dates of each train/test minibatch when graph_params has `market_wide=True`. Each date has every company of the set available on it.
+    - trace_every: Captures a full trace of a train step every `trace_every` steps, written to `{run_dir}/traces/step_{iteration}.json` (Chrome trace format) and to TensorBoard
+
+    Returns a dict with `run_dir`, the final `iteration`, the `test` metrics of the last test evaluation and the `best_test_profit`
+    """
+    print("Building graph...")
+    with build_graph(**graph_params).as_default():
+        print("Loading dataset")
+        next_minibatch = tf.get_default_graph().minibatch_producer(**dataset_params)
+        input_mode = tf.get_default_graph().input_mode
+        market_wide = tf.get_default_graph().market_wide
+
+        print("Creating directories")
+        if run_name is None:
+            run_name = datetime.utcnow().strftime("%Y-%m-%d-%H-%M-%S")
+        run_dir = os.path.abspath(f'runs/{run_name}')
+        tensorboard_run_dir_train = f'{run_dir}/train'
+        tensorboard_run_dir_test  = f'{run_dir}/test'
+        os.makedirs(os.path.dirname(tensorboard_run_dir_train), exist_ok=True)
+        os.makedirs(os.path.dirname(tensorboard_run_dir_test), exist_ok=True)
+
+        print("Files created")
+        input_stock_history = tf.get_default_graph().get_tensor_by_name('inputs/stock_history:0')
+        input_initial_money = tf.get_default_graph().get_tensor_by_name('inputs/initial_money_simple:0')
+
+        iteration = tf.get_default_graph().get_tensor_by_name('iteration:0')
+        iteration_inc = tf.assign_add(iteration, 1, name='iteration_increment')
+
+        evaluation_daily_profit_mean = tf.get_default_graph().get_tensor_by_name('evaluation/daily_variation/metrics/mean:0')
+        evaluation_daily_profit_stddev = tf.get_default_graph().get_tensor_by_name('evaluation/daily_variation/metrics/stddev:0')
+
+        evaluation_period_profit_mean = tf.get_default_graph().get_tensor_by_name('evaluation/period_variation/metrics/mean:0')
+        evaluation_period_profit_stddev = tf.get_default_graph().get_tensor_by_name('evaluation/period_variation/metrics/stddev:0')
+
+        evaluation_price_error = tf.get_default_graph().get_tensor_by_name('evaluation/all_price_errors/metrics/mean_sqr:0')
+        evaluation_price_error_pretty = tf.get_default_graph().get_tensor_by_name('evaluation/all_price_errors/metrics/sqrt_mean_sqr:0')
+
+        evaluation_prediction_error = tf.get_default_graph().get_tensor_by_name('evaluation/prediction_errors/metrics/mean_sqr:0')
+        evaluation_prediction_error_pretty = tf.get_default_graph().get_tensor_by_name('evaluation/prediction_errors/metrics/sqrt_mean_sqr:0')
+        print("Tensors accessed")
+
+        all_summaries = tf.summary.merge_all()
+        scalar_summaries = tf.summary.merge_all(SCALAR_SUMMARIES)
+        histogram_summaries = tf.summary.merge_all(HISTOGRAM_SUMMARIES)
+        print("Summaries created")
+
+        optimize_for = 0
+        if optimize_profit:
+            optimize_for += -evaluation_period_profit_mean
+        if optimize_price_error:
+            optimize_for += evaluation_price_error
+        if optimize_prediction_error:
+            optimize_for += evaluation_prediction_error
+
+        training_op = tf.train.AdagradOptimizer(learning_rate=learning_rate).minimize(optimize_for)
+        print("Optimizer created")
+
+        saver = tf.train.Saver()
+        print("Trainning Saver created")
+
+        timers = profiling.PhaseTimers(enabled=profile)
+        minibatch_size = tf.shape(input_stock_history)[0]
+
+        def train_summaries(it):
+            """
+            The summaries computed on the train step `it`
+            """
+            summaries = []
+            if scalar_summaries is not None and scalar_summaries_every and it % scalar_summaries_every == 0:
+                summaries.append(scalar_summaries)
+            if histogram_summaries is not None and histogram_summaries_every and it % histogram_summaries_every == 0:
+                summaries.append(histogram_summaries)
+            return summaries
+
+        last_iteration = 0
+        def run_iteration(train=False):
+            nonlocal last_iteration
+            # Only train steps are broken down in phases, test steps are timed as a whole by `test_and_save`
+            phase = timers.phase if train else lambda name: contextlib.nullcontext()
+            tf_ops = [
+                iteration_inc if train else iteration,
+                evaluation_daily_profit_mean,
+                evaluation_daily_profit_stddev,
+                evaluation_period_profit_mean,
+                evaluation_period_profit_stddev,
+                evaluation_price_error_pretty,
+                evaluation_prediction_error_pretty,
+            ]
+            extra_ops = {}
+            if train:
+                tf_ops.append(training_op)
+                summary_ops = train_summaries(last_iteration + 1)
+                if profile:
+                    extra_ops['minibatch_size'] = minibatch_size
+            else:
+                summary_ops = [all_summaries]
+
+            with phase('input'):
+                if input_mode == 'dataset':
+                    tf_params = {
+                        tf.get_default_graph().get_tensor_by_name('inputs/dataset/handle:0'): input_handles['train' if train else 'test'],
+                    }
+                elif market_wide:
+                    stock_history, company_mask = (train_minibatches if train else test_minibatches).get()
+                    tf_params = {
+                        tf.get_default_graph().get_tensor_by_name('inputs/stock_history:0'): stock_history,
+                        tf.get_default_graph().get_tensor_by_name('inputs/company_mask:0'): company_mask,
+                    }
+                else:
+                    tf_params = {
+                        tf.get_default_graph().get_tensor_by_name('inputs/stock_history:0'): (train_minibatches if train else test_minibatches).get(),
+                    }
+
+            run_options, run_metadata = tracer.options() if train else (None, None)
+            with phase('run'):
+                result, extra, summaries = session.run((tf_ops, extra_ops, summary_ops), feed_dict=tf_params, options=run_options, run_metadata=run_metadata)
+            it = last_iteration = result[0]
+            daily_profit_mean = result[1]
+            daily_profit_stddev = result[2]
+            period_profit_mean = result[3]
+            period_profit_stddev = result[4]
+            price_error = result[5]
+            prediction_error = result[6]
+
+            print(f'{"TRAIN" if train else "TEST"}: epoch [{it}] -- Profit: {daily_profit_mean:.2f}±{daily_profit_stddev:.2f} %/day or {period_profit_mean:.2f}±{period_profit_stddev:.2f} %/period, Order Price Error: {price_error:.2f}%, Overall prediction error: {prediction_error:.2f}%')
+            with phase('summaries'):
+                tensorboard_writer = tensorboard_writer_train if train else tensorboard_writer_test
+                for summary in summaries:
+                    tensorboard_writer.add_summary(summary, it)
+                if train:
+                    tracer.save(run_metadata, it)
+            if train:
+                timers.step(extra.get('minibatch_size', 0))
+
+            return it, dict(
+                daily_profit_mean = float(daily_profit_mean),
+                daily_profit_stddev = float(daily_profit_stddev),
+                period_profit_mean = float(period_profit_mean),
+                period_profit_stddev = float(period_profit_stddev),
+                price_error = float(price_error),
+                prediction_error = float(prediction_error),
+            )
+
+        with tf.summary.FileWriter(tensorboard_run_dir_train, tf.get_default_graph()) as tensorboard_writer_train:
+            with tf.summary.FileWriter(tensorboard_run_dir_test, tf.get_default_graph()) as tensorboard_writer_test:
+                print("Tensorboard Writers created")
+                tracer = profiling.Tracer(f'{run_dir}/traces', trace_every, tensorboard_writer_train)
+
+                if is_colab:
+                    display(tensorboard.Server.of('runs').badge())
+
+                with tf.Session(config=session_config) as session, contextlib.ExitStack() as exit_stack:
+                    print("Session Created")
+                    checkpointer = exit_stack.enter_context(checkpoints.AsyncCheckpointer(run_dir, keep=keep_checkpoints))
+
+                    tf.global_variables_initializer().run()
+                    print("Initializers executed")
+
+                    if input_mode == 'dataset':
+                        input_handles = {}
+                        for set, iterator in tf.get_default_graph().input_iterators.items():
+                            session.run(iterator.initializer, feed_dict=input_dataset_feed(tf.get_default_graph().input_placeholders[set], next_minibatch, set))
+                            input_handles[set] = session.run(iterator.string_handle())
+                        print("Input datasets initialized")
+                    elif market_wide:
+                        train_minibatches = exit_stack.enter_context(prefetch.Prefetcher(next_minibatch.market, set='train', num_dates=market_dates, **prefetch_params))
+                        test_minibatches = exit_stack.enter_context(prefetch.Prefetcher(next_minibatch.market, set='test', num_dates=market_dates, **prefetch_params))
+                    else:
+                        graph = tf.get_default_graph()
+                        train_minibatches = exit_stack.enter_context(prefetch.Prefetcher(next_minibatch, set='train', minibatch_size=graph.minibatch_sizes['train'], num_companies=graph.num_companies, **prefetch_params))
+                        test_minibatches = exit_stack.enter_context(prefetch.Prefetcher(next_minibatch, set='test', minibatch_size=graph.minibatch_sizes['test'], num_companies=graph.num_companies, **prefetch_params))
+
+                    # Continue a previous trainning session
+                    if restore is not None:
+                        restore_file = checkpoints.find_checkpoint(f'runs/{restore}', restore_from)
+                        try:
+                            saver.restore(session, restore_file)
+                        except:
+                            logging.warning(f'Failed to restore training state from {restore_file}')
+                            raise
+
+                    last_test_metrics = {}
+                    def test():
+                        with timers.phase('test'):
+                            it, test_metrics = run_iteration() # Run and log results on test set
+                        last_test_metrics.update(test_metrics)
+                        if checkpointer.is_best(test_metrics['period_profit_mean']):
+                            with timers.phase('checkpoint'):
+                                checkpointer.save(session, it, test_profit=test_metrics['period_profit_mean'])
+
+                        profile_summary = timers.summary()
+                        if profile_summary is not None:
+                            print(f'PROFILE: epoch [{it}] -- {timers}')
+                            tensorboard_writer_train.add_summary(profile_summary, it)
+
+                    def save():
+                        if checkpointer.last_step == last_iteration:
+                            return # Already saved by `test()`
+                        with timers.phase('checkpoint'):
+                            checkpointer.save(session, last_iteration)
+
+                    test()
+                    save()
+                    last_test = last_save = time.time()
+                    if optimize_profit or optimize_price_error or optimize_prediction_error:
+                        while True:
+                            if (time.time() - last_test) >= test_every_secs:
+                                last_test = time.time()
+                                test()
+                            if (time.time() - last_save) >= save_every_secs:
+                                last_save = time.time()
+                                save()
+
+                            it, _ = run_iteration(train=True)
+
+                            if stop_at is not None and it >= stop_at:
+                                test()
+                                save()
+                                break
+
+                    if input_mode != 'dataset':
+                        print(f'Train minibatches: {train_minibatches}')
+
+        return dict(
+            run_dir = run_dir,
+            iteration = int(last_iteration),
+            test = last_test_metrics,
+            best_test_profit = checkpointer.best_test_profit,
+        )